@@ -4,30 +4,44 @@ This script bypasses our Cloudflare worker and hits query1/2/3.finance.yahoo.com
 from a developer machine. It is archived because the production pipeline now
 relies on scripts/history.py (worker + Finnhub fallback). Use it only for
 one-off troubleshooting when you need to grab a payload manually.
-"""
-"""Quick Yahoo Finance fetcher for selected symbols.
 
 Usage:
-  python scripts/fetch_yahoo.py --symbols "^GSPC,^AEX" [--range 1y] [--interval 1d]
+  python scripts/fetch_yahoo.py --symbols "^GSPC,^AEX" [--range 1y] [--interval 1d] [--no-cache]
 
-Writes normalized daily closes into public/history/{SYMBOL}.json.
+Writes normalized daily closes into public/history/{SYMBOL}.json. Successful
+responses are cached under .cache/yahoo (6h for daily intervals, 5min for
+intraday) so reruns skip symbols fetched moments ago.
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import sys
+import threading
 import time
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date
 from pathlib import Path
-from typing import Iterable
+from typing import Iterator
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
 
 ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = ROOT / "public" / "history"
+CACHE_DIR = ROOT / ".cache" / "yahoo"
+# how long a cached chart stays fresh, by interval granularity (seconds)
+DAILY_CACHE_TTL = 6 * 3600
+INTRADAY_CACHE_TTL = 5 * 60
 USER_AGENT = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
@@ -37,8 +51,13 @@ Y_HOSTS: tuple[str, ...] = (
     "query2.finance.yahoo.com",
     "query3.finance.yahoo.com",
 )
+# Keep-alive pool sized for the worker threads: one pool per Yahoo host,
+# each able to hold a warm TLS connection per concurrent fetch.
+POOL_MAXSIZE = 16
 SESSION = requests.Session()
 SESSION.headers["User-Agent"] = USER_AGENT
+_ADAPTER = HTTPAdapter(pool_connections=len(Y_HOSTS), pool_maxsize=POOL_MAXSIZE)
+SESSION.mount("https://", _ADAPTER)
 
 
 def parse_args() -> argparse.Namespace:
@@ -54,32 +73,150 @@ def parse_args() -> argparse.Namespace:
         "--sleep",
         type=float,
         default=1.5,
-        help="Seconds to wait between symbols (default: 1.5)",
+        help="Minimum seconds between two requests to the same Yahoo host (default: 1.5)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of symbols fetched concurrently (default: 8)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached responses under .cache/yahoo and always refetch",
     )
     return parser.parse_args()
 
 
+class HostPacer:
+    """Rate limiter shared by the worker threads, keyed by Yahoo host.
+
+    A semaphore caps the in-flight requests per host and each request
+    reserves the next start slot, so two requests to the same host are
+    always at least `interval` seconds apart.
+    """
+
+    def __init__(self, interval: float, per_host: int = 2) -> None:
+        self.interval = max(interval, 0.0)
+        self.per_host = max(per_host, 1)
+        self._lock = threading.Lock()
+        self._slots: dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with sem:
+            with self._lock:
+                start = max(time.monotonic(), self._next_start.get(host, 0.0))
+                self._next_start[host] = start + self.interval
+            wait = start - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+
+def loads_json(raw: bytes | str):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps_json(obj) -> bytes:
+    """Serialize with a two-space indent, matching the files we commit."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+
+def cache_ttl_for(interval: str) -> float:
+    # Yahoo intraday intervals are minutes/hours (5m, 1h); the rest are days or longer
+    return INTRADAY_CACHE_TTL if interval.endswith(("m", "h")) else DAILY_CACHE_TTL
+
+
+def cache_path(symbol: str, rng: str, interval: str) -> Path:
+    key = hashlib.md5(f"{symbol}|{rng}|{interval}".encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.json"
+
+
+def read_cache(path: Path, ttl: float) -> list[dict[str, float | str]] | None:
+    try:
+        if time.time() - path.stat().st_mtime > ttl:
+            return None
+        data = loads_json(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, list) and data else None
+
+
+def write_cache(path: Path, series: list[dict[str, float | str]]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        raw = orjson.dumps(series) if orjson is not None else json.dumps(series).encode("utf-8")
+        path.write_bytes(raw)
+    except OSError as err:
+        print(f"[warn] could not write cache {path}: {err}")
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
 def iso_date(ts: int) -> str:
-    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d")
+    # UTC calendar day via integer arithmetic; avoids building an aware
+    # datetime and running strftime for every point
+    return date.fromordinal(_EPOCH_ORDINAL + int(ts) // 86400).isoformat()
 
 
-def fetch_symbol(symbol: str, rng: str, interval: str) -> list[dict[str, float | str]]:
+def clean_pairs(timestamps: list, closes: list) -> list[tuple[int, float]]:
+    """Return (timestamp, close) pairs sorted by time, without null points."""
+    if None not in timestamps and None not in closes:
+        # common case: no gaps, so convert both columns with C-level map()
+        return sorted(zip(map(int, timestamps), map(float, closes)))
+    return sorted(
+        (int(ts), float(close))
+        for ts, close in zip(timestamps, closes)
+        if ts is not None and close is not None
+    )
+
+
+def fetch_symbol(
+    symbol: str,
+    rng: str,
+    interval: str,
+    pacer: HostPacer | None = None,
+    offset: int = 0,
+    cache_ttl: float = 0.0,
+) -> list[dict[str, float | str]]:
+    cached_file = cache_path(symbol, rng, interval) if cache_ttl > 0 else None
+    if cached_file is not None:
+        cached = read_cache(cached_file, cache_ttl)
+        if cached is not None:
+            print(f"[cache] {symbol} hit {cached_file.name}")
+            return cached
     encoded = quote(symbol, safe="")
     params = {"range": rng, "interval": interval}
     last_err: Exception | None = None
-    for host in Y_HOSTS:
+    # rotate the starting host so concurrent symbols spread across hosts
+    start = offset % len(Y_HOSTS)
+    for host in Y_HOSTS[start:] + Y_HOSTS[:start]:
         url = f"https://{host}/v8/finance/chart/{encoded}"
         for attempt in range(1, 5):
             try:
                 print(f"[yahoo] {symbol} host={host} try#{attempt}")
-                res = SESSION.get(url, params=params, timeout=20)
-                if res.status_code == 429:
+                if pacer is not None:
+                    with pacer.slot(host):
+                        res = SESSION.get(url, params=params, timeout=20)
+                else:
+                    res = SESSION.get(url, params=params, timeout=20)
+                if res.status_code == requests.codes.too_many_requests:
                     wait = 1.5 * attempt + 0.75
                     print(f"[yahoo] {symbol} 429 -> wait {wait:.1f}s")
                     time.sleep(wait)
                     continue
                 res.raise_for_status()
-                data = res.json()
+                data = loads_json(res.content)
                 result = (data.get("chart") or {}).get("result") or []
                 if not result:
                     raise RuntimeError("empty result")
@@ -87,14 +224,15 @@ def fetch_symbol(symbol: str, rng: str, interval: str) -> list[dict[str, float |
                 timestamps = block.get("timestamp") or []
                 quote_block = ((block.get("indicators") or {}).get("quote") or [{}])[0]
                 closes = quote_block.get("close") or []
-                out: list[dict[str, float | str]] = []
-                for ts, close in zip(timestamps, closes):
-                    if ts is None or close is None:
-                        continue
-                    out.append({"date": iso_date(int(ts)), "close": float(close)})
+                # order on the integer timestamps, then format each point once
+                pairs = clean_pairs(timestamps, closes)
+                out: list[dict[str, float | str]] = [
+                    {"date": iso_date(ts), "close": close} for ts, close in pairs
+                ]
                 if not out:
                     raise RuntimeError("no closes returned")
-                out.sort(key=lambda x: x["date"])  # chronological
+                if cached_file is not None:
+                    write_cache(cached_file, out)
                 return out
             except Exception as err:  # pylint: disable=broad-except
                 last_err = err
@@ -105,11 +243,10 @@ def fetch_symbol(symbol: str, rng: str, interval: str) -> list[dict[str, float |
     raise RuntimeError(f"Yahoo fetch failed for {symbol}: {last_err}")
 
 
-def save_series(symbol: str, series: Iterable[dict[str, float | str]]) -> None:
+def save_series(symbol: str, series: list[dict[str, float | str]]) -> None:
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     out_path = OUT_DIR / f"{symbol}.json"
-    with out_path.open("w", encoding="utf-8") as handle:
-        json.dump(list(series), handle, indent=2)
+    out_path.write_bytes(dumps_json(series))
     print(f"[ok] wrote {out_path}")
 
 
@@ -120,15 +257,22 @@ def main() -> int:
         print("No symbols provided after parsing.", file=sys.stderr)
         return 1
 
-    for idx, symbol in enumerate(symbols, start=1):
-        try:
-            print(f"[fetch] ({idx}/{len(symbols)}) {symbol}")
-            series = fetch_symbol(symbol, args.range, args.interval)
-            save_series(symbol, series)
-        except Exception as err:  # pylint: disable=broad-except
-            print(f"[error] {symbol}: {err}", file=sys.stderr)
-        if idx < len(symbols) and args.sleep > 0:
-            time.sleep(args.sleep)
+    pacer = HostPacer(args.sleep)
+    cache_ttl = 0.0 if args.no_cache else cache_ttl_for(args.interval)
+    workers = max(1, min(args.workers, len(symbols), POOL_MAXSIZE))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_symbol, symbol, args.range, args.interval, pacer, idx, cache_ttl): symbol
+            for idx, symbol in enumerate(symbols)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            symbol = futures[future]
+            try:
+                series = future.result()
+                print(f"[fetch] ({done}/{len(symbols)}) {symbol}")
+                save_series(symbol, series)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"[error] {symbol}: {err}", file=sys.stderr)
     return 0
 
 
@@ -4,8 +4,6 @@ We keep this script in legacy because normal history refresh now goes through
 scripts/history.py and the Cloudflare worker. Use it only if you captured a
 chart payload (e.g. via browser devtools) and need to produce the simplified
 [{"date", "close"}] JSON locally.
-"""
-"""Convert raw Yahoo Finance chart payloads to our history format.
 
 Usage examples:
   python scripts/yahoo_payload_to_series.py --input raw_gspc.json
@@ -16,14 +14,29 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 import sys
-from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterable
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional; large payloads are then parsed in one go
+    ijson = None
+
 ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = ROOT / "public" / "history"
 RAW_PAYLOAD_DIR = ROOT / "scripts" / "yahoo_payloads"
+# payloads at least this big are streamed with ijson when it is installed
+STREAM_MIN_BYTES = 64 * 1024
 
 
 def parse_args() -> argparse.Namespace:
@@ -32,16 +45,101 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--dir", type=Path, help=f"Process every *.json file in this directory (default: {RAW_PAYLOAD_DIR})")
     parser.add_argument("--symbol", help="Override symbol (otherwise taken from payload)")
     parser.add_argument("--remove-raw", action="store_true", help="Delete source file after conversion")
-    parser.add_argument("--indent", type=int, default=2, help="Indent when writing JSON (default: 2)")
+    parser.add_argument(
+        "--indent",
+        type=int,
+        default=2,
+        help="Indent when writing JSON; 0 writes compact output (default: 2)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes used to convert payloads (default: CPU count)",
+    )
     return parser.parse_args()
 
 
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=1 << 16)
+def _day_iso(day: int) -> str:
+    return date.fromordinal(_EPOCH_ORDINAL + day).isoformat()
+
+
 def utc_date(ts: int) -> str:
-    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d")
+    # UTC calendar day via integer arithmetic; avoids building an aware
+    # datetime and running strftime for every point. Payloads converted by
+    # the same worker share most of their days, so the string is memoized.
+    return _day_iso(int(ts) // 86400)
+
+
+def clean_pairs(timestamps: list, closes: list) -> list[tuple[int, float]]:
+    """Return (timestamp, close) pairs sorted by time, without null points."""
+    if None not in timestamps and None not in closes:
+        # common case: no gaps, so convert both columns with C-level map()
+        return sorted(zip(map(int, timestamps), map(float, closes)))
+    return sorted(
+        (int(ts), float(close))
+        for ts, close in zip(timestamps, closes)
+        if ts is not None and close is not None
+    )
+
+
+def stream_chart_fields(path: Path) -> dict | None:
+    """Stream only the fields extract_series needs out of a large payload.
+
+    Walks the ijson event stream for the first chart result and keeps
+    meta.symbol, the timestamps and the first quote's closes; every other
+    array (open/high/low/volume, adjclose, ...) is skipped without being
+    materialized. Returns None for payloads that are not plain JSON (e.g.
+    the `var x = ...;` captures), which take the regular path.
+    """
+    with path.open("rb") as handle:
+        head = handle.read(64)
+        start = 3 if head.startswith(b"\xef\xbb\xbf") else 0
+        if not head[start:].lstrip().startswith(b"{"):
+            return None
+        handle.seek(start)
+
+        symbol = None
+        timestamps: list = []
+        closes: list = []
+        results = quotes = 0
+        for prefix, event, value in ijson.parse(handle, use_float=True):
+            if event == "start_map":
+                if prefix == "chart.result.item":
+                    results += 1
+                    if results > 1:
+                        break
+                elif prefix == "chart.result.item.indicators.quote.item":
+                    quotes += 1
+                continue
+            if prefix == "chart.result.item.timestamp.item":
+                timestamps.append(value)
+            elif prefix == "chart.result.item.indicators.quote.item.close.item":
+                if quotes == 1:
+                    closes.append(value)
+            elif prefix == "chart.result.item.meta.symbol" and symbol is None:
+                symbol = value
+
+    if not results:
+        return {"chart": {}}
+    block = {
+        "meta": {"symbol": symbol} if symbol else {},
+        "timestamp": timestamps,
+        "indicators": {"quote": [{"close": closes}]},
+    }
+    return {"chart": {"result": [block]}}
 
 
 def load_payload(path: Path) -> dict:
     try:
+        if ijson is not None and path.stat().st_size >= STREAM_MIN_BYTES:
+            streamed = stream_chart_fields(path)
+            if streamed is not None:
+                return streamed
         raw = path.read_bytes()
         if not raw.strip():
             raise RuntimeError('file empty')
@@ -54,6 +152,8 @@ def load_payload(path: Path) -> dict:
                     text = text[:-1].strip()
         if not text or text[0] not in '{[':
             raise RuntimeError('payload does not look like JSON: ' + text[:20])
+        if orjson is not None:
+            return orjson.loads(text)
         return json.loads(text)
     except Exception as exc:
         raise RuntimeError(f"failed to read {path}: {exc}") from exc
@@ -78,56 +178,89 @@ def extract_series(payload: dict, fallback_symbol: str | None = None) -> tuple[s
     if not timestamps or not closes:
         raise RuntimeError("payload missing timestamp/close arrays")
 
-    out: list[dict[str, float | str]] = []
-    for ts, close in zip(timestamps, closes):
-        if ts is None or close is None:
-            continue
-        out.append({"date": utc_date(int(ts)), "close": float(close)})
+    # order on the integer timestamps, then format each point once
+    pairs = clean_pairs(timestamps, closes)
+    day_iso = _day_iso
+    out: list[dict[str, float | str]] = [
+        {"date": day_iso(ts // 86400), "close": close} for ts, close in pairs
+    ]
 
     if not out:
         raise RuntimeError("no usable data points")
 
-    out.sort(key=lambda item: item["date"])
     return symbol, out
 
 
-def write_series(symbol: str, series: Iterable[dict[str, float | str]], indent: int) -> Path:
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+def write_series(symbol: str, series: list[dict[str, float | str]], indent: int) -> Path:
     out_path = OUT_DIR / f"{symbol}.json"
-    with out_path.open("w", encoding="utf-8") as handle:
-        json.dump(list(series), handle, indent=indent)
+    if orjson is not None and indent in (0, 2):
+        # orjson only supports a two-space indent; other widths use stdlib json
+        option = orjson.OPT_INDENT_2 if indent else 0
+        out_path.write_bytes(orjson.dumps(series, option=option))
+    else:
+        with out_path.open("w", encoding="utf-8") as handle:
+            json.dump(series, handle, indent=indent if indent > 0 else None)
     return out_path
 
 
+def convert_one(src: Path, symbol_override: str | None, indent: int, remove_raw: bool) -> tuple[Path, int]:
+    """Convert a single payload; runs inside a worker process."""
+    payload = load_payload(src)
+    symbol, series = extract_series(payload, fallback_symbol=symbol_override)
+    out_path = write_series(symbol, series, indent)
+    if remove_raw:
+        src.unlink(missing_ok=True)
+    return out_path, len(series)
+
+
+def list_payloads(directory: Path) -> list[Path]:
+    """Return the *.json files in `directory`, sorted by name.
+
+    os.scandir hands back cached DirEntry objects, so no extra stat is
+    issued per file the way Path.glob does.
+    """
+    with os.scandir(directory) as entries:
+        names = [
+            entry.name
+            for entry in entries
+            if entry.name.endswith(".json") and entry.is_file(follow_symlinks=False)
+        ]
+    names.sort()
+    return [directory / name for name in names]
+
+
 def iter_sources(args: argparse.Namespace) -> Iterable[Path]:
     if args.input:
         yield args.input
     if args.dir:
-        for path in sorted(Path(args.dir).glob("*.json")):
-            yield path
+        yield from list_payloads(Path(args.dir))
 
 
 def main() -> int:
     args = parse_args()
     sources = list(iter_sources(args))
     if not sources and RAW_PAYLOAD_DIR.exists():
-        sources = sorted(RAW_PAYLOAD_DIR.glob("*.json"))
+        sources = list_payloads(RAW_PAYLOAD_DIR)
     if not sources:
         print("No input provided. Use --input/--dir or drop files into scripts/yahoo_payloads.", file=sys.stderr)
         return 1
 
+    # create the output folder once, before any worker starts writing
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(args.workers, len(sources)))
     status = 0
-    for src in sources:
-        try:
-            payload = load_payload(src)
-            symbol, series = extract_series(payload, fallback_symbol=args.symbol)
-            out_path = write_series(symbol, series, args.indent)
-            print(f"[ok] {src.name} -> {out_path} ({len(series)} points)")
-            if args.remove_raw:
-                src.unlink(missing_ok=True)
-        except Exception as exc:
-            print(f"[error] {src}: {exc}", file=sys.stderr)
-            status = 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (src, pool.submit(convert_one, src, args.symbol, args.indent, args.remove_raw))
+            for src in sources
+        ]
+        for src, future in futures:
+            try:
+                out_path, points = future.result()
+                print(f"[ok] {src.name} -> {out_path} ({points} points)")
+            except Exception as exc:
+                print(f"[error] {src}: {exc}", file=sys.stderr)
+                status = 1
     return status
 
 
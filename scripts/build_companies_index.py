@@ -7,39 +7,71 @@ For each ticker in data/tickers.json:
 - Do not overwrite existing profiles (to avoid noisy commits)
 
 Writes public/companies/index.json listing basic info and relative paths
-to profile, logo (if present), and history.
+to profile, logo (if present), and history. A hash of the inputs is kept in
+.cache/companies_index.json so unchanged runs skip the rebuild entirely.
 """
 
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Set, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA = ROOT / "data"
 PUBLIC = ROOT / "public"
 COMP_DIR = PUBLIC / "companies"
 HIST_DIR = PUBLIC / "history"
+CACHE_FILE = ROOT / ".cache" / "companies_index.json"
+
+
+def read_json(path: Path) -> Any:
+    """Parse a JSON file from its raw bytes, tolerating a UTF-8 BOM."""
+    return parse_json(path.read_bytes())
+
 
+def parse_json(raw: bytes) -> Any:
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
-def load_tickers() -> List[Dict[str, Any]]:
-    p = DATA / "tickers.json"
-    with open(p, "r", encoding="utf-8") as f:
-        arr = json.load(f)
+
+def _text(value: Any) -> str:
+    # values are almost always strings already; only coerce the odd number
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = str(value)
+    return value.strip()
+
+
+def load_tickers(raw: bytes | None = None) -> List[Dict[str, Any]]:
+    arr = parse_json(raw) if raw is not None else read_json(DATA / "tickers.json")
     if not isinstance(arr, list):
         raise SystemExit("data/tickers.json must be a list")
     out: List[Dict[str, Any]] = []
+    append = out.append
     for it in arr:
         if not isinstance(it, dict):
             continue
-        sym = str(it.get("symbol", "")).strip().upper()
-        name = str(it.get("name", "")).strip()
-        sector = str(it.get("sector", "")).strip()
-        market = str(it.get("market", "")).strip().upper() or None
+        sym = _text(it.get("symbol")).upper()
         if not sym:
             continue
-        out.append({"symbol": sym, "name": name, "sector": sector, "market": market})
+        append({
+            "symbol": sym,
+            "name": _text(it.get("name")),
+            "sector": _text(it.get("sector")),
+            "market": _text(it.get("market")).upper() or None,
+        })
     return out
 
 
@@ -62,45 +94,96 @@ def load_existing_index() -> Dict[str, Any]:
     return mapping
 
 
+_BACKSLASH = str.maketrans({"\\": "/"})
+
+
 def normalize_logo_value(value: str | None) -> str | None:
     if not value:
         return None
-    norm = value.strip().replace('\\', '/')
+    norm = value.translate(_BACKSLASH).strip()
     if norm.startswith('public/'):
-        norm = norm[len('public/'): ]
+        norm = norm[7:]
     if norm.startswith('./'):
         norm = norm[2:]
     return norm or None
 
 
 
-def ensure_profile(sym: str, name: str, sector: str) -> None:
+def scan_company_dirs() -> Tuple[Set[str], Set[str], Set[str]]:
+    """Walk public/companies once.
+
+    Returns the company folder names, the folders that already hold a
+    profile.json and the folders that hold a logo.svg, so build_index can
+    answer membership questions without a stat call per symbol.
+    """
+    folders: Set[str] = set()
+    profiles: Set[str] = set()
+    logos: Set[str] = set()
+    if not COMP_DIR.is_dir():
+        return folders, profiles, logos
+    with os.scandir(COMP_DIR) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            folders.add(entry.name)
+            with os.scandir(entry.path) as files:
+                for f in files:
+                    if f.name == "profile.json":
+                        profiles.add(entry.name)
+                    elif f.name == "logo.svg":
+                        logos.add(entry.name)
+    return folders, profiles, logos
+
+
+def ensure_profile(
+    sym: str,
+    name: str,
+    sector: str,
+    folders: Set[str] | None = None,
+    profiles: Set[str] | None = None,
+) -> None:
+    """Create public/companies/{sym}/profile.json if missing.
+
+    `folders` and `profiles` come from scan_company_dirs(); when given, they
+    replace the mkdir/exists syscalls for companies that are already set up.
+    """
+    if profiles is not None and sym in profiles:
+        return
     d = COMP_DIR / sym
-    d.mkdir(parents=True, exist_ok=True)
+    if folders is None or sym not in folders:
+        d.mkdir(parents=True, exist_ok=True)
     prof = d / "profile.json"
-    if prof.exists():
+    if profiles is None and prof.exists():
         return
     with open(prof, "w", encoding="utf-8") as f:
         json.dump({"symbol": sym, "name": name, "sector": sector}, f, indent=2)
+    # keep the scan results current so the build cache key matches next run
+    if folders is not None:
+        folders.add(sym)
+    if profiles is not None:
+        profiles.add(sym)
 
 
-def build_index(rows: List[Dict[str, Any]]) -> None:
+def build_index(
+    rows: List[Dict[str, Any]],
+    scan: Tuple[Set[str], Set[str], Set[str]] | None = None,
+) -> None:
     COMP_DIR.mkdir(parents=True, exist_ok=True)
     existing = load_existing_index()
+    folders, profiles, logos = scan if scan is not None else scan_company_dirs()
     idx: List[Dict[str, Any]] = []
     for it in rows:
         sym = it["symbol"]
         name = it.get("name")
         sector = it.get("sector")
         market = it.get("market")
-        ensure_profile(sym, name, sector)
-        logo_rel = f"companies/{sym}/logo.svg"
-        logo_path = COMP_DIR / sym / "logo.svg"
+        ensure_profile(sym, name, sector, folders, profiles)
         existing_logo = normalize_logo_value(existing[sym].get("logo")) if sym in existing else None
         if existing_logo:
             logo_value = existing_logo
-        elif logo_path.exists():
-            logo_value = normalize_logo_value(logo_rel)
+        elif sym in logos:
+            # already in normalized form, no need to run it through the helper
+            logo_value = "companies/" + sym + "/logo.svg"
         else:
             logo_value = None
         idx.append({
@@ -112,14 +195,75 @@ def build_index(rows: List[Dict[str, Any]]) -> None:
             "history": f"history/{sym}.json",
             "market": market,
         })
-    with open(COMP_DIR / "index.json", "w", encoding="utf-8") as f:
-        json.dump(idx, f, indent=2)
-    print("[ok] wrote", COMP_DIR / "index.json", "entries=", len(idx))
+    write_index(idx)
+
+
+def write_index(idx: List[Dict[str, Any]]) -> None:
+    """Atomically replace index.json, leaving it untouched when nothing changed."""
+    final = COMP_DIR / "index.json"
+    # stdlib json keeps the escaped, spaced layout the committed file already uses
+    new_bytes = json.dumps(idx, indent=2).encode("utf-8")
+    try:
+        if final.read_bytes() == new_bytes:
+            print("[ok] unchanged", final, "entries=", len(idx))
+            return
+    except FileNotFoundError:
+        pass
+    tmp = final.with_name(final.name + ".tmp")
+    tmp.write_bytes(new_bytes)
+    os.replace(tmp, final)
+    print("[ok] wrote", final, "entries=", len(idx))
+
+
+def build_key(tickers_raw: bytes, scan: Tuple[Set[str], Set[str], Set[str]]) -> str:
+    """Hash every input of build_index apart from the current index itself."""
+    _folders, profiles, logos = scan
+    h = hashlib.blake2b(tickers_raw, digest_size=16)
+    for names in (profiles, logos):
+        h.update(b"\0")
+        h.update("\n".join(sorted(names)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def index_digest() -> str | None:
+    try:
+        raw = (COMP_DIR / "index.json").read_bytes()
+    except FileNotFoundError:
+        return None
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def cache_hit(key: str) -> bool:
+    """True when the inputs and the index on disk match the last build."""
+    try:
+        cached = read_json(CACHE_FILE)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return False
+    digest = cached.get("index")
+    return digest is not None and digest == index_digest()
+
+
+def save_cache(key: str) -> None:
+    try:
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        CACHE_FILE.write_text(json.dumps({"key": key, "index": index_digest()}), encoding="utf-8")
+    except OSError as err:
+        print("[warn] could not write", CACHE_FILE, err)
 
 
 def main():
-    rows = load_tickers()
-    build_index(rows)
+    tickers_raw = (DATA / "tickers.json").read_bytes()
+    scan = scan_company_dirs()
+    key = build_key(tickers_raw, scan)
+    if cache_hit(key):
+        print("[ok] up to date", COMP_DIR / "index.json", "(build cache hit)")
+        return
+    rows = load_tickers(tickers_raw)
+    build_index(rows, scan)
+    # build_index keeps `scan` in sync with the profiles it created
+    save_cache(build_key(tickers_raw, scan))
 
 
 if __name__ == "__main__":
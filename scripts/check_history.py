@@ -8,20 +8,38 @@ scripts/history.py (>= 1 year of data and last point <= 1 business day).
 from __future__ import annotations
 
 import json
+import mmap
+import re
 import sys
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
 from pathlib import Path
 from typing import Iterable
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 if str(SCRIPT_DIR) not in sys.path:
     sys.path.insert(0, str(SCRIPT_DIR))
 
-from history import DATA_TICKERS, MIN_YEARS, coverage_ok, load_existing  # type: ignore
+from history import DATA_TICKERS, MIN_YEARS, OUT_DIR, coverage_ok, load_existing  # type: ignore
+
+# history files are small and independent; threads overlap the reads
+MAX_WORKERS = 32
+# mirrors the minimum point count enforced by history.coverage_ok
+MIN_POINTS = 200
+DATE_KEY = b'"date"'
+ISO_DATE = re.compile(rb"\d{4}-\d{2}-\d{2}")
 
 
 def iter_symbols() -> Iterable[str]:
-    data = json.loads(DATA_TICKERS.read_text(encoding="utf-8-sig"))
+    raw = DATA_TICKERS.read_bytes()
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
     for entry in data:
         if not isinstance(entry, dict):
             continue
@@ -30,13 +48,66 @@ def iter_symbols() -> Iterable[str]:
             yield sym
 
 
+def previous_business_day(day: date) -> date:
+    day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def _date_at(mm: mmap.mmap, key_pos: int) -> str | None:
+    """Read the ISO date value following a `"date"` key at key_pos."""
+    if key_pos < 0:
+        return None
+    quote_pos = mm.find(b'"', key_pos + len(DATE_KEY))
+    if quote_pos < 0:
+        return None
+    value = mm[quote_pos + 1:quote_pos + 11]
+    return value.decode("ascii") if ISO_DATE.fullmatch(value) else None
+
+
+def quick_coverage_ok(symbol: str, cutoff: str, fresh_from: str) -> bool:
+    """Positive-only coverage check on the raw bytes of a history file.
+
+    history.py writes files sorted by date, so the first and last `"date"`
+    keys bound the series. Returns True only when the file clearly passes
+    (old enough first point, recent last point, >= MIN_POINTS entries);
+    any other outcome means "unknown" and the caller falls back to the
+    full parse in coverage_ok.
+    """
+    path = OUT_DIR / f"{symbol}.json"
+    try:
+        with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first = _date_at(mm, mm.find(DATE_KEY))
+            last = _date_at(mm, mm.rfind(DATE_KEY))
+            if first is None or last is None or first > last:
+                return False
+            if first > cutoff or last < fresh_from:
+                return False
+            pos = -1
+            for _ in range(MIN_POINTS):
+                pos = mm.find(DATE_KEY, pos + 1)
+                if pos < 0:
+                    return False
+            return True
+    except (OSError, ValueError):  # missing file, or empty file (mmap refuses length 0)
+        return False
+
+
 def main() -> int:
-    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * MIN_YEARS)).isoformat()
-    missing: list[str] = []
-    for symbol in sorted(set(iter_symbols())):
-        existing = load_existing(symbol)
-        if not coverage_ok(existing, cutoff):
-            missing.append(symbol)
+    today = datetime.now(timezone.utc).date()
+    cutoff = (today - timedelta(days=365 * MIN_YEARS)).isoformat()
+    # a last point on or after the previous business day is at most one
+    # business day old, which is what coverage_ok accepts
+    fresh_from = previous_business_day(today).isoformat()
+
+    def check(sym: str) -> bool:
+        return quick_coverage_ok(sym, cutoff, fresh_from) or coverage_ok(load_existing(sym), cutoff, today)
+
+    symbols = sorted(set(iter_symbols()))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        covered = list(pool.map(check, symbols))
+    missing = [sym for sym, ok in zip(symbols, covered) if not ok]
     if missing:
         print(",".join(missing))
     return 0
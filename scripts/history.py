@@ -14,36 +14,107 @@ YAHOO_WORKER_URL is configured.
 
 from __future__ import annotations
 
+import io
 import json
+import logging
+import multiprocessing
 import os
+import sys
+import threading
 import time
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple
 import pandas as pd
 import akshare as ak
-import csv
 import random
-import numpy as np
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limit import TokenBucket
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA_TICKERS = ROOT / "data" / "tickers.json"
 MIN_YEARS = 1  # ensure at least this coverage
+# symbols refreshed in parallel; every provider call is network-bound
+DEFAULT_CONCURRENCY = 8
+# serialization + disk writes are handed to this many threads
+WRITER_THREADS = 4
+# side pool used to race the free Yahoo sources against each other
+_RACE_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="history-race")
+RACE_HEDGE_DELAY = 3.0  # seconds the worker gets before direct Yahoo is started too
 
 SESSION = requests.Session()
 SESSION.headers["User-Agent"] = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 )
+# One keep-alive pool per provider host, large enough for the worker threads.
+# Transient 5xx are retried by urllib3; 429 is left to the rate limiters below.
+_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(500, 502, 503, 504),
+    raise_on_status=False,
+)
+_ADAPTER = HTTPAdapter(pool_connections=64, pool_maxsize=64, max_retries=_RETRY)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
+
+RATE_LIMITERS: Dict[str, TokenBucket] = {
+    "yahoo": TokenBucket(2, 2),
+    "finnhub": TokenBucket(0.5, 5),
+    "alpha": TokenBucket(5 / 60, 5),
+    "stooq": TokenBucket(1, 2),
+}
 
 
 OUT_DIR = ROOT / "public" / "history"
 
+# request/status lines are DEBUG; run with HISTORY_LOG=DEBUG to see them
+log = logging.getLogger("history")
+
+# (endpoint, params index) that last answered Alltick; tried first next time
+_ALLTICK_WORKING: Tuple[str, int] | None = None
+ALLTICK_PROBE_BUDGET = 30.0  # seconds spent probing endpoints per symbol
+
+
+def _loads(resp: requests.Response):
+    """Decode a JSON response body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
+def cutoff_for(years: int, today: date | None = None) -> str:
+    """ISO date `years` back from `today` (UTC today when not given)."""
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    return (today - timedelta(days=365 * years)).isoformat()
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def _day_iso(day: int) -> str:
+    return date.fromordinal(_EPOCH_ORDINAL + day).isoformat()
+
 
 def to_iso_utc(ts: int) -> str:
-    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d")
+    # keyed on the UTC day, so every candle of a given session shares one
+    # cached string; 4096 days covers the whole fetch window many times over
+    return _day_iso(int(ts) // 86400)
 
 
 def fetch_daily_finnhub(symbol: str, token: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
@@ -57,21 +128,20 @@ def fetch_daily_finnhub(symbol: str, token: str, years: int = MIN_YEARS) -> List
         "to": now,
         "token": token,
     }
-    print(f"[history] {symbol} GET {url} res=D from={start} to={now}")
+    log.debug("[history] %s GET %s res=D from=%s to=%s", symbol, url, start, now)
+    RATE_LIMITERS["finnhub"].acquire()
     r = SESSION.get(url, params=params, timeout=20)
-    print(f"[history] {symbol} status={r.status_code}")
+    log.debug("[history] %s status=%s", symbol, r.status_code)
     r.raise_for_status()
-    j = r.json()
+    j = _loads(r)
     if not isinstance(j, dict) or j.get("s") != "ok":
         raise RuntimeError(f"history fetch failed for {symbol}: {j}")
     closes = j.get("c") or []
     ts = j.get("t") or []
     if not closes or not ts or len(closes) != len(ts):
         raise RuntimeError(f"history payload invalid for {symbol}: lens c={len(closes)} t={len(ts)}")
-    out = [{"date": to_iso_utc(t), "close": float(c)} for t, c in zip(ts, closes)]
-    # ensure ascending order by date
-    out.sort(key=lambda x: x["date"])  # already ascending, but be safe
-    return out
+    # Finnhub candles are chronological; merge_history re-sorts if one ever is not
+    return [{"date": to_iso_utc(t), "close": float(c)} for t, c in zip(ts, closes)]
 
 
 def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
@@ -102,16 +172,16 @@ def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, fl
     if token:
         headers["X-Worker-Token"] = token
     query_desc = "&".join(f"{k}={v}" for k, v in params.items())
-    print(f"[history-worker] {symbol} GET {url}?{query_desc}")
+    log.debug("[history-worker] %s GET %s?%s", symbol, url, query_desc)
 
     r = SESSION.get(url, params=params, headers=headers, timeout=20)
-    print(f"[history-worker] {symbol} status={r.status_code}")
+    log.debug("[history-worker] %s status=%s", symbol, r.status_code)
     if r.status_code == 404:
         return []
     r.raise_for_status()
 
     try:
-        data = r.json()
+        data = _loads(r)
     except Exception as exc:
         raise RuntimeError(f"worker payload not JSON for {symbol}: {exc}") from exc
 
@@ -127,7 +197,7 @@ def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, fl
         if isinstance(date, str) and isinstance(close, (int, float)):
             out.append({"date": date, "close": float(close)})
 
-    out.sort(key=lambda x: x["date"])
+    # the worker relays Yahoo's chronological order; merge_history re-sorts if needed
     if not out:
         raise RuntimeError(f"worker payload empty for {symbol}")
     return out
@@ -135,7 +205,9 @@ def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, fl
 
 
 
-def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_alpha(
+    symbol: str, api_key: str, years: int = MIN_YEARS, cutoff: str | None = None
+) -> List[Dict[str, float]]:
     """Alpha Vantage TIME_SERIES_DAILY_ADJUSTED fallback.
 
     Free tier: 5 req/min, 500/day. We request 'full' then trim to last N years.
@@ -147,11 +219,12 @@ def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List
         "outputsize": "full",
         "apikey": api_key,
     }
-    print(f"[history-av] {symbol} GET {base} function={params['function']}")
+    log.debug("[history-av] %s GET %s function=%s", symbol, base, params["function"])
+    RATE_LIMITERS["alpha"].acquire()
     r = SESSION.get(base, params=params, timeout=30)
-    print(f"[history-av] {symbol} status={r.status_code}")
+    log.debug("[history-av] %s status=%s", symbol, r.status_code)
     r.raise_for_status()
-    j = r.json()
+    j = _loads(r)
     ts = j.get("Time Series (Daily)")
     if not isinstance(ts, dict):
         raise RuntimeError(f"alpha payload invalid for {symbol}: {list(j.keys())[:3]}")
@@ -165,12 +238,13 @@ def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List
     rows.sort(key=lambda x: x["date"])  # ascending
     # keep last N years only
     if rows:
-        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
+        if cutoff is None:
+            cutoff = cutoff_for(years)
         rows = [x for x in rows if x["date"] >= cutoff]
     return rows
 
 
-def fetch_daily_stooq(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_stooq(symbol: str, years: int = MIN_YEARS, cutoff: str | None = None) -> List[Dict[str, float]]:
     """Stooq CSV fallback (no key). US tickers via *.us.
 
     Returns all available, trimmed to last N years.
@@ -185,37 +259,44 @@ def fetch_daily_stooq(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, flo
     else:
         s = f"{sym}.us"
     url = f"https://stooq.com/q/d/l/?s={s}&i=d"
-    print(f"[history-stooq] {symbol} GET {url}")
+    log.debug("[history-stooq] %s GET %s", symbol, url)
+    RATE_LIMITERS["stooq"].acquire()
     r = SESSION.get(url, timeout=20)
-    print(f"[history-stooq] {symbol} status={r.status_code}")
+    log.debug("[history-stooq] %s status=%s", symbol, r.status_code)
     r.raise_for_status()
     txt = r.text.strip()
-    reader = csv.DictReader(txt.splitlines())
-    rows = []
-    for row in reader:
-        try:
-            d = row.get("Date") or row.get("date")
-            c = float(row.get("Close") or row.get("close"))
-            rows.append({"date": d, "close": c})
-        except Exception:
-            continue
-    rows.sort(key=lambda x: x["date"])
-    if rows:
-        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
-        rows = [x for x in rows if x["date"] >= cutoff]
-    return rows
+    if not txt:
+        return []
+    try:
+        # dates stay strings: the ISO text compares correctly and is what we store
+        df = pd.read_csv(io.StringIO(txt), dtype=str)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError):
+        return []
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    if "date" not in df.columns or "close" not in df.columns:
+        return []  # e.g. the plain-text "No data" reply
+    closes = pd.to_numeric(df["close"], errors="coerce")
+    dates = df["date"]
+    if cutoff is None:
+        cutoff = cutoff_for(years)
+    keep = closes.notna() & dates.notna() & (dates >= cutoff)
+    frame = pd.DataFrame({"date": dates[keep], "close": closes[keep].astype(float)})
+    return frame.sort_values("date", kind="stable").to_dict("records")
 
 
     
 
 
-def fetch_daily_alltick(symbol: str, api_key: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_alltick(
+    symbol: str, api_key: str, years: int = MIN_YEARS, cutoff: str | None = None
+) -> List[Dict[str, float]]:
     """Alltick daily history (CN) -- tries common kline endpoints, strips .SS.
 
     Note: Without official docs here, we attempt a reasonable default
     and parse common field shapes. If your endpoint differs, set
     ALLTICK_HISTORY_URL to override.
     """
+    global _ALLTICK_WORKING
     sym = symbol.split(".")[0]
     base_env = os.environ.get("ALLTICK_HISTORY_URL")
     candidates = [
@@ -227,98 +308,140 @@ def fetch_daily_alltick(symbol: str, api_key: str, years: int = MIN_YEARS) -> Li
         {"symbol": sym, "interval": "1day", "limit": 5000, "apikey": api_key},
         {"symbol": sym, "interval": "1d", "limit": 5000, "apikey": api_key},
     ]
-    for base in candidates:
-        if not base:
+    combos = [(base, i) for base in candidates if base for i in range(len(params))]
+    # once a combination has answered, start with it instead of re-probing
+    if _ALLTICK_WORKING in combos:
+        combos.remove(_ALLTICK_WORKING)
+        combos.insert(0, _ALLTICK_WORKING)
+    deadline = time.monotonic() + ALLTICK_PROBE_BUDGET
+    for base, i in combos:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            log.warning("[warn] %s alltick probe budget (%gs) exhausted", symbol, ALLTICK_PROBE_BUDGET)
+            break
+        p = params[i]
+        try:
+            log.debug("[history-alltick] %s GET %s params=%s", symbol, base, p)
+            r = SESSION.get(base, params=p, timeout=min(25.0, remaining))
+            log.debug("[history-alltick] %s status=%s", symbol, r.status_code)
+            r.raise_for_status()
+            out = _parse_alltick(_loads(r), years, cutoff)
+            if out is None:
+                continue
+            _ALLTICK_WORKING = (base, i)
+            return out
+        except Exception as e:
+            log.warning("[warn] %s alltick failed: %s", symbol, e)
+    return []
+
+
+def _parse_alltick(j, years: int, cutoff: str | None) -> List[Dict[str, float]] | None:
+    """Series from an Alltick reply, or None when the shape is not recognised."""
+    # Accept common shapes: {data:[...]}, directly list, or object
+    arr = None
+    if isinstance(j, list):
+        arr = j
+    elif isinstance(j, dict):
+        # try several keys
+        for k in ("data", "kline", "values", "result"):
+            v = j.get(k)
+            if isinstance(v, list):
+                arr = v
+                break
+    if not isinstance(arr, list):
+        return None
+    out: List[Dict[str, float]] = []
+    for it in arr:
+        if not isinstance(it, (list, dict)):
             continue
-        for p in params:
+        # Try dict first
+        dts = None
+        close = None
+        if isinstance(it, dict):
+            # common: t/time/datetime, c/close/last
+            dts = it.get("datetime") or it.get("time") or it.get("t") or it.get("date")
+            close = it.get("close") or it.get("c") or it.get("last") or it.get("price")
+        else:
+            # If list, assume [ts, open, high, low, close, ...]
             try:
-                print(f"[history-alltick] {symbol} GET {base} params={p}")
-                r = SESSION.get(base, params=p, timeout=25)
-                print(f"[history-alltick] {symbol} status={r.status_code}")
-                r.raise_for_status()
-                j = r.json()
-                # Accept common shapes: {data:[...]}, directly list, or object
-                arr = None
-                if isinstance(j, list):
-                    arr = j
-                elif isinstance(j, dict):
-                    # try several keys
-                    for k in ("data", "kline", "values", "result"):
-                        v = j.get(k)
-                        if isinstance(v, list):
-                            arr = v
-                            break
-                if not isinstance(arr, list):
-                    continue
-                out: List[Dict[str, float]] = []
-                for it in arr:
-                    if not isinstance(it, (list, dict)):
-                        continue
-                    # Try dict first
-                    dts = None
-                    close = None
-                    if isinstance(it, dict):
-                        # common: t/time/datetime, c/close/last
-                        dts = it.get("datetime") or it.get("time") or it.get("t") or it.get("date")
-                        close = it.get("close") or it.get("c") or it.get("last") or it.get("price")
-                    else:
-                        # If list, assume [ts, open, high, low, close, ...]
-                        try:
-                            ts_val = it[0]
-                            close = float(it[4])
-                            if isinstance(ts_val, (int, float)):
-                                dts = to_iso_utc(int(ts_val))
-                            else:
-                                dts = str(ts_val)
-                        except Exception:
-                            pass
-                    if close is None or dts is None:
-                        continue
-                    try:
-                        c = float(close)
-                    except Exception:
-                        continue
-                    # normalize date
-                    if isinstance(dts, str) and len(dts) >= 10 and dts[4] == "-":
-                        d = dts[:10]
-                    else:
-                        try:
-                            d = to_iso_utc(int(dts))[:10]
-                        except Exception:
-                            continue
-                    out.append({"date": d, "close": c})
-                out.sort(key=lambda x: x["date"])
-                if out:
-                    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
-                    out = [x for x in out if x["date"] >= cutoff]
-                return out
-            except Exception as e:
-                print(f"[warn] {symbol} alltick failed: {e}")
-    return []
+                ts_val = it[0]
+                close = float(it[4])
+                if isinstance(ts_val, (int, float)):
+                    dts = to_iso_utc(int(ts_val))
+                else:
+                    dts = str(ts_val)
+            except Exception:
+                pass
+        if close is None or dts is None:
+            continue
+        try:
+            c = float(close)
+        except Exception:
+            continue
+        # normalize date
+        if isinstance(dts, str) and len(dts) >= 10 and dts[4] == "-":
+            d = dts[:10]
+        else:
+            try:
+                d = to_iso_utc(int(dts))[:10]
+            except Exception:
+                continue
+        out.append({"date": d, "close": c})
+    out.sort(key=lambda x: x["date"])
+    if out:
+        if cutoff is None:
+            cutoff = cutoff_for(years)
+        out = [x for x in out if x["date"] >= cutoff]
+    return out
 
 
-def fetch_daily_yahoo(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
-    # Use Yahoo Chart API v8 for daily candles
+def provider_deadline() -> float:
+    """Seconds one provider may spend on a symbol (HISTORY_PROVIDER_DEADLINE)."""
+    try:
+        return float(os.environ.get("HISTORY_PROVIDER_DEADLINE") or 45)
+    except ValueError:
+        return 45.0
+
+
+def fetch_daily_yahoo(
+    symbol: str,
+    years: int = MIN_YEARS,
+    cancel: threading.Event | None = None,
+) -> List[Dict[str, float]]:
+    # Use Yahoo Chart API v8 for daily candles; once `cancel` is set (another
+    # source already answered) no further token is taken and no GET is sent
     rng = "1y" if years <= 1 else "2y"
     hosts = ["query1.finance.yahoo.com", "query2.finance.yahoo.com", "query3.finance.yahoo.com", "query2.finance.yahoo.com"]
     encoded = quote(symbol, safe='')
+    # bound the whole retry loop in time; a sticky 429 used to cost minutes
+    budget = provider_deadline()
+    deadline = time.monotonic() + budget
     for host in hosts:
         for attempt in range(1, 33):
+            if cancel is not None and cancel.is_set():
+                return []
+            if time.monotonic() >= deadline:
+                log.warning("[warn] %s yahoo gave up after %gs", symbol, budget)
+                return []
             query_host = host.replace('HOST', str(((attempt - 1) % len(hosts)) + 1)) if 'HOST' in host else host
             url = f"https://{query_host}/v8/finance/chart/{encoded}?range={rng}&interval=1d"
             try:
-                print(f"[history-yahoo] {symbol} try#{attempt} GET {url}")
-                r = SESSION.get(url, timeout=20)
-                print(f"[history-yahoo] {symbol} status={r.status_code}")
+                log.debug("[history-yahoo] %s try#%d GET %s", symbol, attempt, url)
+                # a cancel also cuts short the wait, including any 429 pause
+                if not RATE_LIMITERS["yahoo"].acquire(deadline, cancel):
+                    if cancel is None or not cancel.is_set():
+                        log.warning("[warn] %s yahoo gave up after %gs", symbol, budget)
+                    return []
+                # never let one slow socket outlive the symbol's budget
+                remaining = max(deadline - time.monotonic(), 0.1)
+                r = SESSION.get(url, timeout=min(20.0, remaining))
+                log.debug("[history-yahoo] %s status=%s", symbol, r.status_code)
                 if r.status_code == 429:
-                    sleep = min(15.0 * attempt, 60.0) + random.uniform(1.0, 3.0)
-                    time.sleep(sleep)
-                    continue
-                if r.status_code in {500, 502, 503, 504}:
-                    time.sleep(random.uniform(3.0, 6.0))
+                    # back the whole pool off, not just this thread
+                    RATE_LIMITERS["yahoo"].pause(min(15.0 * attempt, 60.0) + random.uniform(1.0, 3.0))
                     continue
                 r.raise_for_status()
-                j = r.json()
+                j = _loads(r)
                 res = (j.get("chart") or {}).get("result") or []
                 if not res:
                     break
@@ -331,13 +454,194 @@ def fetch_daily_yahoo(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, flo
                     if c is None:
                         continue
                     out.append({"date": to_iso_utc(int(t)), "close": float(c)})
-                out.sort(key=lambda x: x["date"])
-                return out
+                return out  # chronological, like every Yahoo chart payload
             except Exception as e:
-                print(f"[warn] {symbol} yahoo failed: {e}")
+                log.warning("[warn] %s yahoo failed: %s", symbol, e)
                 return []
 
 
+def is_fresh(sym: str, max_age_hours: float) -> bool:
+    """True when the symbol's file was rewritten less than `max_age_hours` ago."""
+    if max_age_hours <= 0:
+        return False
+    try:
+        age = time.time() - (OUT_DIR / f"{sym}.json").stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return age < max_age_hours * 3600
+
+
+SPARK_CHUNK = 20  # Yahoo rejects spark requests for more symbols than this
+
+
+def _spark_series(block: dict) -> List[Dict[str, float]]:
+    ts = block.get("timestamp") or []
+    closes = block.get("close")
+    if closes is None:
+        q = ((block.get("indicators") or {}).get("quote") or [{}])[0]
+        closes = q.get("close") or []
+    return [{"date": to_iso_utc(int(t)), "close": float(c)} for t, c in zip(ts, closes) if t is not None and c is not None]
+
+
+def fetch_daily_yahoo_batch(symbols: List[str], years: int = MIN_YEARS) -> Dict[str, List[Dict[str, float]]]:
+    """Daily closes for many symbols via Yahoo's multi-symbol spark endpoint.
+
+    One request covers up to SPARK_CHUNK symbols. Symbols missing from the
+    reply (or chunks that fail) are simply absent from the result and go
+    through the regular per-symbol providers.
+    """
+    rng = "1y" if years <= 1 else "2y"
+    hosts = ["query1.finance.yahoo.com", "query2.finance.yahoo.com"]
+    out: Dict[str, List[Dict[str, float]]] = {}
+    for i in range(0, len(symbols), SPARK_CHUNK):
+        chunk = symbols[i:i + SPARK_CHUNK]
+        params = {"symbols": ",".join(chunk), "range": rng, "interval": "1d"}
+        for attempt, host in enumerate(hosts * 2, start=1):
+            url = f"https://{host}/v7/finance/spark"
+            try:
+                log.debug("[history-spark] %d symbols try#%d GET %s", len(chunk), attempt, url)
+                RATE_LIMITERS["yahoo"].acquire()
+                r = SESSION.get(url, params=params, timeout=20)
+                log.debug("[history-spark] status=%s", r.status_code)
+                if r.status_code == 429:
+                    RATE_LIMITERS["yahoo"].pause(min(15.0 * attempt, 60.0) + random.uniform(1.0, 3.0))
+                    continue
+                r.raise_for_status()
+                j = _loads(r)
+            except Exception as e:
+                log.warning("[warn] spark chunk %s..%s failed: %s", chunk[0], chunk[-1], e)
+                continue
+            # two shapes in the wild: {spark: {result: [{symbol, response: [chart]}]}}
+            # and a flat {SYMBOL: {timestamp, close}} map
+            spark = j.get("spark") if isinstance(j, dict) else None
+            if isinstance(spark, dict):
+                blocks = {
+                    str(res.get("symbol")): (res.get("response") or [{}])[0]
+                    for res in spark.get("result") or []
+                    if isinstance(res, dict)
+                }
+            elif isinstance(j, dict):
+                blocks = {k: v for k, v in j.items() if isinstance(v, dict)}
+            else:
+                blocks = {}
+            for sym in chunk:
+                block = blocks.get(sym)
+                if isinstance(block, dict):
+                    series = _spark_series(block)
+                    if series:
+                        out[sym] = series
+            break
+    return out
+
+
+# (date, close) column names of akshare's A-share frames, resolved once
+_AK_COLS: Tuple[str, str] | None = None
+
+
+def akshare_columns(df: pd.DataFrame) -> Tuple[str, str] | None:
+    global _AK_COLS
+    columns = df.columns
+    if _AK_COLS is not None and _AK_COLS[0] in columns and _AK_COLS[1] in columns:
+        return _AK_COLS
+    date_key = '?-??oY' if '?-??oY' in columns else ('date' if 'date' in columns else None)
+    close_key = '?"?>~' if '?"?>~' in columns else ('close' if 'close' in columns else None)
+    if not date_key or not close_key:
+        return None
+    _AK_COLS = (date_key, close_key)
+    return _AK_COLS
+
+
+def fetch_daily_akshare(symbol: str, years: int = MIN_YEARS, today: date | None = None) -> List[Dict[str, float]]:
+    """A-share daily closes from akshare (Eastmoney); `symbol` like 600519.SS."""
+    code = symbol.split('.')[0]
+    end = today or datetime.now(timezone.utc).date()
+    start_date = (end - timedelta(days=365 * years + 7)).strftime('%Y%m%d')
+    df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start_date, end_date=end.strftime('%Y%m%d'), adjust="")
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return []
+    cols = akshare_columns(df)
+    if cols is None:
+        return []
+    date_key, close_key = cols
+    closes = df[close_key]
+    keep = closes.notna()
+    frame = pd.DataFrame({
+        "date": df[date_key][keep].astype(str).str[:10],
+        "close": closes[keep].astype(float),
+    })
+    # akshare rows come back oldest first
+    return frame.to_dict("records")
+
+
+_AK_POOL: ProcessPoolExecutor | None = None
+_AK_POOL_LOCK = threading.Lock()
+
+
+def akshare_pool() -> ProcessPoolExecutor:
+    """Process pool for akshare scrapes, created on the first CN symbol.
+
+    akshare's HTML parsing and DataFrame work hold the GIL, so several CN
+    symbols only really progress in parallel in separate processes. Workers
+    are spawned rather than forked since the parent already runs threads.
+    """
+    global _AK_POOL
+    with _AK_POOL_LOCK:
+        if _AK_POOL is None:
+            try:
+                workers = int(os.environ.get("HISTORY_AKSHARE_PROCS") or 4)
+            except ValueError:
+                workers = 4
+            _AK_POOL = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _AK_POOL
+
+
+def shutdown_akshare_pool() -> None:
+    global _AK_POOL
+    with _AK_POOL_LOCK:
+        if _AK_POOL is not None:
+            _AK_POOL.shutdown()
+            _AK_POOL = None
+
+
+# Fallback providers tried (in order) once the Yahoo sources came back empty.
+# Each entry takes (symbol, api keys, cutoff, today); a missing key means skip.
+PROVIDERS: Dict[str, Callable[[str, Dict[str, str | None], str, date], List[Dict[str, float]]]] = {
+    "finnhub": lambda sym, keys, cutoff, today: (
+        fetch_daily_finnhub(sym, keys["finnhub"], years=MIN_YEARS) if keys.get("finnhub") else []
+    ),
+    "akshare": lambda sym, keys, cutoff, today: (
+        akshare_pool().submit(fetch_daily_akshare, sym, MIN_YEARS, today).result()
+    ),
+    "alpha": lambda sym, keys, cutoff, today: (
+        fetch_daily_alpha(sym, keys["alpha"], years=MIN_YEARS, cutoff=cutoff) if keys.get("alpha") else []
+    ),
+    "stooq": lambda sym, keys, cutoff, today: fetch_daily_stooq(sym, years=MIN_YEARS, cutoff=cutoff),
+}
+# Markets with no coverage from the equity APIs get no fallback at all.
+MARKET_CHAINS: Dict[str, Tuple[str, ...]] = {
+    "CN": ("akshare",),
+    "CRYPTO": (),
+    "FX": (),
+    "COM": (),
+    "IDX": (),
+}
+DEFAULT_CHAIN: Tuple[str, ...] = ("finnhub", "alpha", "stooq")
+
+
+def provider_chain(sym: str, market: str) -> Tuple[str, ...]:
+    # Shanghai listings only exist on akshare, whatever market they are filed under
+    if sym.endswith('.SS'):
+        return MARKET_CHAINS["CN"]
+    chain = MARKET_CHAINS.get(market, DEFAULT_CHAIN)
+    # Stooq only serves US listings (bare or *.us symbols)
+    if "stooq" in chain and "." in sym and not sym.lower().endswith(".us"):
+        chain = tuple(name for name in chain if name != "stooq")
+    return chain
+
+
 def load_existing(sym: str) -> List[Dict[str, float]]:
     p = OUT_DIR / f"{sym}.json"
     if not p.exists():
@@ -348,34 +652,274 @@ def load_existing(sym: str) -> List[Dict[str, float]]:
         return []
 
 
-def coverage_ok(data: List[Dict[str, float]], min_from_date: str) -> bool:
+def business_gap(start: date, end: date) -> int:
+    """Weekdays in [start, end), i.e. what np.busday_count(start, end) returns."""
+    days = (end - start).days
+    if days <= 0:
+        return 0
+    full_weeks, rem = divmod(days, 7)
+    wd = start.weekday()
+    return full_weeks * 5 + sum(1 for i in range(rem) if (wd + i) % 7 < 5)
+
+
+def coverage_ok(data: List[Dict[str, float]], min_from_date: str, today: date | None = None) -> bool:
     if not data:
         return False
-    data.sort(key=lambda x: x["date"])  # ensure sorted
+    # files we write are ascending already; only sort one that is not
+    if any(a["date"] > b["date"] for a, b in zip(data, data[1:])):
+        data.sort(key=lambda x: x["date"])
     first = data[0]["date"]
     last = data[-1]["date"]
     # require >= 1 year of history and latest point not older than one business day
     try:
-        today = datetime.now(timezone.utc).date()
+        if today is None:
+            today = datetime.now(timezone.utc).date()
         last_d = datetime.fromisoformat(last).date()
-        business_gap = int(np.busday_count(last_d.isoformat(), today.isoformat()))
+        gap = business_gap(last_d, today)
     except Exception:
-        business_gap = 999
-    return len(data) >= 200 and first <= min_from_date and business_gap <= 1
+        gap = 999
+    return len(data) >= 200 and first <= min_from_date and gap <= 1
+
+
+def _points(arr: List[Dict[str, float]] | None) -> List[Tuple[str, float]]:
+    """Valid (date, close) pairs of `arr`, ordered by date (stable)."""
+    pts: List[Tuple[str, float]] = []
+    for it in arr or []:
+        d = it.get("date")
+        c = it.get("close")
+        if isinstance(d, str) and isinstance(c, (int, float)):
+            pts.append((d, float(c)))
+    # stored files and provider payloads are already ascending; only sort if not
+    if any(a[0] > b[0] for a, b in zip(pts, pts[1:])):
+        pts.sort(key=lambda p: p[0])
+    return pts
 
 
 def merge_history(old: List[Dict[str, float]], new: List[Dict[str, float]]) -> List[Dict[str, float]]:
-    m: Dict[str, float] = {}
-    for arr in (old, new):
-        for it in arr or []:
-            d = it.get("date")
-            c = it.get("close")
-            if isinstance(d, str) and isinstance(c, (int, float)):
-                m[d] = float(c)
-    out = [{"date": d, "close": m[d]} for d in sorted(m.keys())]
+    """Merge two series in one linear pass; `new` wins on duplicate dates."""
+    a = _points(old)
+    b = _points(new)
+    out: List[Dict[str, float]] = []
+    last = None
+
+    def emit(d: str, c: float) -> None:
+        nonlocal last
+        if d == last:
+            out[-1]["close"] = c  # later point for the same day replaces it
+        else:
+            out.append({"date": d, "close": c})
+            last = d
+
+    i = j = 0
+    while i < len(a) and j < len(b):
+        # on a tie the old point goes first so the new one overwrites it
+        if a[i][0] <= b[j][0]:
+            emit(*a[i])
+            i += 1
+        else:
+            emit(*b[j])
+            j += 1
+    for d, c in a[i:]:
+        emit(d, c)
+    for d, c in b[j:]:
+        emit(d, c)
     return out
 
 
+_INFLIGHT: Dict[Tuple[str, str, int], Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def run_once(key: Tuple[str, str, int], fetch: Callable[[], List[Dict[str, float]]]) -> List[Dict[str, float]]:
+    """Call `fetch` once per key for the whole run.
+
+    tickers.json can list a symbol twice; the second caller waits for (or
+    reuses) the first call's result instead of hitting the network again.
+    Errors are shared the same way.
+    """
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(key)
+        owner = fut is None
+        if owner:
+            fut = _INFLIGHT[key] = Future()
+    if not owner:
+        return fut.result()
+    try:
+        result = fetch()
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    fut.set_result(result)
+    return result
+
+
+def first_result(
+    sym: str,
+    attempts: List[Tuple[str, str, Callable[[threading.Event], List[Dict[str, float]]]]],
+    hedge_delay: float = RACE_HEDGE_DELAY,
+) -> Tuple[List[Dict[str, float]], str]:
+    """Run (label, source, fetch) attempts in order, hedging slow ones; first non-empty wins.
+
+    The next attempt starts once the running ones have all failed or come
+    back empty, or after `hedge_delay` seconds without an answer. Each fetch
+    gets a threading.Event that is set when the race is decided, so a loser
+    stops instead of spending the shared rate-limit budget.
+    """
+    cancel = threading.Event()
+    if len(attempts) == 1:
+        label, source, fetch = attempts[0]
+        try:
+            out = fetch(cancel)
+            return (out, source) if out else ([], "")
+        except Exception as e:
+            log.warning("[warn] %s %s failed: %s", sym, label, e)
+            return [], ""
+    queued = list(attempts)
+    running: Dict[Future, Tuple[str, str]] = {}
+    try:
+        while queued or running:
+            if queued:
+                label, source, fetch = queued.pop(0)
+                running[_RACE_POOL.submit(fetch, cancel)] = (label, source)
+            # a timeout, or only empty answers, lets the next attempt start
+            done, _ = wait(running, timeout=hedge_delay if queued else None, return_when=FIRST_COMPLETED)
+            for fut in done:
+                label, source = running.pop(fut)
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    log.warning("[warn] %s %s failed: %s", sym, label, e)
+                    continue
+                if out:
+                    return out, source
+    finally:
+        cancel.set()
+        for fut in running:
+            fut.cancel()
+    return [], ""
+
+
+def refresh_symbol(
+    sym: str,
+    market: str,
+    token: str | None,
+    av_key: str | None,
+    use_worker: bool,
+    fresh_hours: float = 0.0,
+    prefetched: List[Dict[str, float]] | None = None,
+    writer: ThreadPoolExecutor | None = None,
+    today: date | None = None,
+) -> None:
+    """Check one symbol's coverage and refetch/merge/write it when needed.
+
+    With a `writer` pool the file is written there, so the calling thread
+    can start on its next symbol straight away.
+    """
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    cutoff = cutoff_for(MIN_YEARS, today)
+    try:
+        if is_fresh(sym, fresh_hours):
+            log.info("[history] %s rewritten within %gh; skip", sym, fresh_hours)
+            return
+        existing = load_existing(sym)
+        if coverage_ok(existing, cutoff, today):
+            log.info("[history] %s already has >=1y coverage; skip fetch (len=%d)", sym, len(existing))
+            return
+        # the worker proxy and direct Yahoo serve the same data for free: the
+        # worker goes first and direct Yahoo only joins if it is slow or comes
+        # back empty; metered providers below are only tried if both do
+        if prefetched:
+            fresh, source = prefetched, "yahoo_spark"
+        else:
+            yahoo_attempts: List[Tuple[str, str, Callable[[threading.Event], List[Dict[str, float]]]]] = []
+            key = sym.upper()
+            if use_worker:
+                yahoo_attempts.append((
+                    "worker",
+                    "yahoo_worker",
+                    lambda cancel: run_once(("worker", key, MIN_YEARS), lambda: fetch_daily_worker(sym, years=MIN_YEARS)),
+                ))
+            yahoo_attempts.append((
+                "yahoo",
+                "yahoo",
+                lambda cancel: run_once(("yahoo", key, MIN_YEARS), lambda: fetch_daily_yahoo(sym, years=MIN_YEARS, cancel=cancel)),
+            ))
+            fresh, source = first_result(sym, yahoo_attempts)
+        if not fresh:
+            keys = {"finnhub": token, "alpha": av_key}
+            for name in provider_chain(sym, market):
+                try:
+                    fresh = PROVIDERS[name](sym, keys, cutoff, today)
+                except Exception as e:
+                    log.warning("[warn] %s %s failed: %s", sym, name, e)
+                    continue
+                if fresh:
+                    source = name
+                    break
+        if not fresh and not existing:
+            log.warning("[warn] %s no data from any provider; skip writing (keep absent)", sym)
+            return
+        merged = merge_history(existing, fresh)
+        out_path = OUT_DIR / f"{sym}.json"
+        if writer is not None:
+            writer.submit(write_history, out_path, merged, source)
+        else:
+            write_history(out_path, merged, source)
+    except Exception as e:
+        log.warning("[warn] %s history failed: %s", sym, e)
+
+
+def dump_series(series: List[Dict[str, float]]) -> bytes:
+    """Compact JSON bytes for a history file, the same with or without orjson.
+
+    The one exception is floats below 1e-4 (e.g. SHIB-USD closes), which the
+    stdlib writes in exponent form; both read back to the same value.
+    """
+    if orjson is not None:
+        return orjson.dumps(series)
+    return json.dumps(series, separators=(",", ":")).encode("utf-8")
+
+
+def write_history(out_path: Path, merged: List[Dict[str, float]], source: str) -> None:
+    try:
+        out_path.write_bytes(dump_series(merged))
+        log.info("[ok] wrote %s len=%d source=%s", out_path, len(merged), source or "existing")
+    except Exception as e:
+        log.warning("[warn] %s write failed: %s", out_path.stem, e)
+
+
+_TICKERS_CACHE: Tuple[float, List[Tuple[str, str]]] | None = None
+
+
+def load_tickers() -> List[Tuple[str, str]]:
+    """(symbol, MARKET) pairs from data/tickers.json.
+
+    The parsed list is kept per file mtime, so repeated calls within one
+    process do not re-read the catalogue.
+    """
+    global _TICKERS_CACHE
+    mtime = DATA_TICKERS.stat().st_mtime
+    if _TICKERS_CACHE is not None and _TICKERS_CACHE[0] == mtime:
+        return _TICKERS_CACHE[1]
+    raw = DATA_TICKERS.read_bytes()
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    arr = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    tickers: List[Tuple[str, str]] = []
+    if isinstance(arr, list):
+        for it in arr:
+            if not isinstance(it, dict):
+                continue
+            sym = str(it.get("symbol") or "").strip()
+            if not sym:
+                continue
+            market = str(it.get("market") or "").strip().upper()
+            tickers.append((sym, market))
+    _TICKERS_CACHE = (mtime, tickers)
+    return tickers
+
+
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(description="Fetch daily history JSON files")
@@ -385,6 +929,13 @@ def parse_args():
 
 
 def main():
+    # only our own logger: DEBUG should not switch on urllib3's chatter too
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.propagate = False
+    level = (os.environ.get("HISTORY_LOG") or "INFO").strip().upper()
+    log.setLevel(getattr(logging, level, logging.INFO))
     args = parse_args()
     symbol_filter: set[str] | None = None
     if args.symbols:
@@ -394,7 +945,7 @@ def main():
     token = os.environ.get("FINNHUB_API_KEY") or os.environ.get("FINNHUB_TOKEN")
     av_key = os.environ.get("ALPHAVANTAGE_API_KEY") or os.environ.get("ALPHAVANTAGE_TOKEN")
     if not token:
-        print("[warn] FINNHUB_API_KEY/FINNHUB_TOKEN not set or not authorized for candles; will try Alpha Vantage or Stooq")
+        log.warning("[warn] FINNHUB_API_KEY/FINNHUB_TOKEN not set or not authorized for candles; will try Alpha Vantage or Stooq")
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -402,17 +953,7 @@ def main():
     worker_first = (os.environ.get("HISTORY_WORKER_PRIORITY") or "").strip().lower() in {"1", "true", "yes"}
     symbol_delay = float(os.environ.get("HISTORY_SYMBOL_DELAY") or "1.5")
     try:
-        arr = json.loads(DATA_TICKERS.read_text(encoding="utf-8"))
-        tickers: list[tuple[str, str]] = []
-        if isinstance(arr, list):
-            for it in arr:
-                if not isinstance(it, dict):
-                    continue
-                sym = str(it.get("symbol") or "").strip()
-                if not sym:
-                    continue
-                market = str(it.get("market") or "").strip().upper()
-                tickers.append((sym, market))
+        tickers = list(load_tickers())
     except Exception:
         tickers = []
 
@@ -423,85 +964,53 @@ def main():
 
     total = len(tickers)
     if total == 0:
-        print('[history] no symbols to process')
+        log.info('[history] no symbols to process')
         return
     limit_total = min(total, max_count) if max_count else total
-    processed = 0
-    for sym, market in tickers:
-        if max_count is not None and processed >= max_count:
-            break
-        idx_display = processed + 1 if limit_total else processed + 1
-        print(f"[history] ({idx_display}/{limit_total or total}) {sym}")
-        try:
-            existing = load_existing(sym)
-            cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365)).isoformat()
-            if coverage_ok(existing, cutoff):
-                print(f"[history] {sym} already has >=1y coverage; skip fetch (len={len(existing)})")
-                continue
-            fresh: List[Dict[str, float]] = []
-            source = ""
-            if use_worker:
-                try:
-                    fresh = fetch_daily_worker(sym, years=MIN_YEARS)
-                    if fresh:
-                        source = "yahoo_worker"
-                except Exception as e:
-                    print(f"[warn] {sym} worker failed: {e}")
-            if not fresh:
-                try:
-                    fresh = fetch_daily_yahoo(sym, years=MIN_YEARS)
-                    if fresh and not source:
-                        source = "yahoo"
-                except Exception as e:
-                    print(f"[warn] {sym} yahoo failed: {e}")
-            if not fresh and token and market not in {"CRYPTO", "FX", "COM", "IDX"} and not sym.endswith('.SS'):
-                try:
-                    fresh = fetch_daily_finnhub(sym, token, years=MIN_YEARS)
-                    if fresh:
-                        source = "finnhub"
-                except Exception as e:
-                    print(f"[warn] {sym} finnhub failed: {e}")
-            if not fresh and (market == "CN" or sym.endswith('.SS')):
-                try:
-                    code = sym.split('.')[0]
-                    end = datetime.now(timezone.utc).date()
-                    start_date = (end - timedelta(days=365 * MIN_YEARS + 7)).strftime('%Y%m%d')
-                    df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start_date, end_date=end.strftime('%Y%m%d'), adjust="")
-                    if isinstance(df, pd.DataFrame) and not df.empty:
-                        date_key = '?-??oY' if '?-??oY' in df.columns else ('date' if 'date' in df.columns else None)
-                        close_key = '?"?>~' if '?"?>~' in df.columns else ('close' if 'close' in df.columns else None)
-                        if date_key and close_key:
-                            fresh = [{"date": str(d)[:10], "close": float(c)} for d, c in zip(df[date_key], df[close_key]) if pd.notna(c)]
-                            fresh.sort(key=lambda x: x['date'])
-                            source = "akshare"
-                except Exception as e:
-                    print(f"[warn] {sym} akshare failed: {e}")
-            if not fresh and av_key and market not in {"CRYPTO", "FX", "COM", "IDX"}:
-                try:
-                    fresh = fetch_daily_alpha(sym, av_key, years=MIN_YEARS)
-                    if fresh:
-                        source = "alpha"
-                except Exception as e:
-                    print(f"[warn] {sym} alpha failed: {e}")
-            if not fresh and market not in {"CRYPTO", "FX", "COM", "IDX"}:
-                try:
-                    fresh = fetch_daily_stooq(sym, years=MIN_YEARS)
-                    if fresh:
-                        source = "stooq"
-                except Exception as e:
-                    print(f"[warn] {sym} stooq failed: {e}")
-            if not fresh and not existing:
-                print(f"[warn] {sym} no data from any provider; skip writing (keep absent)")
-                continue
-            merged = merge_history(existing, fresh)
-            out_path = OUT_DIR / f"{sym}.json"
-            with open(out_path, "w") as f:
-                json.dump(merged, f)
-            print("[ok] wrote", out_path, f"len={len(merged)}", f"source={source or 'existing'}")
-        except Exception as e:
-            print(f"[warn] {sym} history failed: {e}")
-        finally:
-            processed += 1
+    if max_count is not None:
+        tickers = tickers[:max_count]
+    try:
+        concurrency = int(os.environ.get("HISTORY_CONCURRENCY") or DEFAULT_CONCURRENCY)
+    except ValueError:
+        concurrency = DEFAULT_CONCURRENCY
+    concurrency = max(1, min(concurrency, len(tickers)))
+    # opt-in: a git checkout resets every mtime, so this is for local reruns only
+    try:
+        fresh_hours = float(os.environ.get("HISTORY_FRESH_HOURS") or 0)
+    except ValueError:
+        fresh_hours = 0.0
+
+    # one clock read per run; every symbol is judged against the same day
+    today = datetime.now(timezone.utc).date()
+    prefetch: Dict[str, List[Dict[str, float]]] = {}
+    # spark goes to Yahoo directly, so with a worker configured it is opt-in
+    spark_default = "0" if use_worker else "1"
+    if (os.environ.get("HISTORY_YAHOO_SPARK") or spark_default).strip().lower() not in {"0", "false", "no"}:
+        prefetch = fetch_daily_yahoo_batch([sym for sym, _ in tickers], years=MIN_YEARS)
+        log.info("[history] spark prefetch returned %d/%d symbols", len(prefetch), len(tickers))
+
+    def run(job: tuple[int, tuple[str, str]]) -> None:
+        idx, (sym, market) = job
+        log.info("[history] (%d/%d) %s", idx, limit_total, sym)
+        refresh_symbol(
+            sym,
+            market,
+            token=token,
+            av_key=av_key,
+            use_worker=use_worker,
+            fresh_hours=fresh_hours,
+            prefetched=prefetch.get(sym),
+            writer=writer,
+            today=today,
+        )
+
+    # the writer pool is shut down last, so every queued write lands before exit
+    with ThreadPoolExecutor(max_workers=WRITER_THREADS) as writer, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # list() drains the iterator so any unexpected error surfaces here
+        list(pool.map(run, enumerate(tickers, start=1)))
+    shutdown_akshare_pool()
+
+
 if __name__ == "__main__":
     main()
 
@@ -12,17 +12,27 @@ from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from typing import Iterable
 
+import pandas as pd
 import yfinance as yf
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
 ROOT = Path(__file__).resolve().parents[1]
 DATA_TICKERS = ROOT / "data" / "tickers.json"
 OUT_DIR = ROOT / "public" / "history"
+BATCH_SIZE = 50  # symbols per yf.download call
 
 
 def load_symbols(selected: str | None) -> list[str]:
     if selected:
         return [s.strip() for s in selected.split(',') if s.strip()]
-    data = json.loads(DATA_TICKERS.read_text(encoding="utf-8-sig"))
+    raw = DATA_TICKERS.read_bytes()
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
     symbols: list[str] = []
     for entry in data:
         if not isinstance(entry, dict):
@@ -33,14 +43,66 @@ def load_symbols(selected: str | None) -> list[str]:
     return sorted(set(symbols))
 
 
-def fetch_series(symbol: str, years: int) -> list[dict[str, float]]:
+def period_for(years: int) -> str:
     period_years = max(int(years), 1)
-    period = "max" if period_years > 10 else f"{period_years}y"
-    df = yf.Ticker(symbol).history(period=period, interval="1d", auto_adjust=False)
+    return "max" if period_years > 10 else f"{period_years}y"
+
+
+def cutoff_for(years: int) -> str | None:
+    return (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat() if years > 0 else None
+
+
+def closes_to_series(closes: pd.Series, cutoff: str | None) -> list[dict[str, float]]:
+    closes = closes.dropna()
+    if closes.empty:
+        return []
+    dates = closes.index.strftime("%Y-%m-%d")
+    out = [{"date": d, "close": float(c)} for d, c in zip(dates, closes.tolist())]
+    out.sort(key=lambda item: item["date"])
+    if cutoff:
+        out = [item for item in out if item["date"] >= cutoff]
+    return out
+
+
+def fetch_batch(symbols: list[str], years: int) -> dict[str, list[dict[str, float]]]:
+    """Download a group of symbols in one yf.download call."""
+    df = yf.download(
+        tickers=symbols,
+        period=period_for(years),
+        interval="1d",
+        group_by="ticker",
+        auto_adjust=False,
+        threads=True,
+        progress=False,
+    )
+    if df is None or df.empty:
+        return {}
+    cutoff = cutoff_for(years)
+    out: dict[str, list[dict[str, float]]] = {}
+    multi = isinstance(df.columns, pd.MultiIndex)
+    for symbol in symbols:
+        if multi:
+            if symbol not in df.columns.get_level_values(0):
+                continue
+            sub = df[symbol]
+        elif len(symbols) == 1:
+            sub = df
+        else:
+            continue
+        if "Close" not in sub.columns:
+            continue
+        series = closes_to_series(sub["Close"], cutoff)
+        if series:
+            out[symbol] = series
+    return out
+
+
+def fetch_series(symbol: str, years: int) -> list[dict[str, float]]:
+    df = yf.Ticker(symbol).history(period=period_for(years), interval="1d", auto_adjust=False)
     if df.empty:
         return []
     df = df.dropna(subset=["Close"])
-    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat() if years > 0 else None
+    cutoff = cutoff_for(years)
     out: list[dict[str, float]] = []
     for index, close in df["Close"].items():
         try:
@@ -57,11 +119,29 @@ def fetch_series(symbol: str, years: int) -> list[dict[str, float]]:
 def save_series(symbol: str, series: Iterable[dict[str, float | str]]) -> Path:
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     out_path = OUT_DIR / f"{symbol}.json"
-    with out_path.open("w", encoding="utf-8") as handle:
-        json.dump(list(series), handle, indent=2)
+    data = series if isinstance(series, list) else list(series)
+    if orjson is not None:
+        out_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with out_path.open("w", encoding="utf-8") as handle:
+            json.dump(data, handle, indent=2)
     return out_path
 
 
+def process_symbol(idx: int, total: int, symbol: str, years: int, series: list[dict[str, float]] | None) -> None:
+    try:
+        if not series:
+            # missing from the batch download: retry it on its own
+            series = fetch_series(symbol, years)
+        if not series:
+            print(f"[warn] {symbol}: no data fetched")
+            return
+        out_path = save_series(symbol, series)
+        print(f"[ok] ({idx}/{total}) {symbol} -> {out_path} ({len(series)} points)")
+    except Exception as exc:  # pylint: disable=broad-except
+        print(f"[error] {symbol}: {exc}")
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Refresh history JSON locally using yfinance")
     parser.add_argument("--symbols", help="Comma separated list of symbols (default: all in data/tickers.json)")
@@ -75,16 +155,17 @@ def main() -> int:
     if not symbols:
         print("No symbols to process.")
         return 1
-    for idx, symbol in enumerate(symbols, start=1):
+    idx = 0
+    for start in range(0, len(symbols), BATCH_SIZE):
+        chunk = symbols[start:start + BATCH_SIZE]
         try:
-            series = fetch_series(symbol, args.years)
-            if not series:
-                print(f"[warn] {symbol}: no data fetched")
-                continue
-            out_path = save_series(symbol, series)
-            print(f"[ok] ({idx}/{len(symbols)}) {symbol} -> {out_path} ({len(series)} points)")
+            batch = fetch_batch(chunk, args.years)
         except Exception as exc:  # pylint: disable=broad-except
-            print(f"[error] {symbol}: {exc}")
+            print(f"[warn] batch {chunk[0]}..{chunk[-1]} failed: {exc}; fetching one by one")
+            batch = {}
+        for symbol in chunk:
+            idx += 1
+            process_symbol(idx, len(symbols), symbol, args.years, batch.get(symbol))
     return 0
 
 
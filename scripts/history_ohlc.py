@@ -7,7 +7,9 @@ already exists, it loads and checks coverage; if incomplete, it fetches
 the missing range (implemented by refetching the last 1y and merging),
 then writes to public/history_ohlc/{SYMBOL}.json as an array of
 {date: YYYY-MM-DD, open: number, high: number, low: number, close: number}
-sorted ascending.
+sorted ascending. With HISTORY_FORMAT=parquet a zstd Parquet copy of each
+file is also kept under .cache/history_ohlc and read in preference to the
+JSON (requires pyarrow).
 
 Requires FINNHUB_API_KEY (or FINNHUB_TOKEN) env var unless
 YAHOO_WORKER_URL is configured.
@@ -15,33 +17,233 @@ YAHOO_WORKER_URL is configured.
 
 from __future__ import annotations
 
+import gzip
+import hashlib
+import io
 import json
 import os
+import sys
+import threading
 import time
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple
 import math
 import pandas as pd
 import akshare as ak
-import csv
 import random
 import numpy as np
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limit import TokenBucket
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA_TICKERS = ROOT / "data" / "tickers.json"
+CACHE_DIR = ROOT / ".cache" / "history"
 MIN_YEARS = 1  # ensure at least this coverage
+# symbols refreshed in parallel; every provider call is network-bound
+DEFAULT_CONCURRENCY = 8
+# side pool used to fan one request out over several hosts/endpoints
+_RACE_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ohlc-race")
 
 SESSION = requests.Session()
 SESSION.headers["User-Agent"] = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 )
+# urllib3 retries throttling and transient 5xx with exponential backoff and
+# waits out any Retry-After the provider sends; the final response is
+# returned (not raised) so callers still see the status code.
+_RETRY = Retry(
+    total=6,
+    backoff_factor=1.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=("GET",),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# One keep-alive pool per provider host, sized for the symbol threads plus
+# the host fan-out, so warm TLS connections are reused instead of dropped.
+_ADAPTER = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=_RETRY)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
+YAHOO_HOSTS = ("query1.finance.yahoo.com", "query2.finance.yahoo.com", "query3.finance.yahoo.com")
+# Yahoo requests are hedged across hosts (see fetch_daily_yahoo), which caps
+# the attempts per symbol; they must not be retried again underneath.
+YAHOO_MAX_ATTEMPTS = 4
+YAHOO_HEDGE_DELAY = 0.5  # seconds before a slow attempt gets a hedge on the next host
+_YAHOO_ADAPTER = HTTPAdapter(pool_connections=len(YAHOO_HOSTS), pool_maxsize=64, max_retries=0)
+for _host in YAHOO_HOSTS:
+    SESSION.mount(f"https://{_host}/", _YAHOO_ADAPTER)
+
+
+RATE_LIMITERS: Dict[str, TokenBucket] = {
+    "yahoo": TokenBucket(2, 2),
+    "finnhub": TokenBucket(0.5, 5),
+    "alpha": TokenBucket(5 / 60, 5),
+    "stooq": TokenBucket(1, 2),
+}
+
+
+def cache_ttl() -> float:
+    """Seconds a cached provider response stays valid (HISTORY_CACHE_TTL, 0 disables)."""
+    try:
+        return float(os.environ.get("HISTORY_CACHE_TTL") or 6 * 3600)
+    except ValueError:
+        return 6 * 3600.0
+
+
+def cache_path(url: str, params: Dict[str, object] | None) -> Path:
+    key = url + "?" + "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+    return CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json.gz"
+
+
+def cached_response(url: str, params: Dict[str, object] | None, ttl: float) -> requests.Response | None:
+    """The on-disk copy of a 200 body for this request if younger than `ttl` seconds."""
+    if ttl <= 0:
+        return None
+    path = cache_path(url, params)
+    try:
+        if time.time() - path.stat().st_mtime <= ttl:
+            resp = requests.Response()
+            resp._content = gzip.decompress(path.read_bytes())
+            resp.status_code = 200
+            resp.encoding = "utf-8"
+            resp.url = url
+            print(f"[history-cache] hit {url}")
+            return resp
+    except (OSError, EOFError):
+        pass
+    return None
+
+
+def cached_get(
+    url: str,
+    params: Dict[str, object] | None = None,
+    headers: Dict[str, str] | None = None,
+    timeout: float = 20,
+    limiter: str | None = None,
+    ttl: float | None = None,
+) -> requests.Response:
+    """SESSION.get with a gzip'd on-disk copy of every 200 body.
+
+    A hit skips the network (and the provider's rate limiter) entirely, so
+    re-runs within the TTL cost no requests.
+    """
+    if ttl is None:
+        ttl = cache_ttl()
+    hit = cached_response(url, params, ttl)
+    if hit is not None:
+        return hit
+    if limiter:
+        RATE_LIMITERS[limiter].acquire()
+    r = SESSION.get(url, params=params, headers=headers, timeout=timeout)
+    if ttl > 0 and r.status_code == 200:
+        path = cache_path(url, params)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(gzip.compress(r.content, compresslevel=5))
+            os.replace(tmp, path)
+        except OSError as err:
+            print(f"[warn] could not write cache {path}: {err}")
+    return r
+
+
+def _env(name: str) -> str:
+    return (os.environ.get(name) or "").strip()
+
+
+@dataclass(frozen=True)
+class Cfg:
+    """Every environment setting history_ohlc reads, resolved once per run."""
+
+    worker_url: str = ""
+    worker_token: str = ""
+    worker_range: str = ""
+    worker_first: bool = False
+    finnhub_token: str | None = None
+    av_key: str | None = None
+    alltick_url: str | None = None
+    symbol_delay: float = 1.5
+    cache_ttl: float = 6 * 3600.0
+    concurrency: int = DEFAULT_CONCURRENCY
+    history_format: str = "json"
+
+    @property
+    def use_worker(self) -> bool:
+        return bool(self.worker_url)
+
+    @classmethod
+    def from_env(cls) -> "Cfg":
+        try:
+            concurrency = int(os.environ.get("HISTORY_CONCURRENCY") or DEFAULT_CONCURRENCY)
+        except ValueError:
+            concurrency = DEFAULT_CONCURRENCY
+        return cls(
+            worker_url=_env("YAHOO_WORKER_URL"),
+            worker_token=_env("YAHOO_WORKER_TOKEN"),
+            worker_range=_env("YAHOO_WORKER_RANGE"),
+            worker_first=_env("HISTORY_WORKER_PRIORITY").lower() in {"1", "true", "yes"},
+            finnhub_token=os.environ.get("FINNHUB_API_KEY") or os.environ.get("FINNHUB_TOKEN"),
+            av_key=os.environ.get("ALPHAVANTAGE_API_KEY") or os.environ.get("ALPHAVANTAGE_TOKEN"),
+            alltick_url=os.environ.get("ALLTICK_HISTORY_URL"),
+            symbol_delay=float(os.environ.get("HISTORY_SYMBOL_DELAY") or "1.5"),
+            cache_ttl=cache_ttl(),
+            concurrency=max(1, concurrency),
+            history_format=history_format(),
+        )
 
 
 OUT_DIR = ROOT / "public" / "history_ohlc"
+# markets the equity-only providers (Finnhub, Alpha Vantage, Stooq) cannot serve
+NON_EQUITY_MARKETS = frozenset({"CRYPTO", "FX", "COM", "IDX"})
+# the site only reads the JSON files; Parquet is a faster local read mirror
+PARQUET_DIR = ROOT / ".cache" / "history_ohlc"
+OHLC_COLUMNS = ["date", "open", "high", "low", "close"]
+
+
+def cutoff_for(years: int, today: date | None = None) -> str:
+    """ISO date `years` back from `today` (UTC today when not given)."""
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    return (today - timedelta(days=365 * years)).isoformat()
+
+
+def _loads(resp: requests.Response):
+    """Decode a JSON response body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
+def parse_json(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dump_series(series: List[Dict[str, float]]) -> bytes:
+    """Compact JSON bytes for a history file, the same with or without orjson.
+
+    The one exception is floats below 1e-4 (e.g. SHIB-USD closes), which the
+    stdlib writes in exponent form; both read back to the same value.
+    """
+    if orjson is not None:
+        return orjson.dumps(series)
+    return json.dumps(series, separators=(",", ":")).encode("utf-8")
 
 
 def to_iso_utc(ts: int) -> str:
@@ -77,11 +279,67 @@ def build_candle(date: str, open_val, high_val, low_val, close_val):
     low_f = min(low_f, open_f, close_f)
     if low_f > high_f:
         low_f, high_f = high_f, low_f
-    return {"date": date, "open": open_f, "high": high_f, "low": low_f, "close": close_f}
+    # every symbol shares the same few hundred trading days, so one string per date
+    return {"date": sys.intern(date), "open": open_f, "high": high_f, "low": low_f, "close": close_f}
 
 
-def fetch_daily_finnhub(symbol: str, token: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
-    now = int(time.time())
+def _float_column(values, n: int) -> np.ndarray:
+    """`values` as a float64 array of length n; missing/non-finite -> NaN."""
+    col = np.full(n, np.nan)
+    values = list(values[:n])
+    try:
+        arr = np.array(values, dtype=np.float64)  # None becomes NaN
+    except (TypeError, ValueError):
+        arr = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+    col[: len(arr)] = arr
+    col[~np.isfinite(col)] = np.nan
+    return col
+
+
+def _ohlc_arrays(open_, high, low, close) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """build_candle()'s fill/clamp rules over float64 columns (NaN = missing).
+
+    Returns (keep, open, high, low, close); `keep` masks out rows without a close.
+    """
+    keep = ~np.isnan(close)
+    open_ = np.where(np.isnan(open_), close, open_)
+    # fmax/fmin ignore NaN, so a missing high/low falls back to max/min(open, close)
+    high = np.fmax(high, np.maximum(open_, close))
+    low = np.fmin(low, np.minimum(open_, close))
+    return keep, open_[keep], high[keep], low[keep], close[keep]
+
+
+def candles_from_columns(ts, opens, highs, lows, closes) -> List[Dict[str, float]]:
+    """build_candle() over column-oriented payloads (Finnhub, Yahoo chart), vectorized.
+
+    Columns shorter than `ts` are padded with missing values, exactly as the
+    per-index loop did.
+    """
+    n = len(ts)
+    if not n:
+        return []
+    keep, open_, high, low, close = _ohlc_arrays(
+        _float_column(opens, n),
+        _float_column(highs, n),
+        _float_column(lows, n),
+        _float_column(closes, n),
+    )
+    days = (np.asarray(ts, dtype=np.int64)[keep] // 86400).astype("datetime64[D]").astype(str)
+    return [
+        {"date": d, "open": o, "high": h, "low": l, "close": c}
+        for d, o, h, l, c in zip(
+            map(sys.intern, days.tolist()), open_.tolist(), high.tolist(), low.tolist(), close.tolist()
+        )
+    ]
+
+
+def fetch_daily_finnhub(
+    symbol: str, token: str, years: int = MIN_YEARS, cfg: Cfg | None = None
+) -> List[Dict[str, float]]:
+    cfg = cfg or Cfg.from_env()
+    # next UTC midnight rather than the current second, so from/to (and with
+    # them the cache key) stay the same for the whole day
+    now = (int(time.time()) // 86400 + 1) * 86400
     start = now - int(365 * 24 * 3600 * years)
     url = "https://finnhub.io/api/v1/stock/candle"
     params = {
@@ -92,10 +350,10 @@ def fetch_daily_finnhub(symbol: str, token: str, years: int = MIN_YEARS) -> List
         "token": token,
     }
     print(f"[history] {symbol} GET {url} res=D from={start} to={now}")
-    r = SESSION.get(url, params=params, timeout=20)
+    r = cached_get(url, params=params, timeout=20, limiter="finnhub", ttl=cfg.cache_ttl)
     print(f"[history] {symbol} status={r.status_code}")
     r.raise_for_status()
-    j = r.json()
+    j = _loads(r)
     if not isinstance(j, dict) or j.get("s") != "ok":
         raise RuntimeError(f"history fetch failed for {symbol}: {j}")
     opens = j.get("o") or []
@@ -107,38 +365,27 @@ def fetch_daily_finnhub(symbol: str, token: str, years: int = MIN_YEARS) -> List
         raise RuntimeError(
             f"history payload invalid for {symbol}: lens c={len(closes)} t={len(ts)}"
         )
-    def pick(arr, idx):
-        return arr[idx] if idx < len(arr) else None
-
-    out = []
-    for idx, t in enumerate(ts):
-        candle = build_candle(
-            to_iso_utc(t),
-            pick(opens, idx),
-            pick(highs, idx),
-            pick(lows, idx),
-            pick(closes, idx),
-        )
-        if candle:
-            out.append(candle)
+    out = candles_from_columns(ts, opens, highs, lows, closes)
     out.sort(key=lambda x: x["date"])
     return out
 
 
+@lru_cache(maxsize=None)
 def map_symbol_for_market(symbol: str, market: str) -> str:
     if market.upper() in {"FX", "FOREX"} and not symbol.endswith("=X"):
         return f"{symbol}=X"
     return symbol
 
 
-def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_worker(symbol: str, years: int = MIN_YEARS, cfg: Cfg | None = None) -> List[Dict[str, float]]:
     """Fetch daily candles via Cloudflare Yahoo proxy if configured."""
 
-    base_url = (os.environ.get("YAHOO_WORKER_URL") or "").strip()
+    cfg = cfg or Cfg.from_env()
+    base_url = cfg.worker_url
     if not base_url:
         return []
 
-    range_env = (os.environ.get("YAHOO_WORKER_RANGE") or "").strip()
+    range_env = cfg.worker_range
     if range_env:
         range_value = range_env
     elif years <= 1:
@@ -155,20 +402,20 @@ def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, fl
     url = f"{base_url.rstrip('/')}/history/{encoded}"
 
     headers: Dict[str, str] = {}
-    token = (os.environ.get("YAHOO_WORKER_TOKEN") or "").strip()
+    token = cfg.worker_token
     if token:
         headers["X-Worker-Token"] = token
     query_desc = "&".join(f"{k}={v}" for k, v in params.items())
     print(f"[history-worker] {symbol} GET {url}?{query_desc}")
 
-    r = SESSION.get(url, params=params, headers=headers, timeout=20)
+    r = cached_get(url, params=params, headers=headers, timeout=20, ttl=cfg.cache_ttl)
     print(f"[history-worker] {symbol} status={r.status_code}")
     if r.status_code == 404:
         return []
     r.raise_for_status()
 
     try:
-        data = r.json()
+        data = _loads(r)
     except Exception as exc:
         raise RuntimeError(f"worker payload not JSON for {symbol}: {exc}") from exc
 
@@ -206,11 +453,63 @@ def fetch_daily_worker(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, fl
 
 
 
-def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_akshare(symbol: str, years: int = MIN_YEARS, today: date | None = None) -> List[Dict[str, float]]:
+    """A-share daily OHLC from akshare (Eastmoney); `symbol` like 600519.SS."""
+    code = symbol.split('.')[0]
+    end = today or datetime.now(timezone.utc).date()
+    start_date = (end - timedelta(days=365 * years + 7)).strftime('%Y%m%d')
+    df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start_date, end_date=end.strftime('%Y%m%d'), adjust="")
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return []
+    cols_map = {str(col).strip().lower(): col for col in df.columns}
+
+    def pick_col(*aliases):
+        for alias in aliases:
+            key = str(alias).strip().lower()
+            if key in cols_map:
+                return df[cols_map[key]]
+        return None
+
+    def numeric(col) -> np.ndarray:
+        if col is None:
+            return np.full(len(df), np.nan)
+        arr = pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64)
+        return np.where(np.isfinite(arr), arr, np.nan)
+
+    date_col = pick_col('date', '交易日期')
+    if date_col is None:
+        date_col = df.iloc[:, 0]
+    close_col = pick_col('close', '收盘', '收盘价')
+    if close_col is None:
+        if df.shape[1] <= 3:
+            return []
+        close_col = df.iloc[:, 3]
+    keep, open_, high, low, close = _ohlc_arrays(
+        numeric(pick_col('open', '开盘', '开盘价')),
+        numeric(pick_col('high', '最高', '最高价')),
+        numeric(pick_col('low', '最低', '最低价')),
+        numeric(close_col),
+    )
+    frame = pd.DataFrame({
+        "date": [sys.intern(d) for d in date_col.astype(str).str[:10].to_numpy()[keep]],
+        "open": open_,
+        "high": high,
+        "low": low,
+        "close": close,
+    })
+    rows = frame.to_dict("records")
+    rows.sort(key=lambda x: x['date'])
+    return rows
+
+
+def fetch_daily_alpha(
+    symbol: str, api_key: str, years: int = MIN_YEARS, cutoff: str | None = None, cfg: Cfg | None = None
+) -> List[Dict[str, float]]:
     """Alpha Vantage TIME_SERIES_DAILY_ADJUSTED fallback.
 
     Free tier: 5 req/min, 500/day. We request 'full' then trim to last N years.
     """
+    cfg = cfg or Cfg.from_env()
     base = "https://www.alphavantage.co/query"
     params = {
         "function": "TIME_SERIES_DAILY_ADJUSTED",
@@ -219,10 +518,10 @@ def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List
         "apikey": api_key,
     }
     print(f"[history-av] {symbol} GET {base} function={params['function']}")
-    r = SESSION.get(base, params=params, timeout=30)
+    r = cached_get(base, params=params, timeout=30, limiter="alpha", ttl=cfg.cache_ttl)
     print(f"[history-av] {symbol} status={r.status_code}")
     r.raise_for_status()
-    j = r.json()
+    j = _loads(r)
     ts = j.get("Time Series (Daily)")
     if not isinstance(ts, dict):
         raise RuntimeError(f"alpha payload invalid for {symbol}: {list(j.keys())[:3]}")
@@ -242,16 +541,20 @@ def fetch_daily_alpha(symbol: str, api_key: str, years: int = MIN_YEARS) -> List
     rows.sort(key=lambda x: x["date"])  # ascending
     # keep last N years only
     if rows:
-        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
+        if cutoff is None:
+            cutoff = cutoff_for(years)
         rows = [x for x in rows if x["date"] >= cutoff]
     return rows
 
 
-def fetch_daily_stooq(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_stooq(
+    symbol: str, years: int = MIN_YEARS, cutoff: str | None = None, cfg: Cfg | None = None
+) -> List[Dict[str, float]]:
     """Stooq CSV fallback (no key). US tickers via *.us.
 
     Returns all available, trimmed to last N years.
     """
+    cfg = cfg or Cfg.from_env()
     sym = symbol.lower()
     # Stooq supports .us suffix for US tickers; not Shanghai/Shenzhen
     if "." in sym:
@@ -263,42 +566,121 @@ def fetch_daily_stooq(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, flo
         s = f"{sym}.us"
     url = f"https://stooq.com/q/d/l/?s={s}&i=d"
     print(f"[history-stooq] {symbol} GET {url}")
-    r = SESSION.get(url, timeout=20)
+    r = cached_get(url, timeout=20, limiter="stooq", ttl=cfg.cache_ttl)
     print(f"[history-stooq] {symbol} status={r.status_code}")
     r.raise_for_status()
     txt = r.text.strip()
-    reader = csv.DictReader(txt.splitlines())
-    rows = []
-    for row in reader:
-        d = row.get("Date") or row.get("date")
-        candle = build_candle(
-            d,
-            row.get("Open") or row.get("open"),
-            row.get("High") or row.get("high"),
-            row.get("Low") or row.get("low"),
-            row.get("Close") or row.get("close"),
-        )
-        if candle:
-            rows.append(candle)
-    rows.sort(key=lambda x: x["date"])
-    if rows:
-        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
-        rows = [x for x in rows if x["date"] >= cutoff]
-    return rows
+    if not txt:
+        return []
+    try:
+        # dates stay strings: the ISO text compares correctly and is what we store
+        df = pd.read_csv(io.StringIO(txt), dtype=str)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError):
+        return []
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    if "date" not in df.columns or "close" not in df.columns:
+        return []  # e.g. the plain-text "No data" reply
+
+    def numeric(name: str) -> np.ndarray:
+        if name not in df.columns:
+            return np.full(len(df), np.nan)
+        arr = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=np.float64)
+        return np.where(np.isfinite(arr), arr, np.nan)
+
+    if cutoff is None:
+        cutoff = cutoff_for(years)
+    dates = df["date"]
+    in_range = (dates.notna() & (dates >= cutoff)).to_numpy()
+    keep, open_, high, low, close = _ohlc_arrays(numeric("open"), numeric("high"), numeric("low"), numeric("close"))
+    frame = pd.DataFrame({"date": dates.to_numpy()[keep], "open": open_, "high": high, "low": low, "close": close})
+    frame = frame[in_range[keep]]
+    return frame.sort_values("date", kind="stable").to_dict("records")
 
 
     
 
 
-def fetch_daily_alltick(symbol: str, api_key: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def first_result(symbol: str, attempts: List[Tuple[str, Callable[[], List[Dict[str, float]]]]]) -> List[Dict[str, float]]:
+    """Run (label, fetch) attempts concurrently; the first non-empty result wins.
+
+    Slower attempts still finish in the background, their results are dropped.
+    """
+    futures = {_RACE_POOL.submit(fetch): label for label, fetch in attempts}
+    try:
+        for fut in as_completed(futures):
+            try:
+                out = fut.result()
+            except Exception as e:
+                print(f"[warn] {symbol} {futures[fut]} failed: {e}")
+                continue
+            if out:
+                return out
+    finally:
+        for fut in futures:
+            fut.cancel()
+    return []
+
+
+def hedged_first(
+    symbol: str,
+    attempts: List[Tuple[str, Callable[[threading.Event], List[Dict[str, float]]]]],
+    hedge_delay: float,
+    limiter: str | None = None,
+) -> List[Dict[str, float]]:
+    """Hedged requests: start the next attempt once the running ones have had
+    `hedge_delay` seconds (or straight away when one fails); the first
+    non-empty result wins and the attempts not yet started are dropped.
+
+    With `limiter`, the token for each attempt is taken here before it is
+    started, so time queued on the bucket does not count towards the delay.
+    Every fetch gets a threading.Event that is set once the race is decided.
+    """
+    queue = list(attempts)
+    labels: Dict[Future, str] = {}
+    pending: set[Future] = set()
+    cancel = threading.Event()
+    settled = threading.Event()  # a running attempt finished; stop waiting for a token
+    try:
+        while queue or pending:
+            if queue:
+                settled.clear()
+                # look at a finished attempt before spending a token on the next one
+                if not any(fut.done() for fut in pending) and (
+                    limiter is None or RATE_LIMITERS[limiter].acquire(cancel=settled)
+                ):
+                    label, fetch = queue.pop(0)
+                    fut = _RACE_POOL.submit(fetch, cancel)
+                    fut.add_done_callback(lambda _fut: settled.set())
+                    labels[fut] = label
+                    pending.add(fut)
+            done, pending = wait(pending, timeout=hedge_delay if queue else None, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    print(f"[warn] {symbol} {labels[fut]} failed: {e}")
+                    continue
+                if out:
+                    return out
+    finally:
+        cancel.set()
+        for fut in pending:
+            fut.cancel()
+    return []
+
+
+def fetch_daily_alltick(
+    symbol: str, api_key: str, years: int = MIN_YEARS, cutoff: str | None = None, cfg: Cfg | None = None
+) -> List[Dict[str, float]]:
     """Alltick daily history (CN) -- tries common kline endpoints, strips .SS.
 
     Note: Without official docs here, we attempt a reasonable default
     and parse common field shapes. If your endpoint differs, set
     ALLTICK_HISTORY_URL to override.
     """
+    cfg = cfg or Cfg.from_env()
     sym = symbol.split(".")[0]
-    base_env = os.environ.get("ALLTICK_HISTORY_URL")
+    base_env = cfg.alltick_url
     candidates = [
         base_env,
         "https://api.alltick.co/market/kline",
@@ -308,156 +690,220 @@ def fetch_daily_alltick(symbol: str, api_key: str, years: int = MIN_YEARS) -> Li
         {"symbol": sym, "interval": "1day", "limit": 5000, "apikey": api_key},
         {"symbol": sym, "interval": "1d", "limit": 5000, "apikey": api_key},
     ]
-    for base in candidates:
-        if not base:
+    # every endpoint/param combination is probed at once instead of in turn
+    attempts = [
+        ("alltick", partial(_alltick_once, symbol, base, p, years, cutoff, cfg.cache_ttl))
+        for base in candidates
+        if base
+        for p in params
+    ]
+    return first_result(symbol, attempts)
+
+
+def _alltick_once(
+    symbol: str, base: str, p: Dict[str, object], years: int, cutoff: str | None = None, ttl: float | None = None
+) -> List[Dict[str, float]]:
+    print(f"[history-alltick] {symbol} GET {base} params={p}")
+    r = cached_get(base, params=p, timeout=25, ttl=ttl)
+    print(f"[history-alltick] {symbol} status={r.status_code}")
+    r.raise_for_status()
+    j = _loads(r)
+    # Accept common shapes: {data:[...]}, directly list, or object
+    arr = None
+    if isinstance(j, list):
+        arr = j
+    elif isinstance(j, dict):
+        # try several keys
+        for k in ("data", "kline", "values", "result"):
+            v = j.get(k)
+            if isinstance(v, list):
+                arr = v
+                break
+    if not isinstance(arr, list):
+        return []
+    out: List[Dict[str, float]] = []
+    for it in arr:
+        if not isinstance(it, (list, dict)):
             continue
-        for p in params:
+        # Try dict first
+        dts = None
+        open_v = None
+        high_v = None
+        low_v = None
+        close_v = None
+        if isinstance(it, dict):
+            # common: t/time/datetime, c/close/last
+            dts = it.get("datetime") or it.get("time") or it.get("t") or it.get("date")
+            open_v = it.get("open") or it.get("o")
+            high_v = it.get("high") or it.get("h")
+            low_v = it.get("low") or it.get("l")
+            close_v = it.get("close") or it.get("c") or it.get("last") or it.get("price")
+        else:
+            # If list, assume [ts, open, high, low, close, ...]
             try:
-                print(f"[history-alltick] {symbol} GET {base} params={p}")
-                r = SESSION.get(base, params=p, timeout=25)
-                print(f"[history-alltick] {symbol} status={r.status_code}")
-                r.raise_for_status()
-                j = r.json()
-                # Accept common shapes: {data:[...]}, directly list, or object
-                arr = None
-                if isinstance(j, list):
-                    arr = j
-                elif isinstance(j, dict):
-                    # try several keys
-                    for k in ("data", "kline", "values", "result"):
-                        v = j.get(k)
-                        if isinstance(v, list):
-                            arr = v
-                            break
-                if not isinstance(arr, list):
-                    continue
-                out: List[Dict[str, float]] = []
-                for it in arr:
-                    if not isinstance(it, (list, dict)):
-                        continue
-                    # Try dict first
-                    dts = None
-                    open_v = None
-                    high_v = None
-                    low_v = None
-                    close_v = None
-                    if isinstance(it, dict):
-                        # common: t/time/datetime, c/close/last
-                        dts = it.get("datetime") or it.get("time") or it.get("t") or it.get("date")
-                        open_v = it.get("open") or it.get("o")
-                        high_v = it.get("high") or it.get("h")
-                        low_v = it.get("low") or it.get("l")
-                        close_v = it.get("close") or it.get("c") or it.get("last") or it.get("price")
-                    else:
-                        # If list, assume [ts, open, high, low, close, ...]
-                        try:
-                            ts_val = it[0]
-                            open_v = it[1] if len(it) > 1 else None
-                            high_v = it[2] if len(it) > 2 else None
-                            low_v = it[3] if len(it) > 3 else None
-                            close_v = it[4] if len(it) > 4 else None
-                            if isinstance(ts_val, (int, float)):
-                                dts = to_iso_utc(int(ts_val))
-                            else:
-                                dts = str(ts_val)
-                        except Exception:
-                            pass
-                    if close_v is None or dts is None:
-                        continue
-                    # normalize date
-                    if isinstance(dts, str) and len(dts) >= 10 and dts[4] == "-":
-                        d = dts[:10]
-                    else:
-                        try:
-                            d = to_iso_utc(int(dts))[:10]
-                        except Exception:
-                            continue
-                    candle = build_candle(d, open_v, high_v, low_v, close_v)
-                    if candle:
-                        out.append(candle)
-                out.sort(key=lambda x: x["date"])
-                if out:
-                    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365 * years)).isoformat()
-                    out = [x for x in out if x["date"] >= cutoff]
-                return out
-            except Exception as e:
-                print(f"[warn] {symbol} alltick failed: {e}")
-    return []
+                ts_val = it[0]
+                open_v = it[1] if len(it) > 1 else None
+                high_v = it[2] if len(it) > 2 else None
+                low_v = it[3] if len(it) > 3 else None
+                close_v = it[4] if len(it) > 4 else None
+                if isinstance(ts_val, (int, float)):
+                    dts = to_iso_utc(int(ts_val))
+                else:
+                    dts = str(ts_val)
+            except Exception:
+                pass
+        if close_v is None or dts is None:
+            continue
+        # normalize date
+        if isinstance(dts, str) and len(dts) >= 10 and dts[4] == "-":
+            d = dts[:10]
+        else:
+            try:
+                d = to_iso_utc(int(dts))[:10]
+            except Exception:
+                continue
+        candle = build_candle(d, open_v, high_v, low_v, close_v)
+        if candle:
+            out.append(candle)
+    out.sort(key=lambda x: x["date"])
+    if out:
+        if cutoff is None:
+            cutoff = cutoff_for(years)
+        out = [x for x in out if x["date"] >= cutoff]
+    return out
 
 
-def fetch_daily_yahoo(symbol: str, years: int = MIN_YEARS) -> List[Dict[str, float]]:
+def fetch_daily_yahoo(symbol: str, years: int = MIN_YEARS, cfg: Cfg | None = None) -> List[Dict[str, float]]:
     # Use Yahoo Chart API v8 for daily candles
+    cfg = cfg or Cfg.from_env()
     rng = "1y" if years <= 1 else "2y"
-    hosts = ["query1.finance.yahoo.com", "query2.finance.yahoo.com", "query3.finance.yahoo.com", "query2.finance.yahoo.com"]
-    encoded = quote(symbol, safe='=')
-    for host in hosts:
-        for attempt in range(1, 33):
-            query_host = host.replace('HOST', str(((attempt - 1) % len(hosts)) + 1)) if 'HOST' in host else host
-            url = f"https://{query_host}/v8/finance/chart/{encoded}?range={rng}&interval=1d"
-            try:
-                print(f"[history-yahoo] {symbol} try#{attempt} GET {url}")
-                r = SESSION.get(url, timeout=20)
-                print(f"[history-yahoo] {symbol} status={r.status_code}")
-                if r.status_code == 429:
-                    sleep = min(15.0 * attempt, 60.0) + random.uniform(1.0, 3.0)
-                    time.sleep(sleep)
-                    continue
-                if r.status_code in {500, 502, 503, 504}:
-                    time.sleep(random.uniform(3.0, 6.0))
-                    continue
-                r.raise_for_status()
-                j = r.json()
-                res = (j.get("chart") or {}).get("result") or []
-                if not res:
-                    break
-                res = res[0]
-                ts = res.get("timestamp") or []
-                q = ((res.get("indicators") or {}).get("quote") or [{}])[0]
-                opens = q.get("open") or []
-                highs = q.get("high") or []
-                lows = q.get("low") or []
-                closes = q.get("close") or []
-                out: List[Dict[str, float]] = []
-
-                def pick(arr, idx):
-                    return arr[idx] if idx < len(arr) else None
-
-                for idx, t in enumerate(ts):
-                    candle = build_candle(
-                        to_iso_utc(int(t)),
-                        pick(opens, idx),
-                        pick(highs, idx),
-                        pick(lows, idx),
-                        pick(closes, idx),
-                    )
-                    if candle:
-                        out.append(candle)
-                out.sort(key=lambda x: x["date"])
-                return out
-            except Exception as e:
-                print(f"[warn] {symbol} yahoo failed: {e}")
-                return []
+    # a fresh cached chart needs neither a token nor a hedge
+    for host in YAHOO_HOSTS:
+        hit = cached_response(_yahoo_url(symbol, host, rng), None, cfg.cache_ttl)
+        if hit is not None:
+            return _yahoo_candles(hit)
+    hosts = [YAHOO_HOSTS[i % len(YAHOO_HOSTS)] for i in range(YAHOO_MAX_ATTEMPTS)]
+    attempts = [(f"yahoo {host}", partial(_yahoo_from_host, symbol, host, rng, cfg.cache_ttl)) for host in hosts]
+    return hedged_first(symbol, attempts, YAHOO_HEDGE_DELAY, limiter="yahoo")
+
+
+def _yahoo_url(symbol: str, host: str, rng: str) -> str:
+    return f"https://{host}/v8/finance/chart/{quote(symbol, safe='=')}?range={rng}&interval=1d"
+
+
+def _yahoo_from_host(
+    symbol: str, host: str, rng: str, ttl: float | None = None, cancel: threading.Event | None = None
+) -> List[Dict[str, float]]:
+    """One chart request; hedged_first has already taken its Yahoo token."""
+    if cancel is not None and cancel.is_set():
+        return []  # another host answered while this attempt was queued
+    url = _yahoo_url(symbol, host, rng)
+    print(f"[history-yahoo] {symbol} GET {url}")
+    r = cached_get(url, timeout=20, ttl=ttl)
+    print(f"[history-yahoo] {symbol} status={r.status_code}")
+    if r.status_code == 429:
+        # _YAHOO_ADAPTER does not retry, so back the whole pool off before the next host is tried
+        RATE_LIMITERS["yahoo"].pause(15.0 + random.uniform(1.0, 3.0))
+        return []
+    r.raise_for_status()
+    return _yahoo_candles(r)
 
 
-def load_existing(sym: str) -> List[Dict[str, float]]:
+def _yahoo_candles(r: requests.Response) -> List[Dict[str, float]]:
+    j = _loads(r)
+    res = (j.get("chart") or {}).get("result") or []
+    if not res:
+        return []
+    res = res[0]
+    ts = res.get("timestamp") or []
+    q = ((res.get("indicators") or {}).get("quote") or [{}])[0]
+    opens = q.get("open") or []
+    highs = q.get("high") or []
+    lows = q.get("low") or []
+    closes = q.get("close") or []
+    out = candles_from_columns(ts, opens, highs, lows, closes)
+    out.sort(key=lambda x: x["date"])
+    return out
+
+
+def history_format() -> str:
+    """'json' (default) or 'parquet' to also keep a columnar read mirror (HISTORY_FORMAT)."""
+    return (os.environ.get("HISTORY_FORMAT") or "json").strip().lower()
+
+
+def parquet_path(sym: str) -> Path:
+    return PARQUET_DIR / f"{sym}.parquet"
+
+
+def load_parquet(sym: str, json_path: Path) -> List[Dict[str, float]] | None:
+    """Read the Parquet mirror, or None when it is missing or older than the JSON."""
+    p = parquet_path(sym)
+    try:
+        if p.stat().st_mtime < json_path.stat().st_mtime:
+            return None
+        df = pd.read_parquet(p, columns=OHLC_COLUMNS)
+    except Exception:
+        return None
+    return df.to_dict("records")
+
+
+def save_parquet(sym: str, rows: List[Dict[str, float]]) -> None:
+    try:
+        PARQUET_DIR.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(rows, columns=OHLC_COLUMNS).to_parquet(parquet_path(sym), compression="zstd", index=False)
+    except Exception as e:
+        print(f"[warn] {sym} parquet mirror not written: {e}")
+
+
+def load_existing(sym: str, fmt: str | None = None) -> List[Dict[str, float]]:
     p = OUT_DIR / f"{sym}.json"
     if not p.exists():
         return []
+    mirrored = (fmt or history_format()) == "parquet"
+    if mirrored:
+        rows = load_parquet(sym, p)
+        if rows is not None:
+            return rows
     try:
-        return json.loads(p.read_text())
+        rows = parse_json(p.read_bytes())
     except Exception:
         return []
+    if mirrored and rows:
+        # first run in parquet mode: migrate this symbol's JSON once
+        save_parquet(sym, rows)
+    return rows
+
 
+def previous_business_day(day: date) -> date:
+    day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
 
-def coverage_ok(data: List[Dict[str, float]], min_from_date: str) -> bool:
+
+def coverage_ok(
+    data: List[Dict[str, float]],
+    min_from_date: str,
+    today: date | None = None,
+    fresh_from: str | None = None,
+) -> bool:
     if not data:
         return False
-    data.sort(key=lambda x: x["date"])  # ensure sorted
+    # Up-to-date fast path, no sort or date parsing. It holds whatever the
+    # order: the earliest date is <= data[0] and the latest >= data[-1].
+    # `fresh_from` is the previous business day, i.e. a business gap <= 1.
+    if fresh_from and len(data) >= 200 and data[0]["date"] <= min_from_date and data[-1]["date"] >= fresh_from:
+        return True
+    # files we write are ascending already; only sort one that is not.
+    # A sorted copy leaves `data` in file order for appended_tail().
+    if any(a["date"] > b["date"] for a, b in zip(data, data[1:])):
+        data = sorted(data, key=lambda x: x["date"])
     first = data[0]["date"]
     last = data[-1]["date"]
     # require >= 1 year of history and latest point not older than one business day
     try:
-        today = datetime.now(timezone.utc).date()
+        if today is None:
+            today = datetime.now(timezone.utc).date()
         last_d = datetime.fromisoformat(last).date()
         business_gap = int(np.busday_count(last_d.isoformat(), today.isoformat()))
     except Exception:
@@ -465,22 +911,190 @@ def coverage_ok(data: List[Dict[str, float]], min_from_date: str) -> bool:
     return len(data) >= 200 and first <= min_from_date and business_gap <= 1
 
 
-def merge_history(old: List[Dict[str, float]], new: List[Dict[str, float]]) -> List[Dict[str, float]]:
-    merged: Dict[str, Dict[str, float]] = {}
+def _candles(arr: List[Dict[str, float]] | None, trusted: bool = False) -> List[Dict[str, float]]:
+    """Valid candles of `arr`, strictly ascending by date (last duplicate wins).
 
-    def normalize(it):
+    `trusted` rows (our own files, fetcher output) are taken as they are;
+    anything else goes through build_candle().
+    """
+    out: List[Dict[str, float]] = []
+    for it in arr or []:
         if not isinstance(it, dict):
-            return None
-        date = it.get("date")
-        return build_candle(date, it.get("open"), it.get("high"), it.get("low"), it.get("close"))
+            continue
+        if trusted:
+            candle = it if isinstance(it.get("date"), str) else None
+        else:
+            candle = build_candle(it.get("date"), it.get("open"), it.get("high"), it.get("low"), it.get("close"))
+        if candle:
+            out.append(candle)
+    if any(x["date"] >= y["date"] for x, y in zip(out, out[1:])):
+        out.sort(key=lambda x: x["date"])
+        deduped: List[Dict[str, float]] = []
+        for candle in out:
+            if deduped and deduped[-1]["date"] == candle["date"]:
+                deduped[-1] = candle
+            else:
+                deduped.append(candle)
+        out = deduped
+    return out
+
+
+def merge_history(
+    old: List[Dict[str, float]],
+    new: List[Dict[str, float]],
+    validate: bool = False,
+) -> List[Dict[str, float]]:
+    """Merge two series in one linear pass; `new` wins on duplicate dates.
+
+    Both sides are normally build_candle() output already (the stored file
+    and the fetchers), so rows are not normalized again unless `validate`
+    is set for input from elsewhere.
+    """
+    a = _candles(old, trusted=not validate)
+    b = _candles(new, trusted=not validate)
+    if not a or not b or a[-1]["date"] < b[0]["date"]:
+        return a + b  # common case: new candles strictly after the stored ones
+    out: List[Dict[str, float]] = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        da = a[i]["date"]
+        db = b[j]["date"]
+        if da < db:
+            out.append(a[i])
+            i += 1
+        else:
+            if da == db:
+                i += 1  # same day on both sides: the new candle wins
+            out.append(b[j])
+            j += 1
+    out.extend(a[i:])
+    out.extend(b[j:])
+    return out
+
 
-    for arr in (old, new):
-        for it in arr or []:
-            candle = normalize(it)
-            if candle:
-                merged[candle["date"]] = candle
+def appended_tail(existing: List[Dict[str, float]], merged: List[Dict[str, float]]) -> List[Dict[str, float]] | None:
+    """The candles `merged` adds after `existing`, or None if it changes anything before that.
+
+    merge_history() hands back the stored candle objects themselves, so an
+    identity check is enough to tell that the file's rows survived untouched.
+    """
+    n = len(existing)
+    if not n or len(merged) < n:
+        return None
+    if any(m is not e for m, e in zip(merged, existing)):
+        return None
+    return merged[n:]
 
-    return [merged[d] for d in sorted(merged.keys())]
+
+def append_history(out_path: Path, tail: List[Dict[str, float]]) -> bool:
+    """Splice `tail` into the JSON array at out_path in place of a full rewrite.
+
+    Returns False (file untouched) when the file does not end like a
+    non-empty JSON array.
+    """
+    body = dump_series(tail)
+    try:
+        with open(out_path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            start = max(0, size - 64)
+            f.seek(start)
+            end = f.read().rstrip()
+            if not end.endswith(b"]") or end.endswith(b"[]"):
+                return False
+            f.seek(start + len(end) - 1)
+            f.write(b"," + body[1:])
+            f.truncate()
+    except OSError:
+        return False
+    return True
+
+
+def write_history(out_path: Path, rows: List[Dict[str, float]]) -> None:
+    """Rewrite out_path in one buffered write; readers never see a half-written file."""
+    tmp = out_path.with_suffix(".json.tmp")
+    tmp.write_bytes(dump_series(rows))
+    os.replace(tmp, out_path)
+
+
+def refresh_symbol(sym: str, market: str, cfg: Cfg, today: date | None = None) -> None:
+    """Check one symbol's coverage and refetch/merge/write it when needed."""
+    token = cfg.finnhub_token
+    av_key = cfg.av_key
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    cutoff = cutoff_for(MIN_YEARS, today)
+    fresh_from = previous_business_day(today).isoformat()
+    # routing facts for this symbol, worked out once for the whole fallback chain
+    yahoo_sym = map_symbol_for_market(sym, market)
+    is_cn = market == "CN" or sym.endswith('.SS')
+    equity = market not in NON_EQUITY_MARKETS
+    try:
+        existing = load_existing(sym, cfg.history_format)
+        if coverage_ok(existing, cutoff, today, fresh_from):
+            print(f"[history] {sym} already has >=1y coverage; skip fetch (len={len(existing)})")
+            return
+        fresh: List[Dict[str, float]] = []
+        source = ""
+        if cfg.use_worker:
+            try:
+                fresh = fetch_daily_worker(yahoo_sym, years=MIN_YEARS, cfg=cfg)
+                if fresh:
+                    source = "yahoo_worker"
+            except Exception as e:
+                print(f"[warn] {sym} worker failed: {e}")
+        if not fresh:
+            try:
+                fresh = fetch_daily_yahoo(yahoo_sym, years=MIN_YEARS, cfg=cfg)
+                if fresh and not source:
+                    source = "yahoo"
+            except Exception as e:
+                print(f"[warn] {sym} yahoo failed: {e}")
+        if not fresh and token and equity and not sym.endswith('.SS'):
+            try:
+                fresh = fetch_daily_finnhub(sym, token, years=MIN_YEARS, cfg=cfg)
+                if fresh:
+                    source = "finnhub"
+            except Exception as e:
+                print(f"[warn] {sym} finnhub failed: {e}")
+        if not fresh and is_cn:
+            try:
+                fresh = fetch_daily_akshare(sym, years=MIN_YEARS, today=today)
+                if fresh:
+                    source = "akshare"
+            except Exception as e:
+                print(f"[warn] {sym} akshare failed: {e}")
+        if not fresh and av_key and equity:
+            try:
+                fresh = fetch_daily_alpha(sym, av_key, years=MIN_YEARS, cutoff=cutoff, cfg=cfg)
+                if fresh:
+                    source = "alpha"
+            except Exception as e:
+                print(f"[warn] {sym} alpha failed: {e}")
+        if not fresh and equity:
+            try:
+                fresh = fetch_daily_stooq(sym, years=MIN_YEARS, cutoff=cutoff, cfg=cfg)
+                if fresh:
+                    source = "stooq"
+            except Exception as e:
+                print(f"[warn] {sym} stooq failed: {e}")
+        if not fresh and not existing:
+            print(f"[warn] {sym} no data from any provider; skip writing (keep absent)")
+            return
+        merged = merge_history(existing, fresh)
+        out_path = OUT_DIR / f"{sym}.json"
+        tail = appended_tail(existing, merged)
+        if tail is not None and not tail:
+            print(f"[history] {sym} no new candles; {out_path} unchanged (len={len(merged)})")
+            return
+        if tail and append_history(out_path, tail):
+            print("[ok] appended", out_path, f"+{len(tail)} len={len(merged)}", f"source={source or 'existing'}")
+        else:
+            write_history(out_path, merged)
+            print("[ok] wrote", out_path, f"len={len(merged)}", f"source={source or 'existing'}")
+        if cfg.history_format == "parquet":
+            save_parquet(sym, merged)
+    except Exception as e:
+        print(f"[warn] {sym} history failed: {e}")
 
 
 def parse_args():
@@ -500,18 +1114,18 @@ def main():
         symbol_filter = {sym.strip() for sym in args.symbols.split(',') if sym.strip()}
     max_count = args.limit if args.limit and args.limit > 0 else None
 
-    token = os.environ.get("FINNHUB_API_KEY") or os.environ.get("FINNHUB_TOKEN")
-    av_key = os.environ.get("ALPHAVANTAGE_API_KEY") or os.environ.get("ALPHAVANTAGE_TOKEN")
-    if not token:
+    # every environment setting is read here, once, and handed down as `cfg`
+    cfg = Cfg.from_env()
+    if not cfg.finnhub_token:
         print("[warn] FINNHUB_API_KEY/FINNHUB_TOKEN not set or not authorized for candles; will try Alpha Vantage or Stooq")
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    use_worker = bool((os.environ.get("YAHOO_WORKER_URL") or "").strip())
-    worker_first = (os.environ.get("HISTORY_WORKER_PRIORITY") or "").strip().lower() in {"1", "true", "yes"}
-    symbol_delay = float(os.environ.get("HISTORY_SYMBOL_DELAY") or "1.5")
     try:
-        arr = json.loads(DATA_TICKERS.read_text(encoding="utf-8"))
+        raw = DATA_TICKERS.read_bytes()
+        if raw.startswith(b"\xef\xbb\xbf"):
+            raw = raw[3:]
+        arr = parse_json(raw)
         tickers: list[tuple[str, str]] = []
         if isinstance(arr, list):
             for it in arr:
@@ -540,114 +1154,28 @@ def main():
             tickers = tickers[start:end]
             print(f"[history] processing batch {args.batch_index} (symbols {start + 1} to {min(end, original_total)} of {original_total})")
 
-    use_worker = bool(os.environ.get("YAHOO_WORKER_URL"))
-
     total = len(tickers)
     if total == 0:
         print('[history] no symbols to process')
         return
     limit_total = min(total, max_count) if max_count else total
-    processed = 0
-    for sym, market in tickers:
-        if max_count is not None and processed >= max_count:
-            break
-        idx_display = processed + 1 if limit_total else processed + 1
-        print(f"[history] ({idx_display}/{limit_total or total}) {sym}")
-        try:
-            existing = load_existing(sym)
-            cutoff = (datetime.now(timezone.utc).date() - timedelta(days=365)).isoformat()
-            if coverage_ok(existing, cutoff):
-                print(f"[history] {sym} already has >=1y coverage; skip fetch (len={len(existing)})")
-                continue
-            fresh: List[Dict[str, float]] = []
-            source = ""
-            if use_worker:
-                try:
-                    fresh = fetch_daily_worker(map_symbol_for_market(sym, market), years=MIN_YEARS)
-                    if fresh:
-                        source = "yahoo_worker"
-                except Exception as e:
-                    print(f"[warn] {sym} worker failed: {e}")
-            if not fresh:
-                try:
-                    fresh = fetch_daily_yahoo(map_symbol_for_market(sym, market), years=MIN_YEARS)
-                    if fresh and not source:
-                        source = "yahoo"
-                except Exception as e:
-                    print(f"[warn] {sym} yahoo failed: {e}")
-            if not fresh and token and market not in {"CRYPTO", "FX", "COM", "IDX"} and not sym.endswith('.SS'):
-                try:
-                    fresh = fetch_daily_finnhub(sym, token, years=MIN_YEARS)
-                    if fresh:
-                        source = "finnhub"
-                except Exception as e:
-                    print(f"[warn] {sym} finnhub failed: {e}")
-            if not fresh and (market == "CN" or sym.endswith('.SS')):
-                try:
-                    code = sym.split('.')[0]
-                    end = datetime.now(timezone.utc).date()
-                    start_date = (end - timedelta(days=365 * MIN_YEARS + 7)).strftime('%Y%m%d')
-                    df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start_date, end_date=end.strftime('%Y%m%d'), adjust="")
-                    if isinstance(df, pd.DataFrame) and not df.empty:
-                        cols_map = {str(col).strip().lower(): col for col in df.columns}
-
-                        def pick_col(*aliases):
-                            for alias in aliases:
-                                if alias is None:
-                                    continue
-                                key = str(alias).strip().lower()
-                                if key in cols_map:
-                                    return df[cols_map[key]]
-                            return None
-
-                        date_col = pick_col('date', '交易日期') or df.iloc[:, 0]
-                        open_col = pick_col('open', '开盘', '开盘价')
-                        high_col = pick_col('high', '最高', '最高价')
-                        low_col = pick_col('low', '最低', '最低价')
-                        close_col = pick_col('close', '收盘', '收盘价') or (df.iloc[:, 3] if df.shape[1] > 3 else None)
-
-                        if date_col is not None and close_col is not None:
-                            rows: List[Dict[str, float]] = []
-                            for idx, d in enumerate(date_col):
-                                close_val = close_col.iloc[idx] if hasattr(close_col, 'iloc') else close_col[idx]
-                                open_val = open_col.iloc[idx] if open_col is not None else None
-                                high_val = high_col.iloc[idx] if high_col is not None else None
-                                low_val = low_col.iloc[idx] if low_col is not None else None
-                                candle = build_candle(str(d)[:10], open_val, high_val, low_val, close_val)
-                                if candle:
-                                    rows.append(candle)
-                            rows.sort(key=lambda x: x['date'])
-                            if rows:
-                                fresh = rows
-                                source = "akshare"
-                except Exception as e:
-                    print(f"[warn] {sym} akshare failed: {e}")
-            if not fresh and av_key and market not in {"CRYPTO", "FX", "COM", "IDX"}:
-                try:
-                    fresh = fetch_daily_alpha(sym, av_key, years=MIN_YEARS)
-                    if fresh:
-                        source = "alpha"
-                except Exception as e:
-                    print(f"[warn] {sym} alpha failed: {e}")
-            if not fresh and market not in {"CRYPTO", "FX", "COM", "IDX"}:
-                try:
-                    fresh = fetch_daily_stooq(sym, years=MIN_YEARS)
-                    if fresh:
-                        source = "stooq"
-                except Exception as e:
-                    print(f"[warn] {sym} stooq failed: {e}")
-            if not fresh and not existing:
-                print(f"[warn] {sym} no data from any provider; skip writing (keep absent)")
-                continue
-            merged = merge_history(existing, fresh)
-            out_path = OUT_DIR / f"{sym}.json"
-            with open(out_path, "w") as f:
-                json.dump(merged, f)
-            print("[ok] wrote", out_path, f"len={len(merged)}", f"source={source or 'existing'}")
-        except Exception as e:
-            print(f"[warn] {sym} history failed: {e}")
-        finally:
-            processed += 1
+    if max_count is not None:
+        tickers = tickers[:max_count]
+    concurrency = min(cfg.concurrency, len(tickers))
+
+    # one clock read for the whole run: every symbol is judged against the same day
+    today = datetime.now(timezone.utc).date()
+
+    def run(job: tuple[int, tuple[str, str]]) -> None:
+        idx, (sym, market) = job
+        print(f"[history] ({idx}/{limit_total}) {sym}")
+        refresh_symbol(sym, market, cfg, today=today)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # list() drains the iterator so any unexpected error surfaces here
+        list(pool.map(run, enumerate(tickers, start=1)))
+
+
 if __name__ == "__main__":
     main()
 
@@ -1,7 +1,17 @@
+import io
 import os
 import json
+from multiprocessing import Pool
+from pathlib import Path
+
 import psycopg2
-from psycopg2.extras import execute_values
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+from pg_copy import copy_row
 
 # PostgreSQL connection info
 DB_HOST = "localhost"  # or your DB server IP
@@ -13,50 +23,52 @@ DB_PORT = "5432"  # your port
 # Folder containing your JSON files
 FOLDER_PATH = "../public/companies/"
 
-# Connect to PostgresSQL
-conn = psycopg2.connect(
-    host=DB_HOST,
-    dbname=DB_NAME,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    port=DB_PORT
-)
-cur = conn.cursor()
-
-# Loop through each JSON file in the folder
-for company_folder in os.listdir(FOLDER_PATH):
-    subfolder_path = os.path.join(FOLDER_PATH, company_folder)
-
-    # Make sure it's a folder
-    if not os.path.isdir(subfolder_path):
-        continue
-
-    for filename in os.listdir(subfolder_path):
-        if filename.endswith(".json"):
-            file_path = os.path.join(subfolder_path, filename)
-
-            empty_file = True
-            with open(file_path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    empty_file = False
-                except json.JSONDecodeError:
-                    print(f"Skipping invalid or empty JSON file: {filename}")
-
-            values = []
-
-            if not empty_file:
-                # Prepare data for insertion
-                values = [(data["symbol"], data["name"], data["sector"])]
-
-                # Insert into schema.table
-                execute_values(
-                    cur,
-                    'INSERT INTO "rtu-university".stock_market_companies(symbol, name, sector) VALUES %s',
-                    values
-                )
-
-# Commit and close connection
-conn.commit()
-cur.close()
-conn.close()
+
+def parse_company_json(path):
+    """(symbol, name, sector) from one company JSON file, or None if it is empty/invalid."""
+    with open(path, "rb") as f:
+        try:
+            raw = f.read()
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
+            print(f"Skipping invalid or empty JSON file: {path.name}")
+            return None
+    return (data["symbol"], data["name"], data["sector"])
+
+
+def main():
+    # One JSON file per company folder; parsing them is spread over all cores
+    paths = [p for p in Path(FOLDER_PATH).glob("*/*.json") if p.is_file()]
+    with Pool(os.cpu_count()) as pool:
+        values = [row for row in pool.imap_unordered(parse_company_json, paths, chunksize=64) if row]
+
+    # Connect to PostgresSQL
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        port=DB_PORT
+    )
+    cur = conn.cursor()
+
+    # Stream every company into schema.table with a single COPY
+    if values:
+        buf = io.StringIO()
+        for row in values:
+            buf.write(copy_row(row))
+        buf.seek(0)
+        cur.copy_expert(
+            'COPY "rtu-university".stock_market_companies(symbol, name, sector) FROM STDIN',
+            buf
+        )
+
+    # Commit and close connection
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+# Guarded because every Pool worker imports this file as well
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
+import io
 import os
 import json
 import psycopg2
-from psycopg2.extras import execute_values
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+from pg_copy import copy_row
 
 # PostgreSQL connection info
 DB_HOST = "localhost"  # or your DB server IP
@@ -43,11 +50,12 @@ def map_market(code: str) -> str:
     return MARKET_MAP.get(code.upper(), code.upper() or "Other")
 
 empty_file = True
-with open(FILE_PATH, "r", encoding="utf-8") as f:
+with open(FILE_PATH, "rb") as f:
     try:
-        data = json.load(f)
+        raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         empty_file = False
-    except json.JSONDecodeError:
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
         print(f"Skipping invalid or empty JSON file")
 
 values = []
@@ -64,14 +72,18 @@ if data:
         logo = company["logo"]
         history = company["history"]
 
-        values = [(symbol, name, sector, market_code, market, profile, logo, history)]
+        values.append((symbol, name, sector, market_code, market, profile, logo, history))
 
-        # Insert into schema.table
-        execute_values(
-            cur,
-            'INSERT INTO "rtu-university".stock_market_companies(symbol, name, sector, market_code, market, profile, logo, history) VALUES %s',
-            values
-        )
+# Stream every company into schema.table with a single COPY
+if values:
+    buf = io.StringIO()
+    for row in values:
+        buf.write(copy_row(row))
+    buf.seek(0)
+    cur.copy_expert(
+        'COPY "rtu-university".stock_market_companies(symbol, name, sector, market_code, market, profile, logo, history) FROM STDIN',
+        buf
+    )
 
 # Commit and close connection
 conn.commit()
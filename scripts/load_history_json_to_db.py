@@ -1,7 +1,16 @@
+import io
 import os
 import json
+from multiprocessing import Pool
+
 import psycopg2
-from psycopg2.extras import execute_values
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+from pg_copy import copy_field
 
 # PostgreSQL connection info
 DB_HOST = "localhost"  # or your DB server IP
@@ -13,45 +22,95 @@ DB_PORT = "5432"  # your port
 # Folder containing your JSON files
 FOLDER_PATH = "../public/history/"
 
-# Connect to PostgresSQL
-conn = psycopg2.connect(
-    host=DB_HOST,
-    dbname=DB_NAME,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    port=DB_PORT
+# Rows buffered in memory before they are flushed to the server with COPY
+COPY_FLUSH_ROWS = 100_000
+
+# Rows are COPYed into a session-local staging table, then moved into the
+# real table with one INSERT ... SELECT at the end. The stage only has the
+# copied columns, so the table's id (and its NOT NULL) is not carried over.
+STAGE_TABLE = "stock_market_history_stage"
+
+STAGE_SQL = (
+    f"CREATE TEMP TABLE {STAGE_TABLE} ON COMMIT DROP AS "
+    'SELECT symbol, record_date, record_value FROM "rtu-university".stock_market_history WITH NO DATA'
+)
+
+COPY_SQL = f"COPY {STAGE_TABLE}(symbol, record_date, record_value) FROM STDIN"
+
+MOVE_SQL = (
+    'INSERT INTO "rtu-university".stock_market_history(symbol, record_date, record_value) '
+    f"SELECT symbol, record_date, record_value FROM {STAGE_TABLE} "
+    "ON CONFLICT DO NOTHING"
 )
-cur = conn.cursor()
-
-# Loop through each JSON file in the folder
-for filename in os.listdir(FOLDER_PATH):
-    if filename.endswith(".json"):
-        file_path = os.path.join(FOLDER_PATH, filename)
-
-        empty_file = True
-        with open(file_path, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-                empty_file = False
-            except json.JSONDecodeError:
-                print(f"Skipping invalid or empty JSON file: {filename}")
-
-        values = []
-
-        if empty_file:
-            values = [(filename, None, None)]
-        else:
-            # Prepare data for insertion
-            values = [(os.path.splitext(filename)[0], item["date"], item["close"]) for item in data]
-
-        # Insert into schema.table
-        execute_values(
-            cur,
-            'INSERT INTO "rtu-university".stock_market_history(symbol, record_date, record_value) VALUES %s',
-            values
-        )
-
-# Commit and close connection
-conn.commit()
-cur.close()
-conn.close()
+
+
+def load_series(file_path):
+    """Parsed JSON of one history file; raises ValueError when it is empty/invalid."""
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def history_copy_rows(filename):
+    """(COPY text rows, row count) for one history file; runs in a worker process."""
+    try:
+        data = load_series(os.path.join(FOLDER_PATH, filename))
+    except ValueError:  # json.JSONDecodeError / orjson.JSONDecodeError
+        print(f"Skipping invalid or empty JSON file: {filename}")
+        return f"{copy_field(filename)}\t\\N\t\\N\n", 1
+
+    symbol = copy_field(os.path.splitext(filename)[0])
+    rows = "".join(f"{symbol}\t{copy_field(item['date'])}\t{copy_field(item['close'])}\n" for item in data)
+    return rows, len(data)
+
+
+def flush_copy(cur, buf):
+    """Send the buffered rows with one COPY and hand back an empty buffer."""
+    buf.seek(0)
+    cur.copy_expert(COPY_SQL, buf)
+    return io.StringIO()
+
+
+def main():
+    # Connect to PostgresSQL
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        port=DB_PORT
+    )
+    cur = conn.cursor()
+
+    # One transaction for the whole ingest; losing it on a crash just means
+    # re-running the script, so the commit need not wait for the WAL flush
+    cur.execute("SET LOCAL synchronous_commit = off")
+    cur.execute(STAGE_SQL)
+
+    # Files are read and parsed on all cores; this process is the single writer
+    # that appends their rows to the COPY buffer and flushes it
+    filenames = [name for name in os.listdir(FOLDER_PATH) if name.endswith(".json")]
+    buf = io.StringIO()
+    buffered = 0
+    with Pool(os.cpu_count()) as pool:
+        for rows, count in pool.imap_unordered(history_copy_rows, filenames, chunksize=16):
+            buf.write(rows)
+            buffered += count
+            if buffered >= COPY_FLUSH_ROWS:
+                buf = flush_copy(cur, buf)
+                buffered = 0
+
+    if buffered:
+        flush_copy(cur, buf)
+    cur.execute(MOVE_SQL)
+    print(f"Inserted {cur.rowcount} history rows")
+
+    # Commit and close connection (all COPY batches land in this one transaction)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+# Worker processes re-import this module, so nothing may run at import time
+if __name__ == "__main__":
+    main()
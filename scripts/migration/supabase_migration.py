@@ -1,12 +1,22 @@
-from supabase import create_client, Client
+import io
+
 import psycopg2
 
+COLUMNS = "symbol, name, sector, market_code, market, profile, logo, history"
+
 # -------------------------------
 # Supabase Config
 # -------------------------------
-SUPABASE_URL = "https://HOST.supabase.co"  # from Supabase Project Settings
-SUPABASE_KEY = "SERVICE_ROLE_KEY"  # ⚠️ Use the service_role key, not anon key
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Direct Postgres connection (Project Settings -> Database), not the REST API
+SUPABASE_CONN = psycopg2.connect(
+    host="db.HOST.supabase.co",
+    dbname="postgres",
+    user="postgres",
+    password="DB_PASSWORD",  # ⚠️ the database password, not the anon/service_role key
+    port="5432",
+    sslmode="require"
+)
+supabase_cur = SUPABASE_CONN.cursor()
 
 # -------------------------------
 # Local Postgres Config
@@ -23,22 +33,37 @@ local_cur = LOCAL_CONN.cursor()
 # -------------------------------
 # Fetch data from local Postgres
 # -------------------------------
-local_cur.execute('''
-    SELECT symbol, name, sector, market_code, market, profile, logo, history 
-    FROM "rtu-university".stock_market_companies
-''')
-rows = local_cur.fetchall()
-
-# Convert into list of dicts for Supabase
-columns = [desc[0] for desc in local_cur.description]
-data = [dict(zip(columns, row)) for row in rows]
+# COPY out in text format; the rows never become Python objects
+buf = io.StringIO()
+local_cur.copy_expert(
+    f'COPY (SELECT {COLUMNS} FROM "rtu-university".stock_market_companies) TO STDOUT',
+    buf
+)
+buf.seek(0)
 
 # -------------------------------
 # Insert into Supabase
 # -------------------------------
-for chunk_start in range(0, len(data), 100):  # insert in batches of 100
-    chunk = data[chunk_start:chunk_start + 100]
-    supabase.table("stock_market_companies").upsert(chunk).execute()
+# Bulk-load into a staging table with only the copied columns (no id, so an
+# identity primary key is left to the real table), then apply it by symbol.
+# The primary key is id and symbol has no unique constraint, so there is no
+# ON CONFLICT target: existing symbols are updated, new ones inserted.
+supabase_cur.execute(
+    "CREATE TEMP TABLE stock_market_companies_stage ON COMMIT DROP AS "
+    f"SELECT {COLUMNS} FROM stock_market_companies WITH NO DATA"
+)
+supabase_cur.copy_expert(f"COPY stock_market_companies_stage({COLUMNS}) FROM STDIN", buf)
+updates = ", ".join(f"{c} = s.{c}" for c in COLUMNS.split(", ") if c != "symbol")
+supabase_cur.execute(
+    f"UPDATE stock_market_companies t SET {updates} "
+    "FROM stock_market_companies_stage s WHERE t.symbol = s.symbol"
+)
+supabase_cur.execute(
+    f"INSERT INTO stock_market_companies({COLUMNS}) "
+    f"SELECT {COLUMNS} FROM stock_market_companies_stage s "
+    "WHERE NOT EXISTS (SELECT 1 FROM stock_market_companies t WHERE t.symbol = s.symbol)"
+)
+SUPABASE_CONN.commit()
 
 print("✅ Migration completed successfully!")
 
@@ -47,3 +72,5 @@ print("✅ Migration completed successfully!")
 # -------------------------------
 local_cur.close()
 LOCAL_CONN.close()
+supabase_cur.close()
+SUPABASE_CONN.close()
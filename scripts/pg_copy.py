@@ -0,0 +1,27 @@
+"""Postgres COPY text-format helpers shared by the JSON-to-database loaders.
+
+Scripts run as ``python scripts/<name>.py`` (or from scripts/) import this
+module directly.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+
+def copy_field(value) -> str:
+    """One column of a COPY text-format row: \\N for NULL, specials escaped."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_row(values: Iterable) -> str:
+    """One tab-separated, newline-terminated COPY text-format row."""
+    return "\t".join(copy_field(v) for v in values) + "\n"
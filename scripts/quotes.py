@@ -8,14 +8,31 @@ from __future__ import annotations
 
 import json
 import os
+import pickle
+import shutil
 import time
-import random
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timezone, time as dtime, timedelta
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 import akshare as ak
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+try:
+    import httpx
+    import h2  # noqa: F401  (required by httpx for http2=True)
+except ImportError:  # optional HTTP/2 client; requests is the fallback
+    httpx = None
+
+from rate_limit import TokenBucket
 
 DATA_TICKERS = Path("data/tickers.json")
 
@@ -24,14 +41,53 @@ PUBLIC_DIR = Path("public")
 OUT = DATA_DIR / "quotes.json"
 PUBLIC_OUT = PUBLIC_DIR / "quotes.json"
 
-# HTTP session with explicit User-Agent
-SESSION = requests.Session()
-SESSION.headers["User-Agent"] = (
+# Last A-share spot snapshot, reused by runs that start within QUOTES_SPOT_TTL seconds
+CN_SPOT_CACHE = Path(".cache") / "quotes" / "ak_spot.pkl"
+CN_SPOT_TTL = float(os.environ.get("QUOTES_SPOT_TTL", "30"))
+
+# Yahoo quotes fetched at the same time (EU/JP/SA/Crypto/FX/Commodities/Indices)
+YAHOO_CONCURRENCY = max(1, int(os.environ.get("QUOTES_CONCURRENCY", "8")))
+
+USER_AGENT = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 )
 
 
+def make_session():
+    """HTTP session with explicit User-Agent, shared by every provider.
+
+    With httpx (and h2) installed, an HTTP/2 client multiplexes the many
+    small Yahoo/Finnhub requests over one connection per host; otherwise a
+    requests.Session with a keep-alive pool sized for the Yahoo workers.
+    Both expose the same .get(url, params=..., timeout=...) used below.
+    """
+    if httpx is not None:
+        return httpx.Client(
+            http2=True,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            timeout=15,
+            follow_redirects=True,  # requests' default
+        )
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(10, YAHOO_CONCURRENCY))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = make_session()
+
+
+RATE_LIMITERS = {
+    "finnhub": TokenBucket(3, 3),
+    "akshare": TokenBucket(3, 3),
+    "yahoo": TokenBucket(4, 8),
+}
+
+
 def finnhub_last(symbol: str, api_key: str):
     """Fetch last price using Finnhub's official /quote endpoint.
 
@@ -42,6 +98,7 @@ def finnhub_last(symbol: str, api_key: str):
     params = {"symbol": symbol, "token": api_key}
     try:
         print(f"[finnhub] {symbol} GET {base} symbol={params['symbol']}")
+        RATE_LIMITERS["finnhub"].acquire()
         r = SESSION.get(base, params=params, timeout=15)
         print(f"[finnhub] {symbol} status={r.status_code}")
         # Try to parse JSON regardless of status for clearer diagnostics
@@ -70,20 +127,42 @@ def finnhub_last(symbol: str, api_key: str):
         return None, None, None
 
 
+_ALLTICK_PRICE_KEYS = ("price", "close")
+_ALLTICK_TS_KEYS = ("datetime", "timestamp")
+_alltick_base: str | None = None  # endpoint that last answered with a price
+
+
+def _extract_price_ts(obj):
+    """(price, ts) from an Alltick payload: a quote dict, a list of quotes
+    (last entry wins), or either of those nested under 'data'."""
+    if isinstance(obj, list):
+        return _extract_price_ts(obj[-1]) if obj else (None, None)
+    if not isinstance(obj, dict):
+        return None, None
+    if isinstance(obj.get("data"), (dict, list)):
+        return _extract_price_ts(obj["data"])
+    price = next((obj[k] for k in _ALLTICK_PRICE_KEYS if obj.get(k)), None)
+    ts = next((obj[k] for k in _ALLTICK_TS_KEYS if obj.get(k)), None)
+    return price, ts
+
+
 def alltick_last(symbol: str, api_key: str):
     """Fetch last price from Alltick for CN tickers (symbol without .SS).
 
     Tries configurable ALLTICK_QUOTE_URL then common endpoints; parses common
-    fields (price/close, datetime/timestamp)."""
+    fields (price/close, datetime/timestamp). The endpoint that worked is
+    tried first for the following tickers."""
+    global _alltick_base
     sym = symbol.split(".")[0]
     base_env = os.environ.get("ALLTICK_QUOTE_URL")
     candidates = [
+        _alltick_base,
         base_env,
         "https://api.alltick.co/quote",
         "https://api.alltick.co/market/quote",
         "https://api.alltick.co/price",
     ]
-    for base in candidates:
+    for base in dict.fromkeys(candidates):
         if not base:
             continue
         try:
@@ -98,28 +177,12 @@ def alltick_last(symbol: str, api_key: str):
             if r.status_code >= 400:
                 print(f"[allt] {symbol} error-body={j}")
                 r.raise_for_status()
-            # Handle dict payloads
-            price = None
-            ts = None
-            if isinstance(j, dict):
-                # direct fields or nested under 'data'
-                src = j.get("data") if isinstance(j.get("data"), dict) else j
-                price = (src.get("price") if isinstance(src, dict) else None) or (
-                    src.get("close") if isinstance(src, dict) else None
-                )
-                ts = (src.get("datetime") if isinstance(src, dict) else None) or (
-                    src.get("timestamp") if isinstance(src, dict) else None
-                )
-            elif isinstance(j, list) and j:
-                # list, take last entry
-                item = j[-1]
-                if isinstance(item, dict):
-                    price = item.get("price") or item.get("close")
-                    ts = item.get("datetime") or item.get("timestamp")
+            price, ts = _extract_price_ts(j)
             if price is not None:
                 px = float(price)
                 if not ts:
                     ts = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                _alltick_base = base
                 print(f"[allt] {symbol} last={px} @ {ts}")
                 return px, ts, "allt"
         except Exception as e:
@@ -128,18 +191,28 @@ def alltick_last(symbol: str, api_key: str):
     return None, None, None
 
 
+def parse_json(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def dump_json(obj) -> bytes:
+    """Same layout as json.dump(obj, f, indent=2)."""
+    if orjson is not None:
+        # non-str keys are stringified, as json.dumps does
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+
 def load_previous():
     if OUT.exists():
         try:
-            with open(OUT, "r") as f:
-                return json.load(f)
+            return parse_json(OUT.read_bytes())
         except Exception:
             pass
     # fallback: read from public if exists
     if PUBLIC_OUT.exists():
         try:
-            with open(PUBLIC_OUT, "r") as f:
-                return json.load(f)
+            return parse_json(PUBLIC_OUT.read_bytes())
         except Exception:
             pass
     return {}
@@ -156,7 +229,7 @@ def load_tickers_by_market():
     com: list[str] = []
     idx: list[str] = []
     try:
-        arr = json.loads(DATA_TICKERS.read_text(encoding="utf-8"))
+        arr = parse_json(DATA_TICKERS.read_bytes())
         if isinstance(arr, list):
             for it in arr:
                 if not isinstance(it, dict):
@@ -185,7 +258,14 @@ def load_tickers_by_market():
                     us.append(sym)
     except Exception as e:
         print(f"[warn] load tickers failed: {e}; defaulting to US only")
-    return us, cn, eu, jp, sa, crypto, fx, com, idx
+    # One market per symbol; a symbol listed under several markets keeps the
+    # first in this order (CN, then the Yahoo markets, then US)
+    sym_to_market: dict[str, str] = {}
+    for mkt, syms in (("CN", cn), ("EU", eu), ("JP", jp), ("SA", sa), ("CRYPTO", crypto),
+                      ("FX", fx), ("COM", com), ("IDX", idx), ("US", us)):
+        for sym in syms:
+            sym_to_market.setdefault(sym, mkt)
+    return us, cn, eu, jp, sa, crypto, fx, com, idx, sym_to_market
 
 
 def us_market_is_open(token: str | None) -> bool:
@@ -198,6 +278,7 @@ def us_market_is_open(token: str | None) -> bool:
     if token:
         try:
             url = "https://finnhub.io/api/v1/stock/market-status"
+            RATE_LIMITERS["finnhub"].acquire()
             r = SESSION.get(url, params={"exchange": "US", "token": token}, timeout=10)
             if r.status_code == 200:
                 j = r.json()
@@ -216,110 +297,178 @@ def us_market_is_open(token: str | None) -> bool:
             print(f"[warn] market-status check failed, fallback to local window: {e}")
 
     # 2) Fallback: check New York local time window
-    ny = datetime.now(ZoneInfo("America/New_York"))
-    if ny.weekday() >= 5:  # 5=Sat,6=Sun
+    return market_is_open("US")
+
+
+def _hm(h: int, m: int) -> int:
+    return (h * 60 + m) * 60
+
+
+WEEKDAYS = frozenset({0, 1, 2, 3, 4})
+ALL_DAYS = frozenset(range(7))
+ALL_DAY = ((0, _hm(24, 0)),)
+
+# Market -> (timezone, trading days (Mon=0), sessions as (start, end) seconds
+# after local midnight, both ends inclusive). Built once per process.
+MARKET_HOURS = {
+    # NYSE/Nasdaq regular hours
+    "US": (ZoneInfo("America/New_York"), WEEKDAYS, ((_hm(9, 30), _hm(16, 0)),)),
+    # Shanghai regular sessions
+    "CN": (ZoneInfo("Asia/Shanghai"), WEEKDAYS, ((_hm(9, 30), _hm(11, 30)), (_hm(13, 0), _hm(15, 0)))),
+    # Euronext Paris
+    "EU": (ZoneInfo("Europe/Paris"), WEEKDAYS, ((_hm(9, 0), _hm(17, 30)),)),
+    # Tokyo
+    "JP": (ZoneInfo("Asia/Tokyo"), WEEKDAYS, ((_hm(9, 0), _hm(11, 30)), (_hm(12, 30), _hm(15, 0)))),
+    # Tadawul (KSA): Sun–Thu
+    "SA": (ZoneInfo("Asia/Riyadh"), frozenset({6, 0, 1, 2, 3}), ((_hm(10, 0), _hm(15, 0)),)),
+    # Crypto trades 24/7; treat as always open
+    "CRYPTO": (timezone.utc, ALL_DAYS, ALL_DAY),
+    # Approximate FX session: keep open on weekdays
+    "FX": (timezone.utc, WEEKDAYS, ALL_DAY),
+    # Commodities trade nearly 24/6; treat as always available for quotes
+    "COM": (timezone.utc, ALL_DAYS, ALL_DAY),
+    # Indices are evaluated on weekdays similar to FX
+    "IDX": (timezone.utc, WEEKDAYS, ALL_DAY),
+}
+
+
+def market_is_open(mkt: str, now: datetime | None = None) -> bool:
+    """Return True if `mkt` (a MARKET_HOURS key) is trading at `now` (default: now)."""
+    tz, days, sessions = MARKET_HOURS[mkt]
+    local = (now or datetime.now(timezone.utc)).astimezone(tz)
+    if local.weekday() not in days:
         return False
-    start = dtime(9, 30)
-    end = dtime(16, 0)
-    return start <= ny.time() <= end
+    secs = local.hour * 3600 + local.minute * 60 + local.second + local.microsecond / 1e6
+    return any(start <= secs <= end for start, end in sessions)
 
 
-def cn_market_is_open() -> bool:
-    # Shanghai regular sessions: 09:30–11:30 and 13:00–15:00, Mon–Fri
-    sh = datetime.now(ZoneInfo("Asia/Shanghai"))
-    if sh.weekday() >= 5:
-        return False
-    t = sh.time()
-    morning = dtime(9,30) <= t <= dtime(11,30)
-    afternoon = dtime(13,0) <= t <= dtime(15,0)
-    return morning or afternoon
-
+# Markets quoted from Yahoo, with the label used in the logs
+YAHOO_MARKETS = {
+    "EU": "1d", "JP": "1d", "SA": "1d",
+    "CRYPTO": "crypto", "FX": "fx", "COM": "commodity", "IDX": "index",
+}
 
-def eu_market_is_open() -> bool:
-    # Euronext Paris: 09:00–17:30 local time, Mon–Fri
-    eu = datetime.now(ZoneInfo("Europe/Paris"))
-    if eu.weekday() >= 5:
-        return False
-    return dtime(9,0) <= eu.time() <= dtime(17,30)
-
-
-def jp_market_is_open() -> bool:
-    # Tokyo: 09:00–11:30 and 12:30–15:00 local time, Mon–Fri
-    jp = datetime.now(ZoneInfo("Asia/Tokyo"))
-    if jp.weekday() >= 5:
-        return False
-    t = jp.time()
-    return (dtime(9,0) <= t <= dtime(11,30)) or (dtime(12,30) <= t <= dtime(15,0))
-
-
-def sa_market_is_open() -> bool:
-    # Tadawul (KSA): Sun–Thu, 10:00–15:00 local time
-    sa = datetime.now(ZoneInfo("Asia/Riyadh"))
-    if sa.weekday() not in {6,0,1,2,3}:  # Sun(6)–Thu(3)
-        return False
-    return dtime(10,0) <= sa.time() <= dtime(15,0)
 
+def load_cn_spot():
+    """Download the A-share spot table once and index it by code.
 
-def crypto_market_is_open() -> bool:
-    """Crypto trades 24/7; treat as always open."""
-    return True
+    Returns ({code: last price}, as_of_iso_utc); empty map when unavailable.
+    A snapshot younger than CN_SPOT_TTL seconds is reused from CN_SPOT_CACHE.
+    """
+    try:
+        if CN_SPOT_TTL > 0 and time.time() - CN_SPOT_CACHE.stat().st_mtime < CN_SPOT_TTL:
+            spot_map, ts = pickle.loads(CN_SPOT_CACHE.read_bytes())
+            print(f"[akshare] reuse CN spot snapshot @ {ts}")
+            return spot_map, ts
+    except Exception:  # missing/stale/corrupt cache: fetch below
+        pass
+    spot_map, ts = fetch_cn_spot()
+    if spot_map and CN_SPOT_TTL > 0:
+        try:
+            CN_SPOT_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            tmp = CN_SPOT_CACHE.with_suffix(".tmp")
+            tmp.write_bytes(pickle.dumps((spot_map, ts), protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp, CN_SPOT_CACHE)
+        except OSError as e:
+            print(f"[warn] could not write {CN_SPOT_CACHE}: {e}")
+    return spot_map, ts
 
 
-def fx_market_is_open() -> bool:
-    """Approximate FX session: keep open on weekdays."""
-    now = datetime.now(timezone.utc)
-    if now.weekday() >= 5:
-        return False
-    return True
+def fetch_cn_spot():
+    try:
+        print(f"[akshare] load CN spot snapshot")
+        spot = ak.stock_zh_a_spot_em()
+        ts = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        if isinstance(spot, pd.DataFrame) and not spot.empty:
+            # Columns: 代码, 最新价 (commonly)
+            if '代码' in spot.columns and '最新价' in spot.columns:
+                prices = pd.to_numeric(spot['最新价'], errors='coerce')
+                keep = prices.notna()
+                return dict(zip(spot['代码'].astype(str)[keep], prices[keep].astype(float))), ts
+    except Exception as e:
+        print(f"[warn] akshare spot failed: {e}")
+    return {}, None
 
 
-def commodities_market_is_open() -> bool:
-    """Commodities trade nearly 24/6; treat as always available for quotes."""
-    return True
+YAHOO_HOSTS = ("query1.finance.yahoo.com", "query2.finance.yahoo.com")
+YAHOO_CHART_URL = "https://{host}/v8/finance/chart/{symbol}?range=5d&interval=1d"  # a few bars cover weekends/holidays
 
 
-def indices_market_is_open() -> bool:
-    """Indices are evaluated on weekdays similar to FX."""
-    now = datetime.now(timezone.utc)
-    if now.weekday() >= 5:
-        return False
-    return True
+def last_close(res0: dict):
+    """(close, epoch seconds) of the last bar with a close in a chart result, or None."""
+    try:
+        ts = res0["timestamp"]
+        closes = np.asarray(res0["indicators"]["quote"][0]["close"], dtype=np.float64)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    valid = np.flatnonzero(~np.isnan(closes[:len(ts)]))
+    if not valid.size:
+        return None
+    i = valid[-1]
+    return float(closes[i]), int(ts[i])
 
 
 def yahoo_last(symbol: str):
-    hosts = ["query1.finance.yahoo.com", "query2.finance.yahoo.com"]
-    for host in hosts:
-        url = f"https://{host}/v8/finance/chart/{symbol}?range=1mo&interval=1d"
+    for host in YAHOO_HOSTS:
+        url = YAHOO_CHART_URL.format(host=host, symbol=symbol)
         for attempt in range(1,3):
             try:
                 print(f"[yahoo] {symbol} try#{attempt} GET {url}")
+                RATE_LIMITERS["yahoo"].acquire()
                 r = SESSION.get(url, timeout=15)
                 print(f"[yahoo] {symbol} status={r.status_code}")
                 if r.status_code == 429:
-                    time.sleep(1.2 * attempt)
+                    # back off every Yahoo worker, not just this one
+                    RATE_LIMITERS["yahoo"].pause(1.2 * attempt)
                     continue
                 r.raise_for_status()
                 j = r.json()
                 res = (j.get("chart") or {}).get("result") or []
                 if not res:
                     break
-                res0 = res[0]
-                ts = res0.get("timestamp") or []
-                q = ((res0.get("indicators") or {}).get("quote") or [{}])[0]
-                closes = q.get("close") or []
-                for i in range(len(closes)-1, -1, -1):
-                    c = closes[i]
-                    if c is None:
-                        continue
-                    t = ts[i]
-                    dt = datetime.fromtimestamp(int(t), tz=timezone.utc)
+                found = last_close(res[0])
+                if found is not None:
+                    c, t = found
+                    dt = datetime.fromtimestamp(t, tz=timezone.utc)
                     iso = dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    return float(c), iso, "yahoo_1d"
+                    return c, iso, "yahoo_1d"
             except Exception as e:
                 print(f"[warn] yahoo {symbol} failed: {e}")
     return None, None, None
 
 
+def cn_last(symbol: str, spot: dict, spot_ts: str | None):
+    """CN quote from the Akshare spot snapshot (see load_cn_spot); fallback to last daily."""
+    code = symbol.split('.')[0]
+    if code in spot:
+        return spot[code], spot_ts, 'akshare_spot'
+    try:
+        RATE_LIMITERS["akshare"].acquire()
+        df = ak.stock_zh_a_hist(symbol=code, period='daily', start_date=(datetime.now(timezone.utc).date()-timedelta(days=10)).strftime('%Y%m%d'), end_date=datetime.now(timezone.utc).date().strftime('%Y%m%d'), adjust='')
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            date_key = '日期' if '日期' in df.columns else ('date' if 'date' in df.columns else None)
+            close_key = '收盘' if '收盘' in df.columns else ('close' if 'close' in df.columns else None)
+            if date_key and close_key:
+                px = float(df[close_key].iloc[-1])
+                ts_val = str(df[date_key].iloc[-1])
+                return px, ts_val[:10] + 'T00:00:00Z', 'akshare_daily'
+    except Exception as e:
+        print(f"[warn] akshare daily failed: {e}")
+    return None, None, None
+
+
+def yahoo_last_many(symbols: list[str]) -> dict:
+    """yahoo_last() for every symbol, YAHOO_CONCURRENCY requests at a time.
+
+    Returns {symbol: (price, as_of_iso_utc, source)} in the order given.
+    """
+    if not symbols:
+        return {}
+    print(f"[yahoo] fetching {len(symbols)} quotes with {YAHOO_CONCURRENCY} workers")
+    with ThreadPoolExecutor(max_workers=min(YAHOO_CONCURRENCY, len(symbols))) as pool:
+        return dict(zip(symbols, pool.map(yahoo_last, symbols)))
+
+
 def main():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     PUBLIC_DIR.mkdir(parents=True, exist_ok=True)
@@ -331,17 +480,17 @@ def main():
         print("[warn] ALLTICK_API_KEY/TOKEN not set; CN quotes unavailable.")
     had_prev = OUT.exists()
     prev = load_previous()
-    us_list, cn_list, eu_list, jp_list, sa_list, crypto_list, fx_list, com_list, idx_list = load_tickers_by_market()
+    us_list, cn_list, eu_list, jp_list, sa_list, crypto_list, fx_list, com_list, idx_list, sym_to_market = load_tickers_by_market()
     print(f"[main] start; had_prev={had_prev}; prev_keys={list(prev.keys())}")
     open_us = us_market_is_open(api_key)
-    open_cn = cn_market_is_open()
-    open_eu = eu_market_is_open()
-    open_jp = jp_market_is_open()
-    open_sa = sa_market_is_open()
-    open_crypto = bool(crypto_list) and crypto_market_is_open()
-    open_fx = bool(fx_list) and fx_market_is_open()
-    open_com = bool(com_list) and commodities_market_is_open()
-    open_idx = bool(idx_list) and indices_market_is_open()
+    open_cn = market_is_open("CN")
+    open_eu = market_is_open("EU")
+    open_jp = market_is_open("JP")
+    open_sa = market_is_open("SA")
+    open_crypto = bool(crypto_list) and market_is_open("CRYPTO")
+    open_fx = bool(fx_list) and market_is_open("FX")
+    open_com = bool(com_list) and market_is_open("COM")
+    open_idx = bool(idx_list) and market_is_open("IDX")
     symbols: list[str] = []
     if open_us:
         symbols.extend(us_list)
@@ -370,97 +519,42 @@ def main():
     out: dict = {}
     changed = False
 
-    us_set = set(us_list)
-    cn_set = set(cn_list)
-    eu_set = set(eu_list)
-    jp_set = set(jp_list)
-    sa_set = set(sa_list)
-    crypto_set = set(crypto_list)
-    fx_set = set(fx_list)
-    com_set = set(com_list)
-    idx_set = set(idx_list)
+    # The spot table covers every A-share, so it is downloaded once per run
+    cn_spot, cn_spot_ts = load_cn_spot() if open_cn and cn_list else ({}, None)
+    # Yahoo requests are independent, so they all go out up front in parallel
+    yahoo_quotes = yahoo_last_many([s for s in symbols if sym_to_market[s] in YAHOO_MARKETS])
+
+    def us_quote(s):
+        if not api_key:
+            print(f"[warn] {s}: no Finnhub key; cannot update US ticker")
+            return None
+        print(f"[main] {s} - try finnhub")
+        return finnhub_last(s, api_key)
+
+    def yahoo_quote(s):
+        print(f"[main] {s} - try Yahoo {YAHOO_MARKETS[sym_to_market[s]]}")
+        return yahoo_quotes[s]
+
+    handlers = {mkt: yahoo_quote for mkt in YAHOO_MARKETS}
+    handlers["CN"] = lambda s: cn_last(s, cn_spot, cn_spot_ts)
+    handlers["US"] = us_quote
+
     for s in symbols:
-        if s in cn_set:
-            # CN via Akshare spot snapshot; fallback to last daily
-            code = s.split('.')[0]
-            px, ts, src = None, None, None
-            try:
-                print(f"[akshare] load CN spot snapshot")
-                spot = ak.stock_zh_a_spot_em()
-                if isinstance(spot, pd.DataFrame) and not spot.empty:
-                    # Columns: 代码, 最新价 (commonly)
-                    if '代码' in spot.columns and '最新价' in spot.columns:
-                        row = spot.loc[spot['代码'] == code]
-                        if not row.empty:
-                            px = float(row.iloc[0]['最新价'])
-                            ts = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-                            src = 'akshare_spot'
-            except Exception as e:
-                print(f"[warn] akshare spot failed: {e}")
-            if px is None:
-                try:
-                    df = ak.stock_zh_a_hist(symbol=code, period='daily', start_date=(datetime.now(timezone.utc).date()-timedelta(days=10)).strftime('%Y%m%d'), end_date=datetime.now(timezone.utc).date().strftime('%Y%m%d'), adjust='')
-                    if isinstance(df, pd.DataFrame) and not df.empty:
-                        date_key = '日期' if '日期' in df.columns else ('date' if 'date' in df.columns else None)
-                        close_key = '收盘' if '收盘' in df.columns else ('close' if 'close' in df.columns else None)
-                        if date_key and close_key:
-                            px = float(df[close_key].iloc[-1])
-                            ts_val = str(df[date_key].iloc[-1])
-                            ts = (ts_val[:10] + 'T00:00:00Z')
-                            src = 'akshare_daily'
-                except Exception as e:
-                    print(f"[warn] akshare daily failed: {e}")
-            if px is None:
-                old = prev.get(s) or {}
-                if old.get('last') is not None:
-                    print(f"[warn] {s}: no fresh CN data; keeping previous {old.get('last')} @ {old.get('as_of')}")
-                    new_entry = {"last": float(old.get("last")), "as_of": old.get("as_of"), "interval": old.get("interval")}
-                    out[s] = new_entry
-                    continue
-                else:
-                    print(f"[warn] {s}: no CN data and no previous; leaving unchanged")
-                    continue
-            new_entry = {"last": float(px), "as_of": ts, "interval": src}
-            if prev.get(s) != new_entry:
-                changed = True
-            out[s] = new_entry
-            time.sleep(0.2 + random.uniform(0,0.2))
+        mkt = sym_to_market[s]
+        quote = handlers[mkt](s)
+        if quote is None:
             continue
-        elif s in eu_set or s in jp_set or s in sa_set:
-            print(f"[main] {s} - try Yahoo 1d")
-            px, ts, src = yahoo_last(s)
-        elif s in crypto_set:
-            print(f"[main] {s} - try Yahoo crypto")
-            px, ts, src = yahoo_last(s)
-        elif s in fx_set:
-            print(f"[main] {s} - try Yahoo fx")
-            px, ts, src = yahoo_last(s)
-        elif s in com_set:
-            print(f"[main] {s} - try Yahoo commodity")
-            px, ts, src = yahoo_last(s)
-        elif s in idx_set:
-            print(f"[main] {s} - try Yahoo index")
-            px, ts, src = yahoo_last(s)
-        else:
-            if s not in us_set:
-                print(f"[main] {s} - fallback Yahoo global")
-                px, ts, src = yahoo_last(s)
-            else:
-                if not api_key:
-                    print(f"[warn] {s}: no Finnhub key; cannot update US ticker")
-                    continue
-                print(f"[main] {s} - try finnhub")
-                px, ts, src = finnhub_last(s, api_key)
+        px, ts, src = quote
 
         if px is None:
             old = prev.get(s) or {}
             if old.get("last") is not None:
-                print(f"[warn] {s}: no fresh data; keeping previous {old.get('last')} @ {old.get('as_of')}")
+                print(f"[warn] {s}: no fresh {mkt} data; keeping previous {old.get('last')} @ {old.get('as_of')}")
                 new_entry = {"last": float(old.get("last")), "as_of": old.get("as_of"), "interval": old.get("interval")}
                 out[s] = new_entry
                 continue
             else:
-                print(f"[warn] {s}: no data and no previous; leaving unchanged")
+                print(f"[warn] {s}: no {mkt} data and no previous; leaving unchanged")
                 continue
 
         new_entry = {"last": float(px), "as_of": ts, "interval": src}
@@ -468,9 +562,6 @@ def main():
             changed = True
         out[s] = new_entry
 
-        # Small sleep to avoid bursts (provider friendliness)
-        time.sleep(0.2 + random.uniform(0, 0.2))
-
     if not changed:
         if had_prev:
             print("[ok] no changes; preserving previous file")
@@ -484,10 +575,9 @@ def main():
         "note": "Never writes nulls; preserves previous values if unavailable."
     }
 
-    with open(OUT, "w") as f:
-        json.dump(out, f, indent=2)
-    with open(PUBLIC_OUT, "w") as f:
-        json.dump(out, f, indent=2)
+    # Serialize once; the public copy is byte-identical
+    OUT.write_bytes(dump_json(out))
+    shutil.copyfile(OUT, PUBLIC_OUT)
     print("[ok] wrote", OUT, "and", PUBLIC_OUT)
 
 
@@ -0,0 +1,72 @@
+"""Token-bucket rate limiting shared by the provider scripts.
+
+Scripts run as ``python scripts/<name>.py`` import this module directly;
+the ones under scripts/yahoo/ put scripts/ on sys.path first.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests/second with `capacity` burst.
+
+    Shared by every caller that talks to the same provider, so a whole pool
+    of worker threads stays under that provider's limit and requests go out
+    as soon as the budget allows instead of after a fixed sleep.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float | None = None, cancel: threading.Event | None = None) -> bool:
+        """Take one token, sleeping as needed.
+
+        Returns False without taking a token when the wait would run past
+        `deadline` (a time.monotonic() value) or once `cancel` is set.
+        """
+        while True:
+            if cancel is not None and cancel.is_set():
+                return False
+            with self._lock:
+                now = time.monotonic()
+                if now > self.updated_at:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (self.updated_at - now) + (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for `seconds`, e.g. after a 429."""
+        with self._lock:
+            self.tokens = 0
+            self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+    def slow_down(self, factor: float = 0.5, min_rate: float = 1.0) -> None:
+        """Scale the rate (and burst) by `factor`, never below `min_rate`.
+
+        For providers whose real limit is unknown: a 429 lowers the pace for
+        the rest of the run instead of hitting the same wall again. Calls made
+        while a pause() is still running are ignored, so a burst of 429s from
+        concurrent callers only counts once.
+        """
+        with self._lock:
+            if self.updated_at > time.monotonic():
+                return
+            self.rate = max(min_rate, self.rate * factor)
+            self.capacity = max(1.0, min(self.capacity, self.rate))
+            self.tokens = min(self.tokens, self.capacity)
@@ -1,9 +1,10 @@
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import yfinance as yf
 from supabase import create_client, Client
 from datetime import datetime
-import random
+
+from rate_limit import TokenBucket
 
 # ==========================================
 # CONFIGURATION
@@ -15,6 +16,20 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 TABLE_COMPANIES = "stock_market_companies"
 TABLE_FUNDAMENTALS = "company_fundamentals"
 
+# Rows sent per upsert request (same chunk size as supabase_migration.py)
+UPSERT_BATCH_SIZE = 100
+
+# Tickers fetched from Yahoo at the same time
+CONCURRENCY = max(1, int(os.environ.get("FUNDAMENTALS_CONCURRENCY", "4")))
+
+# Tickers started per second across all workers (the old 2-3s pause per
+# symbol with 4 workers came to about 1.6/s)
+RATE = float(os.environ.get("FUNDAMENTALS_RATE", "1.5"))
+
+
+# CRITICAL: shared by every worker to avoid a Yahoo ban
+YAHOO_LIMITER = TokenBucket(RATE, 1)
+
 
 def get_supabase():
     if not SUPABASE_URL or not SUPABASE_KEY:
@@ -31,14 +46,46 @@ def fetch_tickers(supabase):
         print(f"Error fetching tickers: {e}")
         return []
 
+def fetch_stored_extremes(supabase):
+    """Fetches the all-time high/low already stored for each symbol"""
+    try:
+        res = supabase.table(TABLE_FUNDAMENTALS).select("symbol, all_time_high, all_time_low").execute()
+        return {
+            i['symbol']: (i['all_time_high'], i['all_time_low'])
+            for i in res.data
+            if i.get('symbol') and i.get('all_time_high') is not None and i.get('all_time_low') is not None
+        }
+    except Exception as e:
+        print(f"Error fetching stored all-time high/low: {e}")
+        return {}
+
 def get_clean_value(val):
     """Cleans None or 'NaN' values returned by Yahoo"""
     if val is None or val == "NaN":
         return None
     return val
 
-def process_company(symbol):
-    """Fetches info for ONE company"""
+def needs_reseed(hist, stored_extremes):
+    """True when the last few days cannot just be folded into the stored extremes.
+
+    A stock split rescales the whole auto-adjusted series, so the stored
+    values end up on the old basis. A split inside the window shows up in
+    'Stock Splits'; one from before it shows up as closes outside the stored
+    range (as does a genuine new high/low, which a refetch handles too).
+    """
+    splits = hist.get('Stock Splits')
+    if splits is not None and (splits.fillna(0) != 0).any():
+        return True
+    closes = hist['Close']
+    return round(closes.max(), 2) > stored_extremes[0] or round(closes.min(), 2) < stored_extremes[1]
+
+def process_company(symbol, stored_extremes=None):
+    """Fetches info for ONE company
+
+    With the (all_time_high, all_time_low) already stored for it, only the
+    last few days are downloaded and folded into them; otherwise, or when
+    needs_reseed() says they are stale, the full history is fetched.
+    """
     try:
         ticker = yf.Ticker(symbol)
         info = ticker.info
@@ -55,10 +102,18 @@ def process_company(symbol):
         current_price = None
 
         try:
-            hist = ticker.history(period="max", auto_adjust=True)
+            period = "5d" if stored_extremes else "max"
+            hist = ticker.history(period=period, auto_adjust=True)
+            if stored_extremes and not hist.empty and needs_reseed(hist, stored_extremes):
+                print(f"{symbol}: split or new extreme, refetching full history")
+                hist = ticker.history(period="max", auto_adjust=True)
+                stored_extremes = None
             if not hist.empty:
                 all_time_high = round(hist['Close'].max(), 2)
                 all_time_low = round(hist['Close'].min(), 2)
+                if stored_extremes:
+                    all_time_high = max(all_time_high, stored_extremes[0])
+                    all_time_low = min(all_time_low, stored_extremes[1])
                 current_price = hist['Close'].iloc[-1]
 
                 if market_cap is None:
@@ -104,6 +159,28 @@ def process_company(symbol):
         print(f"Exception on {symbol}: {e}")
         return None
 
+def fetch_company_paced(symbol, stored_extremes=None):
+    """process_company() once the shared rate limiter allows, run in a worker thread."""
+    YAHOO_LIMITER.acquire()
+    return process_company(symbol, stored_extremes)
+
+def upsert_fundamentals(supabase, batch):
+    """Upserts a batch of rows, one request per set of columns.
+
+    process_company() drops None fields so the database keeps its old values;
+    a bulk upsert would null out whatever keys a row lacks, so rows are only
+    sent together when they carry exactly the same columns.
+    """
+    groups = {}
+    for row in batch:
+        groups.setdefault(frozenset(row), []).append(row)
+    for rows in groups.values():
+        try:
+            supabase.table(TABLE_FUNDAMENTALS).upsert(rows, returning="minimal").execute()
+            print(f" Saved {len(rows)} rows.")
+        except Exception as e:
+            print(f" DB Error ({len(rows)} rows): {e}")
+
 def main():
     supabase = get_supabase()
     if not supabase: return
@@ -114,25 +191,27 @@ def main():
         return
 
     print(f"{len(tickers)} companies to update.")
+    extremes = fetch_stored_extremes(supabase)
     
-    # Processing one by one
-    for i, symbol in enumerate(tickers):
-        print(f" [{i+1}/{len(tickers)}] {symbol}...", end="", flush=True)
-        
-        data = process_company(symbol)
-        
-        if data:
-            try:
-                # Immediate upsert (line by line) because the script is slow
-                supabase.table(TABLE_FUNDAMENTALS).upsert(data).execute()
-                print(" Saved.")
-            except Exception as e:
-                print(f" DB Error: {e}")
-        else:
-            print("Skipped.")
-
-        # CRITICAL PAUSE TO AVOID BAN
-        time.sleep(random.uniform(2, 3))
+    # Fetching CONCURRENCY tickers at a time; this thread alone collects the
+    # results and upserts every UPSERT_BATCH_SIZE rows
+    batch = []
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        futures = {pool.submit(fetch_company_paced, symbol, extremes.get(symbol)): symbol for symbol in tickers}
+        for i, fut in enumerate(as_completed(futures)):
+            symbol = futures[fut]
+            data = fut.result()
+            if data:
+                batch.append(data)
+                print(f" [{i+1}/{len(tickers)}] {symbol}... Queued.")
+                if len(batch) >= UPSERT_BATCH_SIZE:
+                    upsert_fundamentals(supabase, batch)
+                    batch = []
+            else:
+                print(f" [{i+1}/{len(tickers)}] {symbol}... Skipped.")
+
+    if batch:
+        upsert_fundamentals(supabase, batch)
 
     print("\n Done! All fundamental data is up to date.")
 
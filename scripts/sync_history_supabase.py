@@ -1,8 +1,15 @@
+import io
 import os
+from itertools import islice
 import pandas as pd
 import yfinance as yf
 from supabase import create_client
 
+try:
+    import psycopg2
+except ImportError:  # optional: only needed for the direct Postgres path (SUPABASE_DB_URL)
+    psycopg2 = None
+
 # ==========================================
 # CONFIGURATION & CONSTANTS
 # ==========================================
@@ -14,7 +21,19 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 TABLE_COMPANIES = "stock_market_companies"
 TABLE_HISTORY = "stock_market_history"
 
-BATCH_SIZE = 1000 
+# Rows per REST upsert request (~0.6 MB of JSON, well under the request size limit)
+BATCH_SIZE = 5000
+
+# Optional direct Postgres connection string (Project Settings -> Database).
+# When set (and psycopg2 is installed) the upsert bypasses the REST API.
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
+
+HISTORY_COLUMNS = (
+    "symbol", "record_date", "open_value", "high_value",
+    "low_value", "close_value", "record_value",
+)
+# Direct path: COPY into a staging table, then one upsert into the real table
+STAGE_TABLE = "stock_market_history_stage"
 
 # ==========================================
 # HELPER FUNCTIONS
@@ -39,36 +58,63 @@ def fetch_tickers(supabase):
         print(f"Supabase Fetch Error: {e}")
         return []
 
-def prepare_history_records(symbol, df):
+def history_frame(df):
     """
-    Transforms the yfinance DataFrame into a list of dictionaries
-    matching the 'stock_market_history' table structure.
+    Maps a long yfinance frame (one row per symbol and day, with 'symbol',
+    'Date' and OHLC columns) onto the 'stock_market_history' columns
+    (HISTORY_COLUMNS).
     """
-    if df is None or df.empty:
-        return []
-
-    records = []
-    # Reset index to ensure 'Date' is available as a column
-    df = df.reset_index()
-    
-    for _, row in df.iterrows():
+    # Whole-column rounding/formatting instead of a Python loop over rows
+    prices = df[['Open', 'High', 'Low', 'Close']].astype(float).round(2)
+    return pd.DataFrame({
+        "symbol": df['symbol'],
         # Convert date to ISO string format (YYYY-MM-DD)
-        date_str = row['Date'].strftime('%Y-%m-%d')
-        
+        "record_date": df['Date'].dt.strftime('%Y-%m-%d'),
         # Exact mapping to your Supabase table columns
-        record = {
-            "symbol": symbol,
-            "record_date": date_str,
-            "open_value": round(float(row['Open']), 2),
-            "high_value": round(float(row['High']), 2),
-            "low_value": round(float(row['Low']), 2),
-            "close_value": round(float(row['Close']), 2),
-            # Using 'Close' as the generic record_value
-            "record_value": round(float(row['Close']), 2) 
-        }
-        records.append(record)
-        
-    return records
+        "open_value": prices['Open'],
+        "high_value": prices['High'],
+        "low_value": prices['Low'],
+        "close_value": prices['Close'],
+        # Using 'Close' as the generic record_value
+        "record_value": prices['Close'],
+    })
+
+def iter_history_records(history):
+    """Yields the history DataFrame as record dicts, one row at a time."""
+    columns = list(history.columns)
+    for row in history.itertuples(index=False, name=None):
+        yield dict(zip(columns, row))
+
+def upsert_history_postgres(history):
+    """Upserts the history DataFrame over a direct Postgres connection.
+
+    pandas writes the rows as CSV straight into the COPY buffer; a single
+    INSERT ... ON CONFLICT then merges the staged rows in the same transaction.
+    """
+    columns = ", ".join(HISTORY_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in HISTORY_COLUMNS[2:])
+    buf = io.StringIO()
+    history.to_csv(buf, index=False, header=False, sep='\t', float_format='%.2f')
+    buf.seek(0)
+    conn = psycopg2.connect(SUPABASE_DB_URL)
+    try:
+        with conn, conn.cursor() as cur:
+            # Only the copied columns: an identity id stays NOT NULL on the real table alone
+            cur.execute(
+                f"CREATE TEMP TABLE {STAGE_TABLE} ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {TABLE_HISTORY} WITH NO DATA"
+            )
+            cur.copy_expert(
+                f"COPY {STAGE_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t')",
+                buf
+            )
+            cur.execute(
+                f"INSERT INTO {TABLE_HISTORY} ({columns}) SELECT {columns} FROM {STAGE_TABLE} "
+                f"ON CONFLICT (symbol, record_date) DO UPDATE SET {updates}"
+            )
+        print(f"{len(history)} records upserted via Postgres.")
+    finally:
+        conn.close()
 
 # ==========================================
 # MAIN EXECUTION
@@ -101,48 +147,55 @@ def main():
         print(f"Critical Download Error: {e}")
         return
 
-    all_records = []
-
     # 4. Process Data
     print("Formatting data...")
-    is_multi_ticker = len(tickers) > 1
-
-    for symbol in tickers:
-        try:
-            if is_multi_ticker:
-                # If ticker failed to download, it won't be in columns
-                if symbol not in raw_data.columns.levels[0]:
-                    continue
-                df_sym = raw_data[symbol]
-            else:
-                df_sym = raw_data
-
-            # Drop rows with missing values (NaN)
-            df_sym = df_sym.dropna()
-            
-            # Create records for this specific symbol
-            symbol_records = prepare_history_records(symbol, df_sym)
-            all_records.extend(symbol_records)
-            
-        except Exception as e:
-            print(f"Error processing {symbol}: {e}")
-            continue
+    if raw_data.empty:
+        history = pd.DataFrame(columns=list(HISTORY_COLUMNS))
+    else:
+        if not isinstance(raw_data.columns, pd.MultiIndex):
+            # A single ticker may come back without the ticker column level
+            raw_data = pd.concat({tickers[0]: raw_data}, axis=1)
+        # (Date, ticker) x field -> one row per symbol and day. Failed tickers
+        # have no columns at all; rows with missing values (NaN) are dropped
+        long = (
+            raw_data.stack(level=0, future_stack=True)
+            .rename_axis(['Date', 'symbol'])
+            .reset_index()
+            .dropna()
+        )
+        history = history_frame(long)
 
     # 5. Batch Upsert to Supabase
-    total_records = len(all_records)
+    total_records = len(history)
     print(f"\nUploading {total_records} history records to Supabase...")
 
-    for i in range(0, total_records, BATCH_SIZE):
-        batch = all_records[i : i + BATCH_SIZE]
+    if SUPABASE_DB_URL and psycopg2 is not None and total_records:
+        try:
+            upsert_history_postgres(history)
+            print("\nSYNC COMPLETED SUCCESSFULLY!")
+            return
+        except Exception as e:
+            print(f"Postgres Upload Error, falling back to REST: {e}")
+
+    # Only BATCH_SIZE record dicts exist at a time, never the whole list
+    records = iter_history_records(history)
+    i = 0
+    while True:
+        batch = list(islice(records, BATCH_SIZE))
+        if not batch:
+            break
         try:
-            # Perform UPSERT based on conflict on (symbol, record_date)
+            # Perform UPSERT based on conflict on (symbol, record_date),
+            # without PostgREST echoing the rows back
             supabase.table(TABLE_HISTORY).upsert(
-                batch, 
-                on_conflict='symbol, record_date'
+                batch,
+                on_conflict='symbol, record_date',
+                returning='minimal'
             ).execute()
             print(f"Batch {i}-{i+len(batch)} uploaded successfully.")
         except Exception as e:
             print(f"Batch Upload Error (Index {i}): {e}")
+        i += len(batch)
 
     print("\nSYNC COMPLETED SUCCESSFULLY!")
 
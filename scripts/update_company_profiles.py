@@ -14,26 +14,95 @@ from __future__ import annotations
 
 import json
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Any, Dict, Iterable
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional streaming parser; response.json() is the fallback
+    ijson = None
+
+try:
+    import httpx
+    import h2  # noqa: F401  (required by httpx for http2=True)
+except ImportError:  # optional HTTP/2 client; requests is the fallback
+    httpx = None
+
+try:
+    import requests_cache
+except ImportError:  # optional on-disk response cache
+    requests_cache = None
+
+from rate_limit import TokenBucket
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA_TICKERS = ROOT / "data" / "tickers.json"
 PUBLIC_COMPANIES = ROOT / "public" / "companies"
+# Worker responses younger than PROFILES_CACHE_TTL seconds are replayed from disk (0 disables)
+WORKER_CACHE = ROOT / ".cache" / "profiles" / "worker_cache"
 
 WORKER_URL = os.environ.get("YAHOO_WORKER_URL", "").strip()
 WORKER_TOKEN = os.environ.get("YAHOO_WORKER_TOKEN", "").strip()
 
-SESSION = requests.Session()
-SESSION.headers["User-Agent"] = (
+# Summaries fetched from the worker at the same time, and requests/second across
+# them to start with (the worker proxies Yahoo; every 429 halves the rate)
+PROFILES_CONCURRENCY = max(1, int(os.environ.get("PROFILES_CONCURRENCY", "8")))
+PROFILES_RATE = float(os.environ.get("PROFILES_RATE", "4"))
+# Tries per summary when the worker answers 429
+PROFILES_MAX_ATTEMPTS = max(1, int(os.environ.get("PROFILES_MAX_ATTEMPTS", "4")))
+PROFILES_CACHE_TTL = float(os.environ.get("PROFILES_CACHE_TTL", "900"))
+
+USER_AGENT = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 )
 
+
+def make_session():
+    """HTTP session shared by every worker thread.
+
+    With requests_cache installed, a SQLite-backed CachedSession lets re-runs
+    within PROFILES_CACHE_TTL skip the network for every unchanged symbol.
+    Otherwise, with httpx (and h2), an HTTP/2 client multiplexes all summary
+    requests to the worker host over a single connection; failing both, a
+    requests.Session with one pooled keep-alive connection per thread.
+    """
+    if requests_cache is not None and PROFILES_CACHE_TTL > 0:
+        WORKER_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        session = requests_cache.CachedSession(
+            str(WORKER_CACHE),
+            backend="sqlite",
+            expire_after=PROFILES_CACHE_TTL,
+            allowable_codes=(200, 404),  # unknown symbols stay unknown too
+        )
+        session.headers["User-Agent"] = USER_AGENT
+        session.mount("https://", HTTPAdapter(pool_maxsize=max(10, PROFILES_CONCURRENCY)))
+        return session
+    if httpx is not None:
+        return httpx.Client(
+            http2=True,
+            headers={"User-Agent": USER_AGENT},
+            timeout=20,
+            follow_redirects=True,  # requests' default
+        )
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    session.mount("https://", HTTPAdapter(pool_maxsize=max(10, PROFILES_CONCURRENCY)))
+    return session
+
+
+SESSION = make_session()
+
 SUMMARY_FIELDS = (
     "longName",
     "longBusinessSummary",
@@ -46,6 +115,9 @@ SUMMARY_FIELDS = (
 )
 
 
+WORKER_LIMITER = TokenBucket(PROFILES_RATE, PROFILES_RATE)
+
+
 def load_tickers() -> Iterable[Dict[str, Any]]:
     with open(DATA_TICKERS, "r", encoding="utf-8") as handle:
         payload = json.load(handle)
@@ -81,20 +153,30 @@ def fetch_summary(symbol: str, market: str) -> Dict[str, Any] | None:
     if WORKER_TOKEN:
         headers["x-worker-token"] = WORKER_TOKEN
 
-    print(f"[summary] GET {url}")
-    response = SESSION.get(url, headers=headers, timeout=20)
-    print(f"[summary] {symbol} status={response.status_code}")
+    for attempt in range(1, PROFILES_MAX_ATTEMPTS + 1):
+        print(f"[summary] GET {url}")
+        with open_stream(url, headers) as response:
+            print(f"[summary] {symbol} status={response.status_code}")
 
-    if response.status_code == 404:
-        print(f"[warn] {symbol}: summary unavailable (404)")
-        return None
-    response.raise_for_status()
+            if response.status_code == 429 and attempt < PROFILES_MAX_ATTEMPTS:
+                # Back every worker off and slow the pace, then retry this symbol
+                delay = retry_after(response, 2.0 * attempt)
+                print(f"[warn] {symbol}: throttled, retrying in {delay:g}s")
+                WORKER_LIMITER.slow_down()
+                WORKER_LIMITER.pause(delay)
+                continue
 
-    try:
-        data = response.json()
-    except Exception as exc:  # noqa: BLE001
-        print(f"[warn] {symbol}: failed to decode JSON ({exc})")
-        return None
+            if response.status_code == 404:
+                print(f"[warn] {symbol}: summary unavailable (404)")
+                return None
+            response.raise_for_status()
+
+            try:
+                data = read_summary(response)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[warn] {symbol}: failed to decode JSON ({exc})")
+                return None
+        break
 
     if not isinstance(data, dict):
         print(f"[warn] {symbol}: unexpected payload type {type(data)}")
@@ -102,6 +184,82 @@ def fetch_summary(symbol: str, market: str) -> Dict[str, Any] | None:
     return data
 
 
+def retry_after(response, default: float) -> float:
+    """Seconds asked for by a 429's Retry-After header (capped at 60), else `default`."""
+    try:
+        return min(60.0, max(0.0, float(response.headers.get("Retry-After"))))
+    except (TypeError, ValueError):  # absent, or an HTTP date
+        return default
+
+
+def open_stream(url: str, headers: Dict[str, str]):
+    """GET `url` without reading the body yet; use as a context manager.
+
+    Fresh cached responses are replayed without spending WORKER_LIMITER budget.
+    """
+    if requests_cache is not None and isinstance(SESSION, requests_cache.CachedSession):
+        cached = SESSION.get(url, headers=headers, only_if_cached=True)
+        if cached.status_code != 504:  # 504 = not cached (or expired)
+            return cached
+    WORKER_LIMITER.acquire()
+    if httpx is not None and isinstance(SESSION, httpx.Client):
+        return SESSION.stream("GET", url, headers=headers, timeout=20)
+    return SESSION.get(url, headers=headers, timeout=20, stream=True)
+
+
+class _ChunkReader:
+    """Minimal file-like .read() over httpx's decoded body chunks, for ijson."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:  # ijson probes the return type with read(0)
+            return b""
+        return next(self._chunks, b"")
+
+
+def read_summary(response) -> Any:
+    """Decode the summary body, keeping only SUMMARY_FIELDS when ijson is available.
+
+    ijson walks the top-level object straight off the socket, so only the
+    wanted values are kept instead of the whole payload's dict tree.
+    """
+    is_httpx = httpx is not None and isinstance(response, httpx.Response)
+    # requests_cache responses (from_cache) already hold the whole body
+    if ijson is None or hasattr(response, "from_cache"):
+        if is_httpx:
+            response.read()
+        return response.json()
+    if is_httpx:
+        body = _ChunkReader(chunk for chunk in response.iter_bytes() if chunk)
+    else:
+        response.raw.decode_content = True  # let urllib3 undo gzip/deflate
+        body = response.raw
+    wanted = set(SUMMARY_FIELDS)
+    return {k: v for k, v in ijson.kvitems(body, "", use_float=True) if k in wanted}
+
+
+def parse_json(raw: bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # e.g. NaN written by json.dumps, which only the stdlib accepts
+    return json.loads(raw)
+
+
+def dump_json(obj: Any) -> bytes:
+    """Two-space indented UTF-8 JSON, with non-ASCII text written as-is.
+
+    Both branches write the same bytes, except that orjson turns NaN into
+    null where the stdlib writes NaN (parse_json reads either).
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
 def update_profile(symbol: str, base: Dict[str, Any], summary: Dict[str, Any] | None) -> None:
     folder = PUBLIC_COMPANIES / symbol
     folder.mkdir(parents=True, exist_ok=True)
@@ -110,7 +268,7 @@ def update_profile(symbol: str, base: Dict[str, Any], summary: Dict[str, Any] |
     existing: Dict[str, Any]
     if path.exists():
         try:
-            existing = json.loads(path.read_text(encoding="utf-8"))
+            existing = parse_json(path.read_bytes())
             if not isinstance(existing, dict):
                 existing = {}
         except Exception:  # noqa: BLE001
@@ -131,21 +289,31 @@ def update_profile(symbol: str, base: Dict[str, Any], summary: Dict[str, Any] |
             if value is not None:
                 existing[key] = value
 
-    path.write_text(json.dumps(existing, indent=2), encoding="utf-8")
+    path.write_bytes(dump_json(existing))
     print(f"[ok] updated {path}")
 
 
 def main() -> None:
-    for entry in load_tickers():
-        symbol = entry["symbol"]
-        market = entry["market"]
-        try:
-            summary = fetch_summary(symbol, market)
-        except Exception as exc:  # noqa: BLE001
-            print(f"[warn] {symbol}: fetch failed ({exc})")
-            continue
-        update_profile(symbol, entry, summary)
-        time.sleep(0.5)
+    if not WORKER_URL:
+        raise SystemExit("Missing YAHOO_WORKER_URL environment variable.")
+
+    entries = list(load_tickers())
+    # Requests run in the pool, paced by WORKER_LIMITER; profiles are only
+    # written from this thread
+    with ThreadPoolExecutor(max_workers=PROFILES_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(fetch_summary, entry["symbol"], entry["market"]): entry
+            for entry in entries
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            symbol = entry["symbol"]
+            try:
+                summary = future.result()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[warn] {symbol}: fetch failed ({exc})")
+                continue
+            update_profile(symbol, entry, summary)
 
 
 if __name__ == "__main__":
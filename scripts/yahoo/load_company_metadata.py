@@ -1,17 +1,64 @@
 # pip install supabase yfinance pandas python-dateutil
-import time
+import os
+import shelve
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
 
 import yfinance as yf
 from supabase import create_client
 import pandas as pd
 
+try:
+    import requests_cache
+except ImportError:  # optional on-disk cache for Yahoo responses
+    requests_cache = None
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from rate_limit import TokenBucket  # type: ignore
+
 # DB CONFIG
 SUPABASE_URL = "your_supabase_url"
 SUPABASE_KEY = "your_supabase_key"
 TABLE = "stock_market_companies"
 all_rows = []
 page = 0
-BATCH_SIZE = 1000  # tune by API limits
+BATCH_SIZE = 5000  # rows per upsert request; tune by API limits
+INFO_WORKERS = 12  # tickers looked up concurrently
+UPSERT_WORKERS = 8  # upsert requests in flight at once
+INFO_RATE = 8  # Yahoo lookups started per second, across all workers
+INFO_CACHE = ".cache/yahoo/yf_cache"  # SQLite file for cached Yahoo responses
+INFO_CACHE_TTL = 3600  # seconds a cached response stays fresh
+METADATA_CACHE = ".cache/yahoo/metadata"  # shelve of (industry, website, ir_website) per symbol and month
+
+
+YAHOO_LIMITER = TokenBucket(INFO_RATE, INFO_RATE)  # prevent Yahoo rate-limit
+
+
+def make_yf_session():
+    """CachedSession for yf.Ticker, or None to let yfinance use its own.
+
+    Re-runs within INFO_CACHE_TTL then replay .info from disk. yfinance
+    >= 0.2.58 only accepts curl_cffi sessions and rejects this one, in which
+    case the lookups simply go uncached.
+    """
+    if requests_cache is None:
+        return None
+    os.makedirs(os.path.dirname(INFO_CACHE), exist_ok=True)
+    session = requests_cache.CachedSession(INFO_CACHE, backend="sqlite", expire_after=INFO_CACHE_TTL)
+    try:
+        yf.Ticker("AAPL", session=session)
+    except Exception as e:
+        print(f"ℹ️ yfinance refused the cached session ({e}), fetching uncached")
+        return None
+    return session
+
+
+YF_SESSION = make_yf_session()
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
@@ -33,39 +80,64 @@ symbols = df["symbol"].dropna().unique().tolist()
 
 print(f"🔍 Found {len(symbols)} tickers missing profile data")
 
-updates = []
+# DB ids per symbol, bucketed once instead of filtering df for every ticker
+ids_by_symbol = {symbol: rows["id"].tolist() for symbol, rows in df.groupby("symbol", sort=False)}
 
-for symbol in symbols:
+def fetch_metadata(symbol):
+    """(symbol, (industry, website, ir_website)) for one ticker, or (symbol, None) if Yahoo failed."""
+    YAHOO_LIMITER.acquire()
     print(f"Fetching metadata for {symbol}...")
     try:
-        ticker = yf.Ticker(symbol)
+        ticker = yf.Ticker(symbol, session=YF_SESSION)
         info = ticker.info  # full metadata
     except Exception as e:
         print(f"⚠️ Error reading data for {symbol}: {e}, skipping")
+        return symbol, None
+    return symbol, (
+        info.get("industry"),
+        info.get("website"),
+        info.get("irWebsite") or info.get("website"),  # fallback if IR not available
+    )
+
+# Metadata found earlier this month is reused as is; only the other tickers
+# go to Yahoo. The shelve is only touched from this thread.
+month = datetime.now().strftime("%Y-%m")
+os.makedirs(os.path.dirname(METADATA_CACHE), exist_ok=True)
+with shelve.open(METADATA_CACHE) as cache:
+    metadata = {s: cache[f"{s}:{month}"] for s in symbols if f"{s}:{month}" in cache}
+    missing = [s for s in symbols if s not in metadata]
+    print(f"♻️ {len(metadata)} tickers cached this month, fetching {len(missing)}")
+
+    with ThreadPoolExecutor(max_workers=INFO_WORKERS) as ex:
+        for symbol, meta in ex.map(fetch_metadata, missing):
+            if meta is None:
+                continue
+            metadata[symbol] = meta
+            if meta[0] or meta[1]:  # empty answers are retried next run
+                cache[f"{symbol}:{month}"] = meta
+
+updates = []
+
+for symbol in symbols:
+    if symbol not in metadata:
         continue
 
-    industry = info.get("industry")
-    website = info.get("website")
-    ir_website = info.get("irWebsite") or info.get("website")  # fallback if IR not available
+    industry, website, ir_website = metadata[symbol]
 
     # skip if both industry & website still empty
     if not industry and not website:
         print(f"⚠️ No metadata found for {symbol}, skipping…")
 
     # get DB ids for this symbol
-    symbol_rows = df[df["symbol"] == symbol]
-
-    for _, r in symbol_rows.iterrows():
+    for row_id in ids_by_symbol[symbol]:
         updates.append({
-            "id": r["id"],
+            "id": row_id,
             "symbol": symbol,
             "industry": industry,
             "website": website,
             "ir_website": ir_website
         })
 
-    time.sleep(0.2)  # prevent Yahoo rate-limit
-
 print(f"📝 Prepared {len(updates)} updates.")
 
 # ---- 3) bulk upsert into DB ----
@@ -73,12 +145,17 @@ def chunks(lst, size):
     for i in range(0, len(lst), size):
         yield lst[i:i + size]
 
-for chunk in chunks(updates, BATCH_SIZE):
-    res = (
+def upsert_chunk(chunk):
+    (
         supabase.table(TABLE)
         .upsert(chunk, on_conflict="id", returning="minimal")
         .execute()
     )
     print(f"✅ Upserted {len(chunk)} rows")
 
+# Chunks touch disjoint ids, so they can be sent side by side over the
+# client's shared (thread-safe) HTTP connection pool
+with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as ex:
+    list(ex.map(upsert_chunk, chunks(updates, BATCH_SIZE)))
+
 print("🎉 Company metadata update complete!")
\ No newline at end of file
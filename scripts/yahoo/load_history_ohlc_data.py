@@ -1,42 +1,64 @@
 # pip install supabase yfinance pandas python-dateutil
 
 import yfinance as yf
+import io
 import os
 from supabase import create_client
 import pandas as pd
 from datetime import datetime
 import math
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psycopg2
+except ImportError:  # optional: only needed for the direct Postgres path (SUPABASE_DB_URL)
+    psycopg2 = None
 
 # DB CONFIG
 SUPABASE_URL = "your_supabase_url"
 SUPABASE_KEY = "your_supabase_key"
 TABLE = "stock_market_history"
-all_rows = []
-page = 0
-BATCH_SIZE = 1000  # tune by API limits
+PAGE_SIZE = 1000  # rows per select; Supabase caps responses at 1000 rows (max-rows)
+BATCH_SIZE = 5000  # rows per upsert request (~0.5 MB of JSON); tune by API limits
+PAGE_WORKERS = 8  # pages fetched concurrently
+UPSERT_WORKERS = 8  # upsert requests in flight at once
+# Optional direct Postgres connection string (Project Settings -> Database).
+# When set (and psycopg2 is installed) the updates are COPY'd in instead of sent over REST.
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
+STAGE_TABLE = "stock_market_history_ohlc_stage"
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-while True:
-    from_row = page * BATCH_SIZE
-    to_row = (page + 1) * BATCH_SIZE - 1
+def fetch_page(page):
+    from_row = page * PAGE_SIZE
+    to_row = (page + 1) * PAGE_SIZE - 1
 
     print(f"Fetching rows {from_row} -> {to_row} ...")
 
-    data = (
+    return (
         supabase.table(TABLE)
         .select("id, symbol, record_date")
         .is_("open_value", None)
+        .order("id")  # stable row order so concurrent ranges neither overlap nor skip
         .range(from_row, to_row)
         .execute()
         .data
-    )
-
-    if not data:
-        break
+    ) or []
+
+# Count the matching rows first, then fetch every page range concurrently
+total = (
+    supabase.table(TABLE)
+    .select("id", count="exact", head=True)
+    .is_("open_value", None)
+    .execute()
+    .count
+) or 0
+pages = math.ceil(total / PAGE_SIZE)
 
-    all_rows.extend(data)
-    page += 1
+all_rows = []
+with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as ex:
+    for data in ex.map(fetch_page, range(pages)):
+        all_rows.extend(data)
 
 if len(all_rows) == 0:
     print("No rows found.")
@@ -53,72 +75,106 @@ symbols = df['symbol'].unique()
 print(f"Total rows loaded: {len(df)}")
 print(f"Unique symbols to fetch: {len(symbols)}")
 
-updates = []
-
-# ---- STEP 2: Fetch Yahoo OHLC data per symbol ----
-for symbol in symbols:
-    symbol_rows = df[df['symbol'] == symbol].copy()
-
-    # Filter only rows having valid dates
-    symbol_rows = symbol_rows.dropna(subset=["record_date"])
-    if symbol_rows.empty:
-        print(f"Skipping {symbol}: no valid record_date")
-        continue
-
-    min_date = symbol_rows['record_date'].min()
-    max_date = symbol_rows['record_date'].max()
+# ---- STEP 2: Fetch Yahoo OHLC data for all symbols at once ----
+# Filter only rows having valid dates
+dated = df.dropna(subset=["record_date"])
+for symbol in sorted(set(symbols) - set(dated['symbol'])):
+    print(f"Skipping {symbol}: no valid record_date")
 
-    # If min or max is still NaT, skip
-    if pd.isna(min_date) or pd.isna(max_date):
-        print(f"Skipping {symbol}: min/max date is NaT")
-        continue
-
-    start = (min_date - pd.Timedelta(days=2)).strftime("%Y-%m-%d")
-    end = (max_date + pd.Timedelta(days=2)).strftime("%Y-%m-%d")
-    print(f"Fetching {symbol} from {start} to {end} ...")
+if dated.empty:
+    print("No rows with a valid record_date.")
+    raise SystemExit
 
-    ticker = yf.Ticker(symbol)
-    hist = ticker.history(start=start, end=end, interval="1d")[["Open", "High", "Low", "Close"]]
+# One window covering every symbol's rows, so a single batched download
+# (yfinance threads it internally) replaces one request per symbol
+start = (dated['record_date'].min() - pd.Timedelta(days=2)).strftime("%Y-%m-%d")
+end = (dated['record_date'].max() + pd.Timedelta(days=2)).strftime("%Y-%m-%d")
+fetch_symbols = list(dated['symbol'].unique())
+print(f"Fetching {len(fetch_symbols)} symbols from {start} to {end} ...")
+
+raw = yf.download(
+    fetch_symbols,
+    start=start,
+    end=end,
+    interval="1d",
+    group_by="ticker",
+    threads=True,
+    auto_adjust=True,
+    timeout=30,
+)
+
+# (Date, ticker) x field -> one long (record_date, symbol, OHLC) frame;
+# other symbols' trading days show up as all-NaN rows and are dropped
+ohlc = ['open_value', 'high_value', 'low_value', 'close_value']
+if isinstance(raw.columns, pd.MultiIndex) and not raw.empty:
+    hist = (
+        raw.stack(level=0, future_stack=True)[["Open", "High", "Low", "Close"]]
+        .dropna(how="all")
+        .rename_axis(['record_date', 'symbol'])
+        .reset_index()
+        .rename(columns={
+            "Open": "open_value",
+            "High": "high_value",
+            "Low": "low_value",
+            "Close": "close_value",
+        })
+    )
+    hist['record_date'] = pd.to_datetime(hist['record_date']).dt.tz_localize(None).dt.normalize()
+else:
+    hist = pd.DataFrame(columns=['record_date', 'symbol'] + ohlc)
 
-    if hist.empty:
+downloaded = set(hist['symbol'])
+for symbol in fetch_symbols:
+    if symbol not in downloaded:
         print(f"No Yahoo data for {symbol}, skipping...")
-        continue
-
-    hist = hist.reset_index()
-    hist['Date'] = pd.to_datetime(hist['Date']).dt.tz_localize(None).dt.normalize()
-    hist = hist.rename(columns={
-        "Open": "open_value",
-        "High": "high_value",
-        "Low": "low_value",
-        "Close": "close_value",
-    })
-
-    merged = symbol_rows.merge(
-        hist[['Date', 'open_value', 'high_value', 'low_value', 'close_value']],
-        left_on='record_date', right_on='Date', how='left'
-    )
 
-    for _, r in merged.iterrows():
-        if pd.isna(r['open_value']):
-            continue
-
-        updates.append({
-            "id": r['id'],
-            "symbol": r['symbol'],
-            "open_value": float(r['open_value']),
-            "high_value": float(r['high_value']),
-            "low_value": float(r['low_value']),
-            "close_value": float(r['close_value'])
-        })
+# One hash merge for every symbol; rows Yahoo had no bar for stay untouched
+merged = dated.merge(hist, on=['symbol', 'record_date'], how='inner')
+matched = merged.dropna(subset=['open_value']).astype({c: 'float64' for c in ohlc})
+updates = matched[['id', 'symbol'] + ohlc].to_dict('records')
 
 print(f"\n✅ Prepared {len(updates)} rows for update")
 
-# ---- STEP 3: Upsert in chunks ----
+# ---- STEP 3: Write the values back ----
+def update_postgres(frame):
+    """COPY the matched rows into a staging table, then update them by id in one statement."""
+    columns = ", ".join(frame.columns)
+    sets = ", ".join(f"{c} = s.{c}" for c in ohlc)
+    buf = io.StringIO()
+    frame.to_csv(buf, index=False, header=False, sep='\t')
+    buf.seek(0)
+    conn = psycopg2.connect(SUPABASE_DB_URL)
+    try:
+        with conn, conn.cursor() as cur:
+            # Same column types as the real table, without its constraints
+            cur.execute(
+                f"CREATE TEMP TABLE {STAGE_TABLE} ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {TABLE} WITH NO DATA"
+            )
+            cur.copy_expert(
+                f"COPY {STAGE_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t')",
+                buf
+            )
+            cur.execute(
+                f"UPDATE {TABLE} t SET {sets} FROM {STAGE_TABLE} s WHERE t.id = s.id"
+            )
+        print(f"⬆️ Updated {len(frame)} rows via Postgres")
+    finally:
+        conn.close()
+
+if SUPABASE_DB_URL and psycopg2 is not None and updates:
+    try:
+        update_postgres(matched[['id'] + ohlc])
+        print("\n🎯 Done! ✅")
+        raise SystemExit
+    except psycopg2.Error as e:
+        print(f"Postgres update error, falling back to REST: {e}")
+
 def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-for chunk in chunks(updates, BATCH_SIZE):
+def upsert_chunk(chunk):
     supabase.table(TABLE).upsert(
         chunk,
         on_conflict="id",
@@ -126,4 +182,9 @@ for chunk in chunks(updates, BATCH_SIZE):
     ).execute()
     print(f"⬆️ Upserted {len(chunk)} rows")
 
-print("\n🎯 Done! ✅")
\ No newline at end of file
+# Chunks touch disjoint ids, so they can be sent side by side over the
+# client's shared (thread-safe) HTTP connection pool
+with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as ex:
+    list(ex.map(upsert_chunk, chunks(updates, BATCH_SIZE)))
+
+print("\n🎯 Done! ✅")
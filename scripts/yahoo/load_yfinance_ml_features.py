@@ -1,13 +1,28 @@
 import yfinance as yf
 import pandas as pd
 
+try:
+    import polars as pl
+    import pyarrow  # noqa: F401  (pl.from_pandas needs it for the tz-aware Date index)
+except ImportError:  # optional Arrow-backed frames; pandas is the fallback
+    pl = None
+
 # ---  Load the ticker ---
 ticker = yf.Ticker("AAPL")
 
 # ---  Get OHLCV data (1 year, daily) ---
-ohlcv = ticker.history(period="1y", interval="1d")[["Open", "High", "Low", "Close", "Volume"]]
-ohlcv.reset_index(inplace=True)
-ohlcv["Symbol"] = "AAPL"
+history = ticker.history(period="1y", interval="1d")
+if pl is not None:
+    # One conversion to Arrow columns; everything after runs in Polars
+    ohlcv = (
+        pl.from_pandas(history.reset_index())
+        .select(["Date", "Open", "High", "Low", "Close", "Volume"])
+        .with_columns(pl.lit("AAPL").alias("Symbol"))
+    )
+else:
+    ohlcv = history[["Open", "High", "Low", "Close", "Volume"]]
+    ohlcv.reset_index(inplace=True)
+    ohlcv["Symbol"] = "AAPL"
 
 # ---  Get key fundamental and contextual data ---
 info = ticker.info
@@ -32,7 +47,7 @@ fundamentals = {
     "industry": info.get("industry")
 }
 
-fundamentals_df = pd.DataFrame([fundamentals])
+fundamentals_df = pl.DataFrame([fundamentals]) if pl is not None else pd.DataFrame([fundamentals])
 
 # ---  Display or store the results ---
 print("OHLCV (1 year):")